@@ -0,0 +1,158 @@
+"""Limite de concorrência adaptativo por servidor (AIMD e gradiente)."""
+
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from app.models.schemas import MCPServerConfig
+
+
+class AdaptiveLimit:
+    """Concurrency limit learned from call latency and errors.
+
+    Subclasses implement :meth:`_next_limit`; the limit stays within
+    ``[min_limit, max_limit]`` and every change of its integer value is
+    kept in ``history`` as ``(unix time, limit)``.
+    """
+
+    name = "adaptive"
+    HISTORY_SIZE = 50
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.history: Deque[Tuple[float, int]] = deque(maxlen=self.HISTORY_SIZE)
+        self.history.append((time.time(), self.limit))
+        self.samples_total = 0
+        self.drops_total = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def update(self, latency_ms: float, dropped: bool, in_flight: int) -> int:
+        """Feed one finished call and return the new limit.
+
+        ``dropped`` marks calls the server failed (timeouts, connection
+        errors, 5xx); ``in_flight`` is the number of calls in flight when
+        this one started.
+        """
+        self.samples_total += 1
+        self.drops_total += dropped
+        previous = self.limit
+        self._limit = min(self.max_limit, max(self.min_limit, self._next_limit(latency_ms, dropped, in_flight)))
+        if self.limit != previous:
+            self.history.append((time.time(), self.limit))
+        return self.limit
+
+    def _next_limit(self, latency_ms: float, dropped: bool, in_flight: int) -> float:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the current limit, its bounds and recent changes."""
+        return {
+            "algorithm": self.name,
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "samples_total": self.samples_total,
+            "drops_total": self.drops_total,
+            "history": [{"time": at, "limit": limit} for at, limit in self.history],
+        }
+
+
+class AIMDLimit(AdaptiveLimit):
+    """Additive increase, multiplicative decrease.
+
+    Each successful call while the limit is at least half used adds
+    ``1 / limit`` (about one per limit's worth of calls); a failed call,
+    or one slower than ``latency_threshold_ms``, multiplies the limit by
+    ``backoff``.
+    """
+
+    name = "aimd"
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        backoff: float = 0.9,
+        latency_threshold_ms: Optional[float] = None,
+    ):
+        super().__init__(initial, min_limit, max_limit)
+        self.backoff = backoff
+        self.latency_threshold_ms = latency_threshold_ms
+
+    def _next_limit(self, latency_ms: float, dropped: bool, in_flight: int) -> float:
+        if dropped or (self.latency_threshold_ms is not None and latency_ms > self.latency_threshold_ms):
+            return self._limit * self.backoff
+        if in_flight * 2 >= self._limit:
+            # só cresce quando o limite está de fato em uso
+            return self._limit + 1 / self._limit
+        return self._limit
+
+
+class GradientLimit(AdaptiveLimit):
+    """Vegas-style limit following the ratio of no-load to current latency.
+
+    ``baseline`` is the lowest latency seen (slowly drifting up, so a
+    permanent change of the server is eventually accepted) and
+    ``latency_ewma_ms`` the recent latency. The limit moves towards
+    ``limit × baseline / recent + √limit``: steady while latency stays at
+    the baseline (the square root leaves room to probe for capacity) and
+    shrinking as queueing at the server raises latency. Failed calls
+    halve the gradient.
+    """
+
+    name = "gradient"
+    # peso de cada amostra na latência recente e na suavização do limite
+    EWMA_ALPHA = 0.1
+    SMOOTHING = 0.2
+    # deriva do baseline por amostra (esquece mínimos antigos aos poucos)
+    BASELINE_DRIFT = 0.001
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int):
+        super().__init__(initial, min_limit, max_limit)
+        self.baseline_ms: Optional[float] = None
+        self.latency_ewma_ms: Optional[float] = None
+
+    def _next_limit(self, latency_ms: float, dropped: bool, in_flight: int) -> float:
+        latency_ms = max(latency_ms, 0.001)
+        if self.baseline_ms is None:
+            self.baseline_ms = self.latency_ewma_ms = latency_ms
+        else:
+            self.baseline_ms = min(latency_ms, self.baseline_ms * (1 + self.BASELINE_DRIFT))
+            self.latency_ewma_ms = (1 - self.EWMA_ALPHA) * self.latency_ewma_ms + self.EWMA_ALPHA * latency_ms
+
+        gradient = max(0.5, min(1.0, self.baseline_ms / self.latency_ewma_ms))
+        if dropped:
+            gradient = 0.5
+        if in_flight * 2 < self._limit and gradient == 1.0:
+            # limite ocioso: não há medida de que mais concorrência caberia
+            return self._limit
+        target = self._limit * gradient + math.sqrt(self._limit)
+        return (1 - self.SMOOTHING) * self._limit + self.SMOOTHING * target
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["baseline_ms"] = self.baseline_ms
+        stats["latency_ewma_ms"] = self.latency_ewma_ms
+        return stats
+
+
+def adaptive_limit(config: MCPServerConfig) -> Optional[AdaptiveLimit]:
+    """Build the adaptive limit a server is configured with (None when static)."""
+    initial = config.max_in_flight or config.adaptive_max_limit // 4
+    if config.adaptive_concurrency == "aimd":
+        return AIMDLimit(
+            initial,
+            config.adaptive_min_limit,
+            config.adaptive_max_limit,
+            latency_threshold_ms=config.degraded_latency_ms,
+        )
+    if config.adaptive_concurrency == "gradient":
+        return GradientLimit(initial, config.adaptive_min_limit, config.adaptive_max_limit)
+    return None
@@ -0,0 +1,139 @@
+"""Réplicas de um servidor MCP e balanceamento de carga entre elas."""
+
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from app.models.schemas import MCPServerConfig
+
+
+class Replica:
+    """One replica URL of a server, with its load, latency and health."""
+
+    # peso de cada chamada na média móvel (EWMA) de latência
+    EWMA_ALPHA = 0.2
+    # uma chamada que falhou pesa na EWMA como uma chamada lenta, nunca como uma rápida
+    FAILURE_PENALTY_MS = 1000.0
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.outstanding = 0
+        self.latency_ewma_ms: Optional[float] = None
+        self.requests_total = 0
+        self.failures_total = 0
+        self.consecutive_failures = 0
+        self.ejections = 0  # ejeções seguidas, sem sucesso entre elas
+        self.ejections_total = 0
+        self.ejected_until = 0.0
+
+    def available(self, now: float) -> bool:
+        """Return True when the replica is healthy and not ejected."""
+        return self.healthy and self.ejected_until <= now
+
+    def cost(self) -> float:
+        """Expected cost of one more request: EWMA latency scaled by the queue in front of it.
+
+        A replica without measurements costs nothing, so it is tried first.
+        """
+        return (self.latency_ewma_ms or 0.0) * (self.outstanding + 1)
+
+    def observe(self, latency_ms: float) -> None:
+        """Fold one latency sample into the EWMA."""
+        alpha = self.EWMA_ALPHA
+        self.latency_ewma_ms = (
+            latency_ms
+            if self.latency_ewma_ms is None
+            else (1 - alpha) * self.latency_ewma_ms + alpha * latency_ms
+        )
+
+    def stats(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """Return this replica's counters for /servers and the metrics endpoints."""
+        now = time.monotonic() if now is None else now
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "ejected": self.ejected_until > now,
+            "outstanding": self.outstanding,
+            "latency_ewma_ms": self.latency_ewma_ms,
+            "requests_total": self.requests_total,
+            "failures_total": self.failures_total,
+            "ejections_total": self.ejections_total,
+        }
+
+
+class ReplicaSet:
+    """The replicas of one server and the policy that picks one per call.
+
+    ``p2c`` (power of two choices) samples two available replicas and
+    takes the one with the lower EWMA latency × outstanding requests;
+    ``least_outstanding`` takes the replica with the fewest requests in
+    flight. A replica failing ``replica_eject_failures`` calls in a row is
+    ejected for ``replica_eject_seconds`` (doubling on repeated ejections)
+    and readmitted when that time passes; health probes separately take
+    unreachable replicas out of rotation. When no replica is available
+    every replica is eligible again, so a server is never made
+    unreachable by ejections alone.
+    """
+
+    def __init__(self, config: MCPServerConfig):
+        self.config = config
+        self.replicas = [Replica(url) for url in config.replica_urls()]
+
+    def pick(self, now: Optional[float] = None, exclude: Optional[str] = None) -> Replica:
+        """Choose the replica for the next call, avoiding the ``exclude`` URL when possible."""
+        now = time.monotonic() if now is None else now
+        candidates = [r for r in self.replicas if r.available(now)] or self.replicas
+        if exclude is not None and len(candidates) > 1:
+            candidates = [r for r in candidates if r.url != exclude] or candidates
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.config.load_balancing == "least_outstanding":
+            fewest = min(r.outstanding for r in candidates)
+            return random.choice([r for r in candidates if r.outstanding == fewest])
+        first, second = random.sample(candidates, 2)
+        return first if first.cost() <= second.cost() else second
+
+    def start(self, replica: Replica) -> None:
+        """Count a request sent to ``replica``."""
+        replica.outstanding += 1
+        replica.requests_total += 1
+
+    def finish(self, replica: Replica, success: bool, latency_ms: float) -> None:
+        """Record the outcome of a request, ejecting the replica after repeated failures."""
+        replica.outstanding = max(0, replica.outstanding - 1)
+        if success:
+            replica.consecutive_failures = 0
+            replica.ejections = 0
+            replica.observe(latency_ms)
+            return
+
+        # falhas rápidas (conexão recusada) não podem atrair mais tráfego
+        replica.observe(max(latency_ms, Replica.FAILURE_PENALTY_MS))
+        replica.failures_total += 1
+        replica.consecutive_failures += 1
+        if replica.consecutive_failures >= self.config.replica_eject_failures and len(self.replicas) > 1:
+            replica.ejections += 1
+            replica.ejections_total += 1
+            duration = self.config.replica_eject_seconds * 2 ** min(replica.ejections - 1, 4)
+            replica.ejected_until = time.monotonic() + duration
+            replica.consecutive_failures = 0
+            # readmitida sem histórico: volta a receber tráfego para ser medida de novo
+            replica.latency_ewma_ms = None
+
+    def cancel(self, replica: Replica) -> None:
+        """Free the slot of a request abandoned before it finished (e.g. a losing hedge)."""
+        replica.outstanding = max(0, replica.outstanding - 1)
+
+    def mark_health(self, replica: Replica, healthy: bool) -> None:
+        """Apply the result of an active health probe."""
+        replica.healthy = healthy
+
+    def primary(self) -> Replica:
+        """Return the first healthy replica (used for catalog fetches)."""
+        return next((r for r in self.replicas if r.healthy), self.replicas[0])
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return the counters of every replica."""
+        now = time.monotonic()
+        return [replica.stats(now) for replica in self.replicas]
@@ -0,0 +1,58 @@
+"""Orçamento de requisições extras (hedges, retries) por servidor."""
+
+import time
+from typing import Dict, Optional
+
+
+class RequestBudget:
+    """Cap extra requests to a fraction of the regular ones.
+
+    Every regular request deposits ``ratio`` tokens and every extra
+    request spends one, so over time extra requests stay at most
+    ``ratio`` of the traffic. The balance is capped at ``ratio ×
+    window`` tokens: a quiet period can bank at most ``window`` requests'
+    worth of extras, and an outage cannot multiply the load it sees.
+
+    ``min_per_second`` also refills the balance with time, so servers
+    with little traffic still get a few extra requests.
+    """
+
+    def __init__(self, ratio: float, window: int = 100, min_per_second: float = 0.0):
+        self.ratio = max(0.0, ratio)
+        self.min_per_second = max(0.0, min_per_second)
+        self.capacity = max(1.0, self.ratio * window, self.min_per_second)
+        self.balance = min(self.capacity, self.min_per_second)
+        self._refilled_at = time.monotonic()
+        self.requests = 0
+        self.spent = 0
+        self.denied = 0
+
+    def deposit(self) -> None:
+        """Record a regular request."""
+        self.requests += 1
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def try_spend(self, now: Optional[float] = None) -> bool:
+        """Take one extra request from the budget; False when it is exhausted."""
+        if self.min_per_second:
+            now = time.monotonic() if now is None else now
+            elapsed = max(0.0, now - self._refilled_at)
+            self.balance = min(self.capacity, self.balance + elapsed * self.min_per_second)
+            self._refilled_at = now
+        # tolerância: dez depósitos de 0.1 somam 0.999... em ponto flutuante
+        if self.balance >= 1.0 - 1e-9:
+            self.balance -= 1.0
+            self.spent += 1
+            return True
+        self.denied += 1
+        return False
+
+    def stats(self) -> Dict[str, float]:
+        """Return the budget counters."""
+        return {
+            "ratio": self.ratio,
+            "balance": self.balance,
+            "requests": self.requests,
+            "spent": self.spent,
+            "denied": self.denied,
+        }
@@ -0,0 +1,129 @@
+"""Bulkhead por servidor: limite de requisições simultâneas e fila de espera limitada."""
+
+import asyncio
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+
+class BulkheadRejected(Exception):
+    """A call was shed: the wait queue was full or the wait timed out."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Bulkhead:
+    """Cap the requests in flight to one server, with a bounded FIFO wait queue.
+
+    A call beyond ``limit`` waits in the queue for at most
+    ``queue_timeout`` seconds; when ``max_queue`` calls are already
+    waiting it is rejected at once, so a slow server can never pile up
+    unbounded work in the hub. A released slot goes straight to the
+    oldest waiter. ``limit`` may be changed at any time (``None`` means
+    unlimited); raising it admits waiters right away.
+    """
+
+    def __init__(self, limit: Optional[int], max_queue: int, queue_timeout: float):
+        self._limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted_total = 0
+        self.shed_total: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0}
+
+    @property
+    def limit(self) -> Optional[int]:
+        return self._limit
+
+    @limit.setter
+    def limit(self, value: Optional[int]) -> None:
+        self._limit = value
+        self._wake()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Seconds a shed client should wait before trying again."""
+        return max(1, math.ceil(self.queue_timeout))
+
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        """Take a slot, waiting in the queue up to ``queue_timeout`` (or ``timeout`` if shorter).
+
+        Raises :class:`BulkheadRejected` when the call is shed.
+        """
+        if self._has_room() and not self._waiters:
+            self._admit()
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.shed_total["queue_full"] += 1
+            raise BulkheadRejected("queue_full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        wait = self.queue_timeout if timeout is None else min(self.queue_timeout, max(0.0, timeout))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # a vaga chegou junto com o timeout/cancelamento: passa adiante
+                self.release()
+            else:
+                waiter.cancel()
+                self._discard(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.shed_total["queue_timeout"] += 1
+            raise BulkheadRejected("queue_timeout", self.retry_after()) from None
+
+    def release(self) -> None:
+        """Free a slot, handing it to the oldest waiter when there is one."""
+        self.in_flight = max(0, self.in_flight - 1)
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Hold a slot for the duration of a ``with`` block."""
+        await self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the bulkhead gauges and counters."""
+        return {
+            "limit": self._limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "admitted_total": self.admitted_total,
+            "shed_total": dict(self.shed_total),
+        }
+
+    def _has_room(self) -> bool:
+        return self._limit is None or self.in_flight < self._limit
+
+    def _admit(self) -> None:
+        self.in_flight += 1
+        self.admitted_total += 1
+
+    def _wake(self) -> None:
+        """Hand free slots to waiters, oldest first."""
+        while self._waiters and self._has_room():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._admit()
+                waiter.set_result(None)
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
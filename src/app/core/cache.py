@@ -0,0 +1,103 @@
+"""Cache de resultados de chamadas de ferramentas MCP."""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from app.models.schemas import ToolCallResponse
+
+
+def call_key(tool_full_name: str, arguments: Dict[str, Any]) -> str:
+    """Build a key from the tool name and a canonical hash of its arguments."""
+    canonical = json.dumps(arguments, sort_keys=True, separators=(",", ":"), default=str)
+    digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    return f"{tool_full_name}:{digest}"
+
+
+class ToolResultCache:
+    """Bounded LRU cache with per-entry TTL for successful tool call results."""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 300.0, enabled: bool = True):
+        self.enabled = enabled
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl)
+        # chave -> (expira_em, nome completo da ferramenta, resposta)
+        self._entries: "OrderedDict[str, Tuple[float, str, ToolCallResponse]]" = OrderedDict()
+        self._keys_by_tool: Dict[str, Set[str]] = defaultdict(set)
+        self._stats: Dict[str, int] = defaultdict(int)
+
+    make_key = staticmethod(call_key)
+
+    def get(self, key: str) -> Optional[ToolCallResponse]:
+        """Return a copy of a cached response, or None on miss/expiry."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+
+        expires_at, tool_full_name, response = entry
+        if expires_at <= time.monotonic():
+            self._remove(key, tool_full_name)
+            self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return response.model_copy(update={"cached": True})
+
+    def set(self, tool_full_name: str, key: str, response: ToolCallResponse) -> None:
+        """Store a successful response, evicting least recently used entries."""
+        if not response.success:
+            return
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self._entries[key] = (time.monotonic() + self.ttl, tool_full_name, response.model_copy())
+        self._keys_by_tool[tool_full_name].add(key)
+
+        while len(self._entries) > self.max_size:
+            old_key, (_, old_tool, _) = self._entries.popitem(last=False)
+            self._discard_tool_key(old_key, old_tool)
+            self._stats["evictions"] += 1
+
+    def invalidate_tool(self, tool_full_name: str) -> int:
+        """Drop every cached result for a tool and return how many were removed."""
+        keys = self._keys_by_tool.pop(tool_full_name, set())
+        for key in keys:
+            self._entries.pop(key, None)
+        self._stats["invalidations"] += len(keys)
+        return len(keys)
+
+    def clear(self) -> None:
+        """Remove all cached entries."""
+        self._entries.clear()
+        self._keys_by_tool.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache counters and sizing information."""
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self._stats["hits"],
+            "misses": self._stats["misses"],
+            "evictions": self._stats["evictions"],
+            "expirations": self._stats["expirations"],
+            "invalidations": self._stats["invalidations"],
+        }
+
+    def _remove(self, key: str, tool_full_name: str) -> None:
+        self._entries.pop(key, None)
+        self._discard_tool_key(key, tool_full_name)
+
+    def _discard_tool_key(self, key: str, tool_full_name: str) -> None:
+        keys = self._keys_by_tool.get(tool_full_name)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_tool[tool_full_name]
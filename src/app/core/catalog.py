@@ -0,0 +1,92 @@
+"""Snapshot pré-serializado do catálogo de ferramentas servido em /tools."""
+
+import gzip
+import hashlib
+from datetime import UTC, datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.models.schemas import ListToolsResponse, ToolSchema
+
+# corpos menores que isso não compensam a compressão
+GZIP_MIN_SIZE = 1024
+
+
+class CatalogView:
+    """One serialized ``ListToolsResponse`` body with its ETag and gzip variant."""
+
+    def __init__(self, body: bytes, compress: bool = True):
+        self.body = body
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_body: Optional[bytes] = None
+        self.gzip_etag: Optional[str] = None
+        if compress and len(body) >= GZIP_MIN_SIZE:
+            # mtime fixo: o mesmo catálogo gera sempre os mesmos bytes
+            self.gzip_body = gzip.compress(body, compresslevel=6, mtime=0)
+            self.gzip_etag = f'"{digest}-gz"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Return True when an ``If-None-Match`` header names this view."""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return self.etag in tags or (self.gzip_etag is not None and self.gzip_etag in tags)
+
+
+class CatalogSnapshot:
+    """Immutable, pre-serialized tool catalog: the full list plus one view per server.
+
+    A snapshot is built once per catalog version, so serving ``/tools``
+    only copies bytes that already exist. It is assembled from each
+    tool's JSON record, so tools that were never decoded (restored from
+    a snapshot file) are served as they are.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        records: List[Tuple[str, bytes]],
+        server_names: List[str],
+        servers_online: int,
+    ):
+        self.version = version
+        self.servers_online = servers_online
+        self.last_updated = datetime.now(UTC).isoformat()
+        self._full = self._assemble([record for _, record in records])
+
+        by_server: Dict[str, List[bytes]] = {name: [] for name in server_names}
+        for server_name, record in records:
+            by_server.setdefault(server_name, []).append(record)
+        self._views = {name: self._assemble(server_records) for name, server_records in by_server.items()}
+        self._empty: Optional[CatalogView] = None
+
+    def view(self, server_name: Optional[str] = None) -> CatalogView:
+        """Return the full catalog, or the view of one server (empty when unknown)."""
+        if not server_name:
+            return self._full
+        view = self._views.get(server_name)
+        if view is None:
+            if self._empty is None:
+                self._empty = self._assemble([])
+            view = self._empty
+        return view
+
+    def filtered(self, tools: List[ToolSchema]) -> CatalogView:
+        """Serialize an ad hoc selection of tools (not kept, not compressed)."""
+        return self._assemble([tool.model_dump_json().encode("utf-8") for tool in tools], compress=False)
+
+    def _assemble(self, records: List[bytes], compress: bool = True) -> CatalogView:
+        # o resto do corpo vem do próprio modelo; só a lista é colada a partir dos registros
+        envelope = ListToolsResponse(
+            tools=[],
+            total_count=len(records),
+            servers_online=self.servers_online,
+            last_updated=self.last_updated,
+        ).model_dump_json().encode("utf-8")
+        body = _TOOLS_PREFIX + b",".join(records) + envelope[len(_TOOLS_PREFIX):]
+        return CatalogView(body, compress=compress)
+
+
+_TOOLS_PREFIX = b'{"tools":['
@@ -0,0 +1,38 @@
+"""Janela de latências recentes para estimar percentis por ferramenta."""
+
+from collections import deque
+from typing import Deque, Optional
+
+
+class LatencyWindow:
+    """The last ``size`` latencies of one tool, with a cached percentile.
+
+    The sorted copy behind :meth:`percentile` is rebuilt at most once
+    every ``size // 10`` new samples, so reading it on every call costs
+    O(1) amortized.
+    """
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.min_samples = min_samples
+        self._sorted: list = []
+        self._stale = 0
+        self._refresh_every = max(1, size // 10)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def record(self, latency_ms: float) -> None:
+        """Add one latency sample."""
+        self.samples.append(latency_ms)
+        self._stale += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Return the ``p``-th percentile (0-100), or None with too few samples."""
+        if len(self.samples) < self.min_samples:
+            return None
+        if not self._sorted or self._stale >= self._refresh_every:
+            self._sorted = sorted(self.samples)
+            self._stale = 0
+        index = min(len(self._sorted) - 1, int(len(self._sorted) * p / 100))
+        return self._sorted[index]
@@ -0,0 +1,508 @@
+"""Transporte MCP nativo: sessões JSON-RPC 2.0 persistentes com os upstreams.
+
+Fala o transporte "streamable HTTP" do MCP (mensagens JSON-RPC por POST,
+respostas em JSON ou SSE, stream GET para os avisos do servidor) e o
+transporte SSE antigo (um stream de eventos e um endpoint para os POSTs).
+Uma sessão inicializada por réplica atende todas as chamadas a ela.
+"""
+
+import asyncio
+import functools
+import itertools
+import json
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+import structlog
+
+from app import __version__
+from app.core.pools import UpstreamPools, pool_key
+from app.models.schemas import MCPServerConfig
+
+logger = structlog.get_logger(__name__)
+
+PROTOCOL_VERSION = "2025-06-18"
+TOOLS_LIST_CHANGED = "notifications/tools/list_changed"
+# código JSON-RPC para requests do servidor que o hub não atende (roots, sampling...)
+METHOD_NOT_FOUND = -32601
+# espera inicial e máxima (segundos) antes de reabrir um stream de avisos que caiu
+STREAM_RETRY_INITIAL = 0.5
+STREAM_RETRY_MAX = 30.0
+
+
+class MCPError(Exception):
+    """A JSON-RPC error answer from an upstream."""
+
+    def __init__(self, code: int, message: str, data: Any = None):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+class SessionExpired(Exception):
+    """The upstream no longer knows a session (HTTP 404): a new one must be initialized."""
+
+    def __init__(self, session_id: Optional[str]):
+        super().__init__(f"MCP session expired: {session_id}")
+        self.session_id = session_id
+
+
+async def _sse_events(response: httpx.Response) -> AsyncIterator[Tuple[str, str]]:
+    """Yield the ``(event, data)`` pairs of a ``text/event-stream`` body."""
+    event, data = "message", []
+    async for line in response.aiter_lines():
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+        elif not line.startswith(":"):
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+    if data:
+        yield event, "\n".join(data)
+
+
+class MCPSession:
+    """An initialized MCP session with one upstream, shared by every request to it.
+
+    Each request gets its own JSON-RPC id and waits for the answer with
+    that id, whichever stream brings it (the JSON or SSE body of its own
+    POST, the standalone event stream, or with the ``sse`` transport the
+    single event stream), so any number of calls run concurrently over
+    the same pooled connections. The session is initialized on first
+    use, and again when the upstream forgets it (404) or, with ``sse``,
+    when the event stream drops. Notifications from the server go to
+    ``on_notification(method, params)``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        transport: str,
+        client: httpx.AsyncClient,
+        timeout: float,
+        on_notification: Callable[[str, Dict[str, Any]], None],
+    ):
+        self.name = name
+        self.url = url
+        self.transport = transport
+        self.client = client
+        self.timeout = timeout
+        self._on_notification = on_notification
+        self._ids = itertools.count(1)
+        self._pending: Dict[Any, asyncio.Future] = {}
+        self._ready: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Task] = set()
+        # transporte sse: URL dos POSTs, anunciada pelo evento "endpoint"
+        self._endpoint: Optional[asyncio.Future] = None
+        self._post_url = url
+        self._closed = False
+        self.session_id: Optional[str] = None
+        self.protocol_version = PROTOCOL_VERSION
+        self.capabilities: Dict[str, Any] = {}
+        self.server_info: Dict[str, Any] = {}
+        self.streaming = False
+        self.initializations = 0
+        self.requests_total = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Number of requests waiting for their answer."""
+        return len(self._pending)
+
+    @property
+    def watches_tools(self) -> bool:
+        """True when the upstream announces tool list changes and the event stream is kept open."""
+        listening = self._listener is not None and not self._listener.done()
+        return listening and bool((self.capabilities.get("tools") or {}).get("listChanged"))
+
+    async def request(
+        self, method: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Send a request and return its result, initializing the session first when needed.
+
+        Raises :class:`MCPError` for an error answer, ``asyncio.TimeoutError``
+        when no answer arrives within ``timeout`` seconds (the upstream is
+        then told the request was cancelled) and ``httpx.HTTPError`` for
+        transport failures.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = asyncio.get_running_loop().time() + timeout
+        await asyncio.wait_for(self._ensure_ready(), timeout)
+        try:
+            return await self._call(method, params, self._left(deadline))
+        except SessionExpired as e:
+            # só quem viu o 404 da sessão atual a descarta: as outras chamadas esperam a nova
+            if e.session_id == self.session_id:
+                self._expire()
+            await asyncio.wait_for(self._ensure_ready(), self._left(deadline))
+            return await self._call(method, params, self._left(deadline))
+
+    def _left(self, deadline: float) -> float:
+        return max(0.0, deadline - asyncio.get_running_loop().time())
+
+    def _ensure_ready(self) -> "asyncio.Future[None]":
+        if self._closed:
+            raise httpx.ConnectError(f"MCP session closed: {self.url}")
+        ready = self._ready
+        if ready is None or (ready.done() and (ready.cancelled() or ready.exception() is not None)):
+            ready = self._ready = asyncio.create_task(self._initialize())
+        # quem desiste de esperar não cancela a inicialização que os outros aguardam
+        return asyncio.shield(ready)
+
+    async def _initialize(self) -> None:
+        try:
+            if self.transport == "sse":
+                self._endpoint = asyncio.get_running_loop().create_future()
+                self._start_listener()
+                self._post_url = await asyncio.wait_for(asyncio.shield(self._endpoint), self.timeout)
+            result = await self._call(
+                "initialize",
+                {
+                    "protocolVersion": PROTOCOL_VERSION,
+                    "capabilities": {},
+                    "clientInfo": {"name": "mcp-one", "version": __version__},
+                },
+                self.timeout,
+            )
+            self.protocol_version = result.get("protocolVersion") or PROTOCOL_VERSION
+            self.capabilities = result.get("capabilities") or {}
+            self.server_info = result.get("serverInfo") or {}
+            await self._post({"jsonrpc": "2.0", "method": "notifications/initialized"}, self.timeout)
+        except BaseException:
+            if self.transport == "sse":
+                self._stop_listener()
+            raise
+        self.initializations += 1
+        if self.transport == "streamable_http":
+            self._start_listener()
+        logger.info(
+            "mcp_session_initialized",
+            server_name=self.name,
+            url=self.url,
+            protocol_version=self.protocol_version,
+            list_changed=bool((self.capabilities.get("tools") or {}).get("listChanged")),
+        )
+        if self.initializations > 1:
+            # avisos enviados enquanto não havia sessão se perderam: a lista pode ter mudado
+            self._notify(TOOLS_LIST_CHANGED, {})
+
+    async def _call(self, method: str, params: Optional[Dict[str, Any]], timeout: float) -> Dict[str, Any]:
+        request_id = next(self._ids)
+        message: Dict[str, Any] = {"jsonrpc": "2.0", "id": request_id, "method": method}
+        if params is not None:
+            message["params"] = params
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self.requests_total += 1
+        try:
+            answer = await asyncio.wait_for(self._exchange(message, future, timeout), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if method != "initialize":
+                # ninguém espera mais a resposta: o upstream pode parar o trabalho
+                self._spawn(self._post(
+                    {
+                        "jsonrpc": "2.0",
+                        "method": "notifications/cancelled",
+                        "params": {"requestId": request_id, "reason": "client gave up"},
+                    },
+                    self.timeout,
+                ))
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+        if "error" in answer:
+            error = answer["error"] or {}
+            raise MCPError(error.get("code", 0), error.get("message", ""), error.get("data"))
+        return answer.get("result") or {}
+
+    async def _exchange(self, message: Dict[str, Any], future: asyncio.Future, timeout: float) -> Dict[str, Any]:
+        await self._post(message, timeout, future)
+        return await future
+
+    async def _post(
+        self, message: Dict[str, Any], timeout: float, future: Optional[asyncio.Future] = None
+    ) -> None:
+        """POST one message; answers carried by the HTTP response are dispatched."""
+        headers = {"Accept": "application/json, text/event-stream"}
+        session_id = self.session_id
+        if self.transport == "streamable_http":
+            if session_id:
+                headers["Mcp-Session-Id"] = session_id
+            if message.get("method") != "initialize":
+                headers["MCP-Protocol-Version"] = self.protocol_version
+        async with self.client.stream(
+            "POST", self._post_url, json=message, headers=headers, timeout=timeout
+        ) as response:
+            if response.status_code == 404 and session_id:
+                raise SessionExpired(session_id)
+            if response.status_code >= 400:
+                await response.aread()
+                response.raise_for_status()
+            if message.get("method") == "initialize" and response.headers.get("mcp-session-id"):
+                self.session_id = response.headers["mcp-session-id"]
+            content_type = response.headers.get("content-type", "")
+            if content_type.startswith("text/event-stream"):
+                async for event, data in _sse_events(response):
+                    if event == "message":
+                        self._dispatch_data(data)
+                    if future is not None and future.done():
+                        # o resto do stream só diria respeito a este request
+                        break
+            elif content_type.startswith("application/json"):
+                self._dispatch_data(await response.aread())
+
+    def _dispatch_data(self, data: Any) -> None:
+        try:
+            message = json.loads(data)
+        except ValueError:
+            logger.warning("mcp_invalid_message", server_name=self.name, url=self.url)
+            return
+        for item in message if isinstance(message, list) else [message]:
+            self._dispatch(item)
+
+    def _dispatch(self, message: Any) -> None:
+        """Route one incoming message: an answer to its caller, a request or notification to its handler."""
+        if not isinstance(message, dict):
+            return
+        if "method" in message:
+            if "id" in message:
+                self._spawn(self._answer(message))
+            else:
+                self._notify(message["method"], message.get("params") or {})
+            return
+        future = self._pending.get(message.get("id"))
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    async def _answer(self, request: Dict[str, Any]) -> None:
+        """Reply to a request from the server (only ``ping`` is supported)."""
+        if request["method"] == "ping":
+            reply: Dict[str, Any] = {"jsonrpc": "2.0", "id": request["id"], "result": {}}
+        else:
+            # o hub não oferece roots, sampling nem elicitation
+            reply = {
+                "jsonrpc": "2.0",
+                "id": request["id"],
+                "error": {"code": METHOD_NOT_FOUND, "message": f"method not supported: {request['method']}"},
+            }
+        await self._post(reply, self.timeout)
+
+    def _notify(self, method: str, params: Dict[str, Any]) -> None:
+        try:
+            self._on_notification(method, params)
+        except Exception as e:
+            logger.error("mcp_notification_handler_failed", server_name=self.name, method=method, error=str(e))
+
+    def _spawn(self, coroutine: Any) -> None:
+        task = asyncio.get_running_loop().create_task(self._quietly(coroutine))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _quietly(self, coroutine: Any) -> None:
+        try:
+            await coroutine
+        except (httpx.HTTPError, SessionExpired, MCPError) as e:
+            logger.debug("mcp_background_send_failed", server_name=self.name, error=str(e))
+
+    def _start_listener(self) -> None:
+        if self._closed:
+            return
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    def _stop_listener(self) -> None:
+        if self._listener is not None and self._listener is not asyncio.current_task():
+            self._listener.cancel()
+        self._listener = None
+        self.streaming = False
+
+    async def _listen(self) -> None:
+        """Keep the server-to-client event stream open, reopening it when it drops.
+
+        With ``streamable_http`` a server without a standalone stream (405)
+        only sends notifications along with answers. With ``sse`` the
+        session lives on the stream, so losing it fails pending requests
+        and expires the session.
+        """
+        delay = STREAM_RETRY_INITIAL
+        opened = False
+        while not self._closed:
+            headers = {"Accept": "text/event-stream"}
+            session_id = self.session_id
+            if self.transport == "streamable_http":
+                if session_id:
+                    headers["Mcp-Session-Id"] = session_id
+                headers["MCP-Protocol-Version"] = self.protocol_version
+            try:
+                async with self.client.stream(
+                    "GET", self.url, headers=headers, timeout=httpx.Timeout(self.timeout, read=None)
+                ) as response:
+                    if self.transport == "streamable_http" and response.status_code == 405:
+                        logger.info("mcp_stream_unsupported", server_name=self.name, url=self.url)
+                        # sem stream os avisos podem não chegar: quem depende deles volta a consultar
+                        self._notify(TOOLS_LIST_CHANGED, {})
+                        return
+                    if self.transport == "streamable_http" and response.status_code == 404 and session_id:
+                        if session_id == self.session_id:
+                            self._expire()
+                        return
+                    if response.status_code >= 400:
+                        await response.aread()
+                        response.raise_for_status()
+                    self.streaming = True
+                    delay = STREAM_RETRY_INITIAL
+                    if opened:
+                        # avisos enviados com o stream fechado se perderam
+                        self._notify(TOOLS_LIST_CHANGED, {})
+                    opened = True
+                    async for event, data in _sse_events(response):
+                        if event == "endpoint" and self._endpoint is not None and not self._endpoint.done():
+                            self._endpoint.set_result(str(httpx.URL(self.url).join(data)))
+                        elif event == "message":
+                            self._dispatch_data(data)
+            except httpx.HTTPError as e:
+                logger.warning("mcp_stream_failed", server_name=self.name, url=self.url, error=str(e))
+            finally:
+                self.streaming = False
+            if self.transport == "sse":
+                self._expire(httpx.ReadError(f"MCP event stream closed: {self.url}"))
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STREAM_RETRY_MAX)
+
+    def _expire(self, error: Optional[BaseException] = None) -> None:
+        """Forget the session so the next request initializes a new one."""
+        self.session_id = None
+        self.capabilities = {}
+        self._ready = None
+        if self._endpoint is not None and not self._endpoint.done():
+            self._endpoint.set_exception(error or httpx.ReadError(f"MCP event stream closed: {self.url}"))
+        self._stop_listener()
+        if error is not None:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    async def close(self) -> None:
+        """End the session: stop its streams, fail what is pending and tell the upstream."""
+        self._closed = True
+        session_id = self.session_id
+        if self._ready is not None and not self._ready.done():
+            self._ready.cancel()
+        self._expire(httpx.ReadError(f"MCP session closed: {self.url}"))
+        for task in list(self._background):
+            task.cancel()
+        if session_id and self.transport == "streamable_http":
+            try:
+                await self.client.delete(
+                    self.url,
+                    headers={"Mcp-Session-Id": session_id, "MCP-Protocol-Version": self.protocol_version},
+                    timeout=self.timeout,
+                )
+            except httpx.HTTPError:
+                pass
+
+    async def close_when_idle(self, poll_interval: float = 0.1) -> None:
+        """Close the session once the requests already sent have their answers."""
+        if self.transport == "streamable_http":
+            # sem novos avisos; as respostas vêm no corpo de cada POST
+            self._stop_listener()
+        while self._pending:
+            await asyncio.sleep(poll_interval)
+        await self.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the session's state and request counters."""
+        return {
+            "url": self.url,
+            "transport": self.transport,
+            "initialized": self.session_id is not None or (self._ready is not None and self._ready.done()),
+            "protocol_version": self.protocol_version,
+            "streaming": self.streaming,
+            "watches_tools": self.watches_tools,
+            "in_flight": self.in_flight,
+            "requests_total": self.requests_total,
+            "initializations": self.initializations,
+        }
+
+
+class MCPSessions:
+    """The MCP sessions of the hub: one per server replica, created on first use.
+
+    Sessions use the same connection pools as everything else. A session
+    is replaced when its server's transport, pool or timeout changes; the
+    old one is closed once its pending requests are answered.
+    """
+
+    DRAIN_POLL_INTERVAL = 0.1
+
+    def __init__(self, pools: UpstreamPools, on_notification: Callable[[str, str, Dict[str, Any]], None]):
+        self.pools = pools
+        self._on_notification = on_notification
+        self._sessions: Dict[Tuple[str, str], MCPSession] = {}
+        self._settings: Dict[Tuple[str, str], Tuple[Any, ...]] = {}
+        # sessões substituídas ou de servidores removidos, esperando as respostas pendentes
+        self._closing: Dict[asyncio.Task, MCPSession] = {}
+
+    def session_for(self, config: MCPServerConfig, url: Optional[str] = None) -> MCPSession:
+        """Return the session with a server (or one of its replicas, given its URL)."""
+        url = url or config.replica_urls()[0]
+        key = (config.name, url)
+        settings = (config.transport, pool_key(config, url), float(config.timeout))
+        session = self._sessions.get(key)
+        if session is not None and self._settings[key] == settings:
+            return session
+        if session is not None:
+            self._retire(session)
+        session = self._sessions[key] = MCPSession(
+            config.name,
+            url,
+            config.transport,
+            self.pools.client_for(config, url),
+            float(config.timeout),
+            functools.partial(self._on_notification, config.name),
+        )
+        self._settings[key] = settings
+        return session
+
+    def watches_tools(self, config: MCPServerConfig, url: Optional[str] = None) -> bool:
+        """True when the session with a server will announce changes to its tool list."""
+        session = self._sessions.get((config.name, url or config.replica_urls()[0]))
+        return session is not None and session.watches_tools
+
+    def discard_server(self, server_name: str) -> None:
+        """Drop a server's sessions, closing each once its pending requests are answered."""
+        for key in [key for key in self._sessions if key[0] == server_name]:
+            self._settings.pop(key, None)
+            self._retire(self._sessions.pop(key))
+
+    def _retire(self, session: MCPSession) -> None:
+        task = asyncio.get_running_loop().create_task(session.close_when_idle(self.DRAIN_POLL_INTERVAL))
+        self._closing[task] = session
+        task.add_done_callback(lambda done: self._closing.pop(done, None))
+
+    def stats(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Return the sessions of every server."""
+        stats: Dict[str, List[Dict[str, Any]]] = {}
+        for (server_name, _), session in self._sessions.items():
+            stats.setdefault(server_name, []).append(session.stats())
+        return stats
+
+    async def aclose(self) -> None:
+        """Close every session, including the ones still draining."""
+        for task, session in list(self._closing.items()):
+            task.cancel()
+            await session.close()
+        self._closing.clear()
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+        self._settings.clear()
@@ -0,0 +1,354 @@
+"""Métricas com labels: contadores e histogramas de buckets fixos.
+
+Os mesmos objetos alimentam o JSON de ``/metrics`` e o texto de
+``/metrics/prometheus``. Os valores são por processo; com vários workers
+cada um exporta as suas séries e quem responde soma todas (``merge``).
+"""
+
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# buckets de latência (segundos), do cache local a upstreams lentos
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# valor que substitui labels limitados quando uma métrica atinge o máximo de séries
+OVERFLOW_LABEL = "__other__"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Series of one metric, keyed by label values, with a cardinality guard.
+
+    Once ``max_series`` series exist, new label sets have their
+    ``bounded`` labels (e.g. ``tool``) replaced by ``__other__``, so an
+    unbounded label can never grow memory or scrape size without limit.
+    """
+
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Iterable[str] = (),
+        bounded: Iterable[str] = (),
+        max_series: int = 2000,
+    ):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._bounded = [i for i, label in enumerate(self.labelnames) if label in set(bounded)]
+        self.max_series = max_series
+        self.overflowed_total = 0
+        self._series: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        if key in self._series or len(self._series) < self.max_series or not self._bounded:
+            return key
+        self.overflowed_total += 1
+        folded = list(key)
+        for index in self._bounded:
+            folded[index] = OVERFLOW_LABEL
+        return tuple(folded)
+
+    def clear(self) -> None:
+        self._series.clear()
+
+    def raw_series(self) -> List[List[Any]]:
+        return [[list(key), value] for key, value in self._series.items()]
+
+    def absorb(self, key: Tuple[str, ...], value: Any) -> None:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic counter with labels."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Add ``amount`` to the series of ``labels``."""
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._series.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0)
+
+    def absorb(self, key: Tuple[str, ...], value: float) -> None:
+        """Add another process's value of one series."""
+        self._series[key] = self._series.get(key, 0) + value
+
+    def samples(self) -> List[Dict[str, Any]]:
+        return [
+            {"labels": dict(zip(self.labelnames, key)), "value": value}
+            for key, value in self._series.items()
+        ]
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._series.items()
+        ]
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram with labels (cumulative buckets only at render time)."""
+
+    kind = "histogram"
+
+    def __init__(self, *args: Any, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record one observation in the series of ``labels``."""
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # [contagem por bucket (+Inf no fim), soma, total]
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def absorb(self, key: Tuple[str, ...], value: List[Any]) -> None:
+        """Add another process's buckets, sum and count of one series."""
+        counts, value_sum, total = value
+        series = self._series.get(key)
+        if series is None:
+            self._series[key] = [list(counts), value_sum, total]
+            return
+        series[0] = [a + b for a, b in zip(series[0], counts)]
+        series[1] += value_sum
+        series[2] += total
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(tuple(str(labels.get(n, "")) for n in self.labelnames))
+        return series[2] if series else 0
+
+    def _cumulative(self, counts: List[int]) -> List[Tuple[float, int]]:
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def samples(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "labels": dict(zip(self.labelnames, key)),
+                "count": total,
+                "sum": value_sum,
+                "buckets": {_format_value(bound): count for bound, count in self._cumulative(counts)},
+            }
+            for key, (counts, value_sum, total) in self._series.items()
+        ]
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, value_sum, total) in self._series.items():
+            for bound, count in self._cumulative(counts):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {value_sum:g}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class MetricsRegistry:
+    """The labeled metrics of the hub, rendered as JSON or Prometheus text."""
+
+    def __init__(self, max_series: int = 2000):
+        self.max_series = max_series
+        self._metrics: Dict[str, _Metric] = {}
+
+    def counter(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Iterable[str] = (),
+        bounded: Iterable[str] = (),
+    ) -> Counter:
+        """Return the counter ``name``, creating it on first use."""
+        return self._get(Counter, name, help_text, labelnames, bounded)
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Iterable[str] = (),
+        bounded: Iterable[str] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """Return the histogram ``name``, creating it on first use."""
+        return self._get(Histogram, name, help_text, labelnames, bounded, buckets=buckets)
+
+    def set_max_series(self, max_series: int) -> None:
+        """Change the series limit of every metric."""
+        self.max_series = max_series
+        for metric in self._metrics.values():
+            metric.max_series = max_series
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return every metric with its series, for the JSON endpoint."""
+        return {
+            name: {
+                "type": metric.kind,
+                "help": metric.help,
+                "series": metric.samples(),
+                "overflowed_total": metric.overflowed_total,
+            }
+            for name, metric in self._metrics.items()
+        }
+
+    def render_prometheus(self) -> List[str]:
+        """Return the Prometheus text exposition lines of every metric."""
+        lines: List[str] = []
+        for name, metric in self._metrics.items():
+            lines += [f"# HELP {name} {metric.help}", f"# TYPE {name} {metric.kind}"]
+            lines += metric.render()
+        overflowed = [(name, m.overflowed_total) for name, m in self._metrics.items() if m.overflowed_total]
+        if overflowed:
+            lines += [
+                "# HELP mcp_one_metric_series_overflowed_total Observations folded into __other__ by the series limit",
+                "# TYPE mcp_one_metric_series_overflowed_total counter",
+            ]
+            lines += [
+                f'mcp_one_metric_series_overflowed_total{{metric="{name}"}} {count}'
+                for name, count in overflowed
+            ]
+        return lines
+
+    def export(self) -> Dict[str, Any]:
+        """Return the raw series of every metric (JSON-serializable), for :meth:`merge`."""
+        return {
+            name: {
+                "type": metric.kind,
+                "help": metric.help,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "overflowed_total": metric.overflowed_total,
+                "series": metric.raw_series(),
+            }
+            for name, metric in self._metrics.items()
+        }
+
+    def merge(self, exported: Dict[str, Any]) -> None:
+        """Add the series exported by another registry (e.g. another worker) to this one."""
+        for name, data in exported.items():
+            if data["type"] == Histogram.kind:
+                metric = self.histogram(name, data["help"], data["labelnames"], buckets=tuple(data["buckets"]))
+            else:
+                metric = self.counter(name, data["help"], data["labelnames"])
+            metric.overflowed_total += data["overflowed_total"]
+            for key, value in data["series"]:
+                metric.absorb(tuple(key), value)
+
+    def clear(self) -> None:
+        """Drop every series (metrics stay registered)."""
+        for metric in self._metrics.values():
+            metric.clear()
+            metric.overflowed_total = 0
+
+    def _get(
+        self,
+        cls: type,
+        name: str,
+        help_text: str,
+        labelnames: Iterable[str],
+        bounded: Iterable[str],
+        **kwargs: Any,
+    ) -> Any:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(
+                name, help_text, labelnames, bounded=bounded, max_series=self.max_series, **kwargs
+            )
+        elif not isinstance(metric, cls):
+            raise ValueError(f"metric {name} already registered as {metric.kind}")
+        return metric
+
+
+# métricas do processo (registry, router e endpoints)
+METRICS = MetricsRegistry()
+
+
+class HubMetrics:
+    """The metrics the hub records, declared once."""
+
+    def __init__(self, registry: MetricsRegistry = METRICS):
+        self.registry = registry
+        self.tool_calls = registry.counter(
+            "mcp_one_tool_calls_total",
+            "Tool calls by server, tool and result (ok or error code)",
+            ("server", "tool", "result"),
+            bounded=("tool",),
+        )
+        self.call_duration = registry.histogram(
+            "mcp_one_tool_call_duration_seconds",
+            "End-to-end tool call latency in the hub",
+            ("server", "tool"),
+            bounded=("tool",),
+        )
+        self.upstream_duration = registry.histogram(
+            "mcp_one_upstream_request_duration_seconds",
+            "Latency of each HTTP request to an upstream call endpoint",
+            ("server", "result"),
+        )
+        self.hub_overhead = registry.histogram(
+            "mcp_one_hub_overhead_seconds",
+            "Time a tool call spent in the hub outside upstream requests",
+            ("server",),
+        )
+        self.probe_duration = registry.histogram(
+            "mcp_one_health_probe_duration_seconds",
+            "Latency of upstream health probes",
+            ("server", "result"),
+        )
+        self.refresh_duration = registry.histogram(
+            "mcp_one_catalog_refresh_duration_seconds",
+            "Duration of upstream tool list refreshes",
+            ("server", "result"),
+        )
+
+
+def error_code(error: Optional[str]) -> str:
+    """Reduce a call error to a bounded label value."""
+    if not error:
+        return "ok"
+    if error.startswith(("http_error_", "mcp_error_")) or error in _KNOWN_ERRORS:
+        return error
+    # mensagens de exceção (conexão recusada, DNS...) variam demais para virar label
+    return "connection_error"
+
+
+_KNOWN_ERRORS = frozenset({
+    "tool_not_found",
+    "server_not_found",
+    "server_offline",
+    "circuit_open",
+    "timeout",
+    "deadline_exceeded",
+    "server_overloaded",
+    "execution_failed",
+    "tool_error",
+})
@@ -0,0 +1,250 @@
+"""Pools de conexões HTTP por upstream, compartilhados entre registry e router."""
+
+import asyncio
+import importlib.util
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+import httpx
+import structlog
+
+from app.models.schemas import MCPServerConfig
+
+logger = structlog.get_logger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# streams simultâneos por conexão HTTP/2 (valor usual de SETTINGS_MAX_CONCURRENT_STREAMS)
+HTTP2_STREAMS_PER_CONNECTION = 100
+
+
+def pool_origin(config: MCPServerConfig, url: Optional[str] = None) -> str:
+    """Return the origin (scheme://host:port) whose connections a server (or one of its replicas) uses."""
+    url = httpx.URL(url or str(config.url))
+    port = url.port or (443 if url.scheme == "https" else 80)
+    return f"{url.scheme}://{url.host}:{port}"
+
+
+def pool_profile(config: MCPServerConfig) -> str:
+    """Return a compact label for a server's pool settings."""
+    return (
+        f"c{config.max_connections}-k{config.max_keepalive_connections}"
+        f"-e{config.keepalive_expiry:g}-{'h2' if config.http2 else 'h1'}"
+    )
+
+
+def pool_key(config: MCPServerConfig, url: Optional[str] = None) -> str:
+    """Return the pool a server uses: servers share one only with the same origin and settings."""
+    return f"{pool_origin(config, url)} {pool_profile(config)}"
+
+
+def request_timeout(config: MCPServerConfig, remaining: Optional[float] = None) -> httpx.Timeout:
+    """Build the per-request timeout for a server (separate connect and read limits).
+
+    ``remaining`` (seconds left before the caller's deadline) caps every limit.
+    """
+    timeout = float(config.timeout)
+    connect = float(config.connect_timeout)
+    read = float(config.read_timeout if config.read_timeout is not None else config.timeout)
+    if remaining is not None:
+        remaining = max(remaining, 0.001)
+        timeout, connect, read = min(timeout, remaining), min(connect, remaining), min(read, remaining)
+    return httpx.Timeout(timeout, connect=connect, read=read)
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response stream that frees its pool slot once the body is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            # corpo lido até o fim: a conexão já está livre
+            self.release()
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self.release()
+
+    def release(self) -> None:
+        """Free the pool slot (only the first call has an effect)."""
+        if not self._released:
+            self._released = True
+            self._release()
+
+
+class MeteredTransport(httpx.AsyncBaseTransport):
+    """Transport wrapper that bounds concurrent requests and measures pool waits.
+
+    A slot is held from the moment a request is sent until its response
+    body is fully read or closed, mirroring how long the underlying
+    connection is busy, so ``in_flight / max_concurrent`` is the pool
+    utilization and the time spent waiting for a slot is the pool wait
+    time. With HTTP/2 several requests share a connection, so
+    ``max_concurrent`` is the number of streams rather than connections.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_connections: int, max_concurrent: int = 0):
+        self._transport = transport
+        self.max_connections = max_connections
+        self.max_concurrent = max_concurrent or max_connections
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests_total = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - started
+        self.wait_seconds_total += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.requests_total += 1
+        self.in_flight += 1
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._release()
+            raise
+        stream = _ReleasingStream(response.stream, self._release)
+        response.stream = stream
+        if response.is_closed:
+            # resposta já lida pelo transporte (ex.: MockTransport): ninguém vai fechá-la de novo
+            stream.release()
+        return response
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._slots.release()
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class UpstreamPools:
+    """One HTTP client (and connection pool) per upstream origin and pool settings.
+
+    The registry and the router obtain clients here, so health checks and
+    tool calls to the same host reuse the same connections, while a slow
+    host can only exhaust its own pool. Servers on the same host with
+    different pool settings get separate pools, so each server's settings
+    are always honoured.
+    """
+
+    # intervalo (segundos) entre verificações de um pool aposentado esperando esvaziar
+    DRAIN_POLL_INTERVAL = 0.1
+
+    def __init__(self) -> None:
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, MeteredTransport] = {}
+        self._http2: Dict[str, bool] = {}
+        self._labels: Dict[str, Dict[str, str]] = {}
+        # pools aposentados que ainda têm requisições em andamento
+        self._draining: Dict[asyncio.Task, httpx.AsyncClient] = {}
+
+    def client_for(self, config: MCPServerConfig, url: Optional[str] = None) -> httpx.AsyncClient:
+        """Return the client for a server's pool (or a replica's, given its URL), creating it on first use."""
+        key = pool_key(config, url)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        http2 = config.http2 and HTTP2_AVAILABLE
+        if config.http2 and not HTTP2_AVAILABLE:
+            logger.warning("http2_unavailable", server_name=config.name, hint="pip install h2")
+
+        limits = httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=min(config.max_keepalive_connections, config.max_connections),
+            keepalive_expiry=config.keepalive_expiry,
+        )
+        transport = MeteredTransport(
+            httpx.AsyncHTTPTransport(limits=limits, http2=http2),
+            max_connections=config.max_connections,
+            max_concurrent=config.max_connections * (HTTP2_STREAMS_PER_CONNECTION if http2 else 1),
+        )
+        client = httpx.AsyncClient(transport=transport, timeout=request_timeout(config))
+        self._clients[key] = client
+        self._transports[key] = transport
+        self._http2[key] = http2
+        self._labels[key] = {"pool": pool_origin(config, url), "profile": pool_profile(config)}
+
+        logger.info(
+            "upstream_pool_created",
+            pool=key,
+            server_name=config.name,
+            max_connections=config.max_connections,
+            http2=http2,
+        )
+        return client
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return utilization and wait statistics for every pool."""
+        return [
+            {
+                **self._labels[key],
+                "http2": self._http2[key],
+                "max_connections": transport.max_connections,
+                "max_concurrent": transport.max_concurrent,
+                "in_flight": transport.in_flight,
+                "waiting": transport.waiting,
+                "utilization": transport.in_flight / transport.max_concurrent,
+                "requests_total": transport.requests_total,
+                "wait_seconds_total": transport.wait_seconds_total,
+                "max_wait_seconds": transport.max_wait_seconds,
+            }
+            for key, transport in self._transports.items()
+        ]
+
+    def retire_unused(self, configs: Iterable[MCPServerConfig]) -> List[str]:
+        """Stop handing out the pools none of ``configs`` uses, closing each once idle.
+
+        Requests already running on a retired pool finish on it; its
+        client is closed after the last one returns. Returns the retired
+        pool keys.
+        """
+        in_use = {pool_key(config, url) for config in configs for url in config.replica_urls()}
+        retired = [key for key in self._clients if key not in in_use]
+        for key in retired:
+            client = self._clients.pop(key)
+            transport = self._transports.pop(key)
+            self._http2.pop(key, None)
+            self._labels.pop(key, None)
+            task = asyncio.create_task(self._close_when_idle(client, transport))
+            self._draining[task] = client
+            task.add_done_callback(lambda done: self._draining.pop(done, None))
+            logger.info("upstream_pool_retired", pool=key, in_flight=transport.in_flight)
+        return retired
+
+    async def _close_when_idle(self, client: httpx.AsyncClient, transport: MeteredTransport) -> None:
+        while transport.in_flight or transport.waiting:
+            await asyncio.sleep(self.DRAIN_POLL_INTERVAL)
+        await client.aclose()
+
+    async def aclose(self) -> None:
+        """Close every client and its connections (retired ones too, even if busy)."""
+        for task, client in list(self._draining.items()):
+            task.cancel()
+            await client.aclose()
+        self._draining.clear()
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        self._transports.clear()
+        self._http2.clear()
+        self._labels.clear()
@@ -0,0 +1,53 @@
+"""Profiler por amostragem da thread do event loop, em formato de pilhas colapsadas."""
+
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import List, Optional
+
+
+class SamplingProfiler:
+    """Sample the stack of one thread at a fixed interval.
+
+    The result is in the collapsed-stack format read by ``flamegraph.pl``,
+    speedscope and similar tools: one line per distinct stack, frames
+    from the outermost in, separated by ``;``, then the sample count.
+    Samples are taken from another thread, so the profiled event loop
+    keeps serving requests and pays only the cost of
+    ``sys._current_frames``.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005, max_depth: int = 128):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+
+    def run(self, duration: float, stop: Optional[threading.Event] = None) -> None:
+        """Sample for ``duration`` seconds (blocking: run it in a worker thread)."""
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline and not (stop and stop.is_set()):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.samples[self._stack(frame)] += 1
+            self.sample_count += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        """Return the samples as collapsed stacks, most frequent first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def _stack(self, frame: Optional[FrameType]) -> str:
+        frames: List[str] = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            module = frame.f_globals.get("__name__", "?")
+            name = getattr(code, "co_qualname", code.co_name)
+            # ";" separa frames e o espaço separa a contagem: não podem aparecer nos nomes
+            frames.append(f"{module}:{name}".replace(";", ":").replace(" ", "_"))
+            frame = frame.f_back
+        return ";".join(reversed(frames))
@@ -0,0 +1,93 @@
+"""Rate limiting por cliente com token bucket."""
+
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+
+
+class RateLimitDecision(NamedTuple):
+    """Outcome of a rate limit check for one request.
+
+    ``limit`` is the bucket capacity (the burst size), the unit in which
+    ``remaining`` and ``reset_after`` are expressed.
+    """
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float
+    reset_after: float
+
+    def headers(self) -> Dict[str, str]:
+        """Return the ``X-RateLimit-*`` (and ``Retry-After``) headers for this decision."""
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+class TokenBucketLimiter:
+    """Token bucket limiter with O(1) state per key and a bounded key table.
+
+    Each key refills at ``requests_per_minute / 60`` tokens per second up to
+    ``burst_size`` tokens. A bucket that has been idle long enough to refill
+    completely is indistinguishable from a new one, so idle keys are evicted
+    from the LRU table without changing any decision.
+    """
+
+    def __init__(self, requests_per_minute: int, burst_size: Optional[int] = None, max_keys: int = 10000):
+        self.limit = max(1, int(requests_per_minute))
+        self.capacity = float(max(1, int(burst_size or requests_per_minute)))
+        self.rate = self.limit / 60.0
+        self.max_keys = max(1, int(max_keys))
+        # chave -> [tokens, atualizado_em]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: str, now: Optional[float] = None, cost: int = 1) -> RateLimitDecision:
+        """Try to take ``cost`` tokens for ``key``.
+
+        A request costing more than the bucket holds is admitted only when
+        the bucket is full and leaves it in debt, so large requests are
+        still charged in full before the key can send again.
+        """
+        now = time.monotonic() if now is None else now
+        self._evict_idle(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.capacity, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        needed = min(float(cost), self.capacity)
+        allowed = bucket[0] >= needed
+        if allowed:
+            bucket[0] -= cost
+
+        tokens = bucket[0]
+        return RateLimitDecision(
+            allowed=allowed,
+            limit=int(self.capacity),
+            remaining=max(0, int(tokens)),
+            retry_after=0.0 if allowed else (needed - tokens) / self.rate,
+            reset_after=(self.capacity - tokens) / self.rate,
+        )
+
+    def _evict_idle(self, now: float) -> None:
+        """Drop least recently used keys whose buckets are already full again."""
+        while self._buckets:
+            _, (tokens, updated_at) = next(iter(self._buckets.items()))
+            if tokens + (now - updated_at) * self.rate < self.capacity:
+                break
+            self._buckets.popitem(last=False)
@@ -1,12 +1,31 @@
 """Registry para gerenciar servidores MCP."""
 
 import asyncio
+import bisect
+import hashlib
+import json
+import os
+import random
 import time
+from collections import defaultdict
 from datetime import UTC, datetime
-from typing import Dict, List, Optional, Set
-import httpx
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from httpx import HTTPStatusError, RequestError
 import structlog
+from app.core.balancer import ReplicaSet
+from app.core.catalog import CatalogSnapshot
+from app.core.mcp_session import TOOLS_LIST_CHANGED, MCPSessions
+from app.core.metrics import HubMetrics
+from app.core.pools import UpstreamPools, request_timeout
+from app.core.search import ToolSearchIndex
+from app.core.snapshot import (
+    SnapshotError,
+    SnapshotReader,
+    ToolMap,
+    config_digest,
+    encode_snapshot,
+    write_snapshot,
+)
 from app.models.schemas import (
     MCPServerConfig,
     MCPServerInfo,
@@ -19,33 +38,248 @@ logger = structlog.get_logger(__name__)
 
 class MCPRegistry:
     """Maintain MCP server registrations, status, and tool catalogs."""
+
+    # peso de cada chamada nas médias móveis (EWMA) de erro e latência
+    PASSIVE_EWMA_ALPHA = 0.1
+
+    # refresh que muda mais ferramentas que isso reconstrói o índice de busca numa thread
+    SEARCH_REBUILD_THRESHOLD = 500
     
-    def __init__(self):
+    # espera depois de uma mudança antes de gravar o snapshot (agrupa refreshes seguidos)
+    PERSIST_DELAY = 1.0
+
+    # campos que mudam de onde vem o catálogo ou como as chamadas chegam ao upstream
+    UPSTREAM_FIELDS = ("url", "replicas", "transport", "endpoints", "response_map", "payload_map", "enabled")
+    
+    def __init__(
+        self,
+        max_concurrent_probes: int = 10,
+        metrics: Optional[HubMetrics] = None,
+        snapshot_path: Optional[str] = None,
+    ):
+        self.metrics = metrics or HubMetrics()
         self.servers: Dict[str, MCPServerInfo] = {}
-        self.tools: Dict[str, ToolSchema] = {} 
+        # ferramentas restauradas de um snapshot só são decodificadas quando usadas
+        self.tools: ToolMap = ToolMap()
         self.server_tools: Dict[str, Set[str]] = {}  
-        self._client = httpx.AsyncClient(timeout=30.0)
+        # índices secundários: nomes completos ordenados (prefixo), por tag e servidores online
+        self._sorted_names: List[str] = []
+        self._tools_by_tag: Dict[str, Set[str]] = defaultdict(set)
+        self._online: Set[str] = set()
+        # busca: atualizada por ferramenta ou reconstruída fora do event loop
+        self.search_index = ToolSearchIndex()
+        self._search_lock = asyncio.Lock()
+        self._search_building = False
+        self._search_stale = False
+        self._search_dirty: Set[str] = set()
+        self.pools = UpstreamPools()
+        # sessões MCP persistentes (transport != "rest"), sobre os mesmos pools
+        self.sessions = MCPSessions(self.pools, self._on_mcp_notification)
         self._refresh_task: Optional[asyncio.Task] = None
+        # agendador: próximo health check / catálogo por servidor (time.monotonic)
+        self._probe_slots = asyncio.Semaphore(max(1, max_concurrent_probes))
+        self._next_probe: Dict[str, float] = {}
+        self._next_tools: Dict[str, float] = {}
+        self._probing: Dict[str, asyncio.Task] = {}
+        # servidores que avisaram (tools/list_changed) que a lista de ferramentas mudou
+        self._tools_changed: Set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._replicas: Dict[str, ReplicaSet] = {}
+        # última chamada real bem-sucedida por servidor (time.monotonic)
+        self._last_call_success: Dict[str, float] = {}
         self._shutdown = False
+        self._tool_removed_listeners: List[Callable[[str], None]] = []
+        self._server_removed_listeners: List[Callable[[str], None]] = []
+        # muda a cada recarga da configuração que altera algum servidor
+        self.config_version = 0
+        # versão do catálogo: muda só quando o conjunto de ferramentas muda de fato
+        self.catalog_version = 0
+        self._catalog: Optional[CatalogSnapshot] = None
+        # validadores (ETag/Last-Modified) e hash do último catálogo aplicado, por servidor
+        self._tools_validators: Dict[str, Dict[str, str]] = {}
+        self._tools_digests: Dict[str, str] = {}
+        self._refresh_stats: Dict[str, Dict[str, Any]] = {}
+        self._refresh_totals: Dict[str, int] = defaultdict(int)
+        # progresso do primeiro probe de cada servidor (readiness)
+        self._warmup: Dict[str, Dict[str, Any]] = {}
+        # hash das ferramentas de cada servidor no último snapshot carregado
+        self._snapshot_digests: Dict[str, str] = {}
+        # snapshot em disco para reinícios a quente (None: desligado)
+        self.snapshot_path = snapshot_path
+        self._persist_task: Optional[asyncio.Task] = None
+        self._persist_dirty = False
+        self._search_task: Optional[asyncio.Task] = None
+
+    def invalidate_catalog(self) -> None:
+        """Mark the tool catalog as changed so the next snapshot is rebuilt."""
+        self.catalog_version += 1
+        self._schedule_persist()
+
+    def catalog_snapshot(self) -> CatalogSnapshot:
+        """Return the serialized catalog, rebuilding it only after a change."""
+        online = self.servers_online
+        snapshot = self._catalog
+        if (
+            snapshot is None
+            or snapshot.version != self.catalog_version
+            or snapshot.servers_online != online
+        ):
+            snapshot = self._catalog = CatalogSnapshot(
+                self.catalog_version,
+                [(server_name, record) for server_name, _, record in self.tools.records()],
+                list(self.servers.keys()),
+                online,
+            )
+            logger.debug("catalog_snapshot_built", version=snapshot.version, tools=len(self.tools))
+        return snapshot
+
+    @property
+    def servers_online(self) -> int:
+        """Number of servers currently accepting calls (ONLINE or DEGRADED)."""
+        return len(self._online)
+
+    @property
+    def tools_count(self) -> int:
+        """Number of tools in the catalog."""
+        return len(self.tools)
+
+    def _set_status(self, server_info: MCPServerInfo, status: ServerStatus) -> None:
+        """Change a server's status, keeping the online index up to date."""
+        if status != server_info.status:
+            self._schedule_persist()
+        server_info.status = status
+        if server_info.available:
+            self._online.add(server_info.config.name)
+        else:
+            self._online.discard(server_info.config.name)
+
+    def _put_tool(self, schema: ToolSchema) -> None:
+        """Add or replace a tool in the catalog and its indexes."""
+        previous = self.tools.get(schema.full_name)
+        if previous is None:
+            bisect.insort(self._sorted_names, schema.full_name)
+        else:
+            self._unindex_tags(previous)
+        self.tools[schema.full_name] = schema
+        for tag in schema.tags:
+            self._tools_by_tag[tag].add(schema.full_name)
+        self._search_touch(schema.full_name)
+
+    def _drop_tool(self, full_name: str) -> None:
+        """Remove a tool from the catalog and its indexes."""
+        schema = self.tools.pop(full_name, None)
+        if schema is None:
+            return
+        position = bisect.bisect_left(self._sorted_names, full_name)
+        if position < len(self._sorted_names) and self._sorted_names[position] == full_name:
+            del self._sorted_names[position]
+        self._unindex_tags(schema)
+        self._search_touch(full_name)
+
+    def _search_touch(self, full_name: str) -> None:
+        """Bring one tool of the search index up to date with the catalog."""
+        if self._search_building:
+            # reaplicado sobre o índice novo quando a reconstrução terminar
+            self._search_dirty.add(full_name)
+        elif not self._search_stale:
+            tool = self.tools.get(full_name)
+            if tool is None:
+                self.search_index.remove(full_name)
+            else:
+                self.search_index.add(tool)
+
+    async def rebuild_search_index(self) -> None:
+        """Rebuild the search index in a worker thread and swap it in.
+
+        Queries keep using the previous index meanwhile; catalog changes
+        made during the rebuild are replayed on the new index.
+        """
+        async with self._search_lock:
+            self._search_dirty = set()
+            self._search_building = True
+            started = time.perf_counter()
+            try:
+                load_tools = self.tools.loader()
+                index = await asyncio.to_thread(lambda: ToolSearchIndex.build(load_tools()))
+            finally:
+                self._search_building = False
+            for full_name in self._search_dirty:
+                tool = self.tools.get(full_name)
+                if tool is None:
+                    index.remove(full_name)
+                else:
+                    index.add(tool)
+            self._search_dirty = set()
+            self.search_index = index
+            self._search_stale = False
+            logger.info(
+                "search_index_rebuilt",
+                tools=len(index),
+                duration_ms=(time.perf_counter() - started) * 1000,
+            )
+
+    async def search_tools(self, query: str, k: int = 10) -> List[Tuple[ToolSchema, float]]:
+        """Return the ``k`` tools best matching ``query`` with their BM25 scores."""
+        return [
+            (self.tools[name], score)
+            for name, score in self.search_index.search(query, k)
+            if name in self.tools
+        ]
+
+    def _unindex_tags(self, schema: ToolSchema) -> None:
+        for tag in schema.tags:
+            names = self._tools_by_tag.get(tag)
+            if names is not None:
+                names.discard(schema.full_name)
+                if not names:
+                    del self._tools_by_tag[tag]
+
+    def _names_with_prefix(self, prefix: str) -> List[str]:
+        """Return the full names starting with ``prefix``, in order (binary search)."""
+        start = bisect.bisect_left(self._sorted_names, prefix)
+        end = start
+        while end < len(self._sorted_names) and self._sorted_names[end].startswith(prefix):
+            end += 1
+        return self._sorted_names[start:end]
+
+    def add_tool_removed_listener(self, listener: Callable[[str], None]) -> None:
+        """Register a callback invoked with the full name of every removed tool."""
+        self._tool_removed_listeners.append(listener)
+
+    def add_server_removed_listener(self, listener: Callable[[str], None]) -> None:
+        """Register a callback invoked with the name of every unregistered server."""
+        self._server_removed_listeners.append(listener)
+
+    def _notify_tools_removed(self, full_names: Set[str]) -> None:
+        """Inform listeners that tools disappeared from the catalog."""
+        for full_name in full_names:
+            for listener in self._tool_removed_listeners:
+                try:
+                    listener(full_name)
+                except Exception as e:
+                    logger.error("tool_removed_listener_failed", tool=full_name, error=str(e))
         
-    async def register_server(self, config: MCPServerConfig) -> bool:
-        """Register a server and perform initial health/tool discovery."""
+    async def register_server(self, config: MCPServerConfig, probe: bool = True) -> bool:
+        """Register a server and perform initial health/tool discovery.
+
+        With ``probe=False`` the server stays CONNECTING until a snapshot
+        or a later probe brings its status (used by follower workers).
+        """
+        # configuração nova pode mapear o catálogo de outro jeito: não reaproveita o último
+        self._forget_catalog_state(config.name)
         try:
             server_info = MCPServerInfo(
                 config=config,
                 status=ServerStatus.CONNECTING
             )
             self.servers[config.name] = server_info
+            self._online.discard(config.name)
+            self._warmup.pop(config.name, None)
+            if not probe:
+                return True
             
             # Tenta conectar imediatamente
-            await self._check_server_health(config.name)
-            
-            logger.info(
-                "server_registered",
-                server_name=config.name,
-                url=str(config.url),
-                status=server_info.status
-            )
+            await self._initial_probe(config.name)
             return True
             
         except Exception as e:
@@ -55,6 +289,148 @@ class MCPRegistry:
                 error=str(e)
             )
             return False
+
+    async def register_servers(
+        self,
+        configs: List[MCPServerConfig],
+        timeout: Optional[float] = None,
+        probe: bool = True,
+    ) -> int:
+        """Register servers and probe them all concurrently, waiting at most ``timeout`` seconds.
+
+        Probes still running at the deadline go on in the background
+        (their progress is in :meth:`warmup_stats`). Returns how many
+        servers are still warming up.
+        """
+        for config in configs:
+            await self.register_server(config, probe=False)
+        if not probe:
+            return 0
+        # o catálogo da execução anterior responde enquanto os servidores são sondados
+        await self.restore_snapshot()
+        tasks = self._start_warmup([config.name for config in configs])
+        if not tasks:
+            return 0
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning("servers_still_warming_up", pending=len(pending), timeout=timeout)
+        return len(pending)
+
+    def _start_warmup(self, server_names: List[str]) -> List[asyncio.Task]:
+        """Start the first probe of each server in the background."""
+        tasks = []
+        for server_name in server_names:
+            # o agendador não sonda servidores em _probing: o primeiro probe é este
+            task = self._probing[server_name] = asyncio.create_task(self._initial_probe(server_name))
+            tasks.append(task)
+        return tasks
+
+    async def update_servers(self, configs: List[MCPServerConfig], probe: bool = True) -> Dict[str, List[str]]:
+        """Apply a new server list, touching only the servers whose configuration changed.
+
+        Servers missing from ``configs`` are unregistered (calls already
+        running against them finish normally), new ones are registered
+        and probed in the background, and changed ones get the new
+        configuration in place: their tools, cache and connection pools
+        stay unless the change affects where they come from. Returns the
+        names that were added, removed, updated and left unchanged.
+        """
+        wanted = {config.name: config for config in configs}
+        result: Dict[str, List[str]] = {"added": [], "removed": [], "updated": [], "unchanged": []}
+        for server_name in list(self.servers):
+            if server_name not in wanted:
+                await self.unregister_server(server_name)
+                result["removed"].append(server_name)
+        for server_name, config in wanted.items():
+            server_info = self.servers.get(server_name)
+            if server_info is None:
+                await self.register_server(config, probe=False)
+                result["added"].append(server_name)
+            elif server_info.config == config:
+                result["unchanged"].append(server_name)
+            else:
+                self._reconfigure_server(server_info, config)
+                result["updated"].append(server_name)
+        if probe:
+            self._start_warmup(result["added"])
+        # pools que só servidores removidos ou reconfigurados usavam fecham depois de esvaziar
+        self.pools.retire_unused(server_info.config for server_info in self.servers.values())
+        if result["added"] or result["removed"] or result["updated"]:
+            self.config_version += 1
+            self._schedule_persist()
+        logger.info("servers_updated", **{key: len(names) for key, names in result.items()})
+        return result
+
+    def _reconfigure_server(self, server_info: MCPServerInfo, config: MCPServerConfig) -> None:
+        """Swap a registered server's configuration, keeping its tools and health state."""
+        server_name = config.name
+        previous = server_info.config
+        # chamadas em andamento seguem com a configuração que já têm
+        server_info.config = config
+        now = time.monotonic()
+        if any(getattr(previous, field) != getattr(config, field) for field in self.UPSTREAM_FIELDS):
+            # outro upstream ou outro mapeamento: as ferramentas atuais respondem até o
+            # refresh, que recarrega o catálogo sem validadores; resultados em cache caem já
+            self._forget_catalog_state(server_name)
+            self._notify_tools_removed({f"{server_name}.{t}" for t in self.server_tools.get(server_name, ())})
+            server_info.stale = True
+            self.sessions.discard_server(server_name)
+            probing = self._probing.pop(server_name, None)
+            if probing is not None:
+                # probe em andamento usa a configuração antiga: o agendador começa outro
+                probing.cancel()
+            self._next_probe[server_name] = now
+            self._next_tools[server_name] = now
+        else:
+            # intervalos menores valem já; maiores, a partir do próximo probe
+            if server_name in self._next_probe:
+                self._next_probe[server_name] = min(self._next_probe[server_name], now + config.health_interval)
+            if server_name in self._next_tools:
+                self._next_tools[server_name] = min(
+                    self._next_tools[server_name], now + config.tools_refresh_interval
+                )
+        logger.info("server_reconfigured", server_name=server_name)
+
+    async def _initial_probe(self, server_name: str) -> None:
+        """First health check and tool discovery of a newly registered server."""
+        started = time.monotonic()
+        self._warmup[server_name] = {"state": "probing", "started": started, "duration_ms": None}
+        try:
+            async with self._probe_slots:
+                await self._check_server_health(server_name)
+            self._schedule_after_probe(server_name, refreshed_tools=True)
+            server_info = self.servers.get(server_name)
+            if server_info is not None:
+                logger.info(
+                    "server_registered",
+                    server_name=server_name,
+                    url=str(server_info.config.url),
+                    status=server_info.status
+                )
+        except Exception as e:
+            logger.error("server_registration_failed", server_name=server_name, error=str(e))
+        finally:
+            warmup = self._warmup.get(server_name)
+            if warmup is not None and warmup["started"] == started:
+                warmup["state"] = "done"
+                warmup["duration_ms"] = (time.monotonic() - started) * 1000
+            if self._probing.get(server_name) is asyncio.current_task():
+                self._probing.pop(server_name, None)
+
+    def warmup_stats(self) -> Dict[str, Any]:
+        """Return how many servers finished their first probe, and each server's progress."""
+        servers = {}
+        for name, server_info in self.servers.items():
+            warmup = self._warmup.get(name, {"state": "pending", "duration_ms": None})
+            servers[name] = {
+                "state": warmup["state"],
+                "status": server_info.status,
+                "tools_count": server_info.tools_count,
+                "stale": server_info.stale,
+                "duration_ms": warmup["duration_ms"],
+            }
+        done = sum(1 for server in servers.values() if server["state"] == "done")
+        return {"done": done, "total": len(servers), "servers": servers}
     
     async def unregister_server(self, server_name: str) -> bool:
         """Unregister a server and remove all its indexed tools."""
@@ -63,17 +439,54 @@ class MCPRegistry:
             
         # Remove ferramentas do servidor
         if server_name in self.server_tools:
+            removed = set()
             for tool_name in self.server_tools[server_name]:
                 full_name = f"{server_name}.{tool_name}"
-                self.tools.pop(full_name, None)
+                self._drop_tool(full_name)
+                removed.add(full_name)
             del self.server_tools[server_name]
+            self._notify_tools_removed(removed)
         
         # Remove servidor
         del self.servers[server_name]
+        probing = self._probing.pop(server_name, None)
+        if probing is not None and probing is not asyncio.current_task():
+            # um probe atrasado não pode trazer de volta as ferramentas do servidor
+            probing.cancel()
+        self._online.discard(server_name)
+        self._next_probe.pop(server_name, None)
+        self._next_tools.pop(server_name, None)
+        self._last_call_success.pop(server_name, None)
+        self._replicas.pop(server_name, None)
+        self._warmup.pop(server_name, None)
+        self._tools_changed.discard(server_name)
+        self.sessions.discard_server(server_name)
+        self._forget_catalog_state(server_name)
+        self._refresh_stats.pop(server_name, None)
+        self.invalidate_catalog()
+        for listener in self._server_removed_listeners:
+            try:
+                listener(server_name)
+            except Exception as e:
+                logger.error("server_removed_listener_failed", server_name=server_name, error=str(e))
         
         logger.info("server_unregistered", server_name=server_name)
         return True
     
+    def replicas_for(self, server_name: str) -> Optional[ReplicaSet]:
+        """Return the replica set of a registered server (rebuilt if its config changed)."""
+        server_info = self.servers.get(server_name)
+        if server_info is None:
+            return None
+        replicas = self._replicas.get(server_name)
+        if replicas is None or replicas.config is not server_info.config:
+            replicas = self._replicas[server_name] = ReplicaSet(server_info.config)
+        return replicas
+
+    def replica_stats(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Return per-replica load, latency and health for every server."""
+        return {name: self.replicas_for(name).stats() for name in self.servers}
+
     async def get_server_info(self, server_name: str) -> Optional[MCPServerInfo]:
         """Return metadata for a registered server by name."""
         return self.servers.get(server_name)
@@ -86,21 +499,41 @@ class MCPRegistry:
         """Return a tool schema by its fully qualified name."""
         return self.tools.get(tool_full_name)
     
-    async def list_tools(self, server_name: Optional[str] = None) -> List[ToolSchema]:
-        """List tool schemas, optionally filtered by server."""
+    async def list_tools(
+        self,
+        server_name: Optional[str] = None,
+        prefix: Optional[str] = None,
+        tag: Optional[str] = None,
+    ) -> List[ToolSchema]:
+        """List tool schemas, optionally filtered by server, full-name prefix and tag.
+
+        Candidates come from the most selective index, so the cost grows
+        with the size of the result rather than of the catalog. Filtered
+        results are ordered by full name.
+        """
+        if not (server_name or prefix or tag):
+            return list(self.tools.values())
+
+        candidates: List[Set[str]] = []
         if server_name:
-            return [
-                tool for tool in self.tools.values()
-                if tool.server_name == server_name
-            ]
-        return list(self.tools.values())
+            candidates.append({f"{server_name}.{t}" for t in self.server_tools.get(server_name, ())})
+        if tag:
+            candidates.append(self._tools_by_tag.get(tag, set()))
+        if prefix:
+            candidates.append(set(self._names_with_prefix(prefix)))
+
+        smallest = min(candidates, key=len)
+        names = smallest.intersection(*[c for c in candidates if c is not smallest])
+        return [self.tools[name] for name in sorted(names) if name in self.tools]
     
     async def refresh_all_servers(self) -> None:
-        """Refresh health and tool catalogs for all servers."""
-        tasks = [
-            self._check_server_health(server_name)
-            for server_name in self.servers.keys()
-        ]
+        """Refresh health and tool catalogs for all servers (at most ``max_concurrent_probes`` at once)."""
+        async def refresh(server_name: str) -> None:
+            async with self._probe_slots:
+                await self._check_server_health(server_name)
+            self._schedule_after_probe(server_name, refreshed_tools=True)
+
+        tasks = [refresh(server_name) for server_name in list(self.servers.keys())]
         
         if tasks:
             await asyncio.gather(*tasks, return_exceptions=True)
@@ -108,30 +541,74 @@ class MCPRegistry:
         logger.info(
             "servers_refreshed",
             total_servers=len(self.servers),
-            online_servers=len([s for s in self.servers.values() if s.status == ServerStatus.ONLINE])
+            online_servers=self.servers_online
         )
     
-    async def _check_server_health(self, server_name: str) -> None:
-        """Update health state for a server and refresh its tools when online."""
+    async def _check_server_health(self, server_name: str, refresh_tools: bool = True) -> None:
+        """Update health state for a server and, if asked, refresh its tools when online."""
         server_info = self.servers.get(server_name)
         if not server_info:
             return
             
         config = server_info.config
         if not config.enabled:
-            server_info.status = ServerStatus.OFFLINE
+            self._set_status(server_info, ServerStatus.OFFLINE)
             return
             
+        replicas = self.replicas_for(server_name)
+        results = await asyncio.gather(
+            *(self._probe_replica(config, replica.url) for replica in replicas.replicas)
+        )
+        errors = []
+        for replica, (healthy, detail) in zip(replicas.replicas, results):
+            replicas.mark_health(replica, healthy)
+            if not healthy:
+                errors.append(detail if len(replicas.replicas) == 1 else f"{replica.url}: {detail}")
+
+        response_times = [detail for healthy, detail in results if healthy]
+        if response_times:
+            # basta uma réplica respondendo para o servidor aceitar chamadas
+            if not server_info.available:
+                # servidor voltou: as medidas passivas antigas não valem mais
+                server_info.error_rate = 0.0
+                server_info.consecutive_call_failures = 0
+            self._set_status(server_info, self._passive_status(server_info))
+            server_info.response_time_ms = min(response_times)
+            server_info.last_seen = datetime.now(UTC).isoformat()
+            server_info.error_message = "; ".join(errors) or None
+
+            # Atualiza ferramentas
+            if refresh_tools:
+                await self._refresh_server_tools(server_name)
+        else:
+            self._set_status(server_info, ServerStatus.ERROR)
+            server_info.error_message = "; ".join(errors)
+            logger.warning(
+                "server_health_check_failed",
+                server_name=server_name,
+                error=server_info.error_message
+            )
+
+    async def _probe_replica(self, config: MCPServerConfig, base_url: str) -> Tuple[bool, Any]:
+        """Probe one replica's health endpoint.
+
+        Returns ``(True, response_time_ms)`` or ``(False, error message)``.
+        """
         start_time = time.time()
-        
+        health_endpoint = config.endpoints.get("health", "/health")
         try:
-            endpoints = config.endpoints
-            health_endpoint = endpoints.get("health", "/health")
-            base_url = str(config.url).rstrip("/")
+            if config.transport != "rest":
+                # ping na sessão persistente: sem conexão nem handshake novos a cada probe
+                await self.sessions.session_for(config, base_url).request("ping", timeout=float(config.timeout))
+                self.metrics.probe_duration.observe(time.time() - start_time, server=config.name, result="ok")
+                return True, (time.time() - start_time) * 1000
+
             response = None
             for attempt in range(max(1, config.retry_attempts)):
                 try:
-                    response = await self._client.get(f"{base_url}{health_endpoint}", timeout=config.timeout)
+                    response = await self.pools.client_for(config, base_url).get(
+                        f"{base_url}{health_endpoint}", timeout=request_timeout(config)
+                    )
                     response.raise_for_status()
                     break
                 except (RequestError, HTTPStatusError) as exc:
@@ -140,43 +617,55 @@ class MCPRegistry:
                     await asyncio.sleep(min(0.2 * (attempt + 1), 1.0))
 
             if response and response.status_code == 200:
-                server_info.status = ServerStatus.ONLINE
-                server_info.response_time_ms = (time.time() - start_time) * 1000
-                server_info.last_seen = datetime.now(UTC).isoformat()
-                server_info.error_message = None
-                
-                # Atualiza ferramentas
-                await self._refresh_server_tools(server_name)
-                
-            else:
-                server_info.status = ServerStatus.ERROR
-                server_info.error_message = f"HTTP {response.status_code}"
-                
+                self.metrics.probe_duration.observe(time.time() - start_time, server=config.name, result="ok")
+                return True, (time.time() - start_time) * 1000
+            self.metrics.probe_duration.observe(time.time() - start_time, server=config.name, result="error")
+            return False, f"HTTP {response.status_code}"
         except Exception as e:
-            server_info.status = ServerStatus.ERROR
-            server_info.error_message = str(e)
-            
-            logger.warning(
-                "server_health_check_failed",
-                server_name=server_name,
-                error=str(e)
-            )
+            self.metrics.probe_duration.observe(time.time() - start_time, server=config.name, result="error")
+            return False, str(e) or type(e).__name__
     
     async def _refresh_server_tools(self, server_name: str) -> None:
-        """Fetch and normalize tools from a specific online MCP server."""
+        """Fetch a server's tool list and apply only what changed.
+
+        The request is conditional (``If-None-Match``/``If-Modified-Since``)
+        when the server sent validators last time, and an identical body is
+        detected by its hash, so an unchanged catalog is never parsed again.
+        Otherwise the added, removed and changed tools are applied in one
+        step, without an intermediate state where the server's tools are
+        missing.
+        """
         server_info = self.servers.get(server_name)
-        if not server_info or server_info.status != ServerStatus.ONLINE:
+        if not server_info or not server_info.available:
             return
-            
+
+        started = time.perf_counter()
         try:
-            # Pega endpoints configurados
+            # Pega endpoints configurados (catálogo vem da primeira réplica saudável)
             endpoints = server_info.config.endpoints
-            base_url = str(server_info.config.url).rstrip("/")
+            base_url = self.replicas_for(server_name).primary().url
+            if server_info.config.transport != "rest":
+                await self._refresh_mcp_tools(server_info, base_url, started)
+                return
             tools_endpoint = endpoints.get("tools", "/tools")
 
-            response = await self._client.get(f"{base_url}{tools_endpoint}", timeout=server_info.config.timeout)
-                        
+            response = await self.pools.client_for(server_info.config, base_url).get(
+                f"{base_url}{tools_endpoint}",
+                headers=self._tools_validators.get(server_name, {}),
+                timeout=request_timeout(server_info.config),
+            )
+
+            if response.status_code == 304:
+                server_info.stale = False
+                self._record_refresh(server_name, "not_modified", started)
+                return
+
             if response.status_code == 200:
+                digest = hashlib.sha256(response.content).hexdigest()
+                if digest == self._tools_digests.get(server_name):
+                    server_info.stale = False
+                    self._record_refresh(server_name, "unchanged", started)
+                    return
                 raw = response.json()
 
                 # pega as configurações de mapeamento do servidor
@@ -184,6 +673,7 @@ class MCPRegistry:
                 tools_key = resp_map.get("tools_key", "tools")
                 name_field = resp_map.get("tool_name_field", "name")
                 desc_field = resp_map.get("tool_desc_field", "description")
+                tags_field = resp_map.get("tool_tags_field", "tags")
 
                 # decide se a resposta é lista direta ou se precisa acessar uma chave
                 if tools_key:
@@ -191,71 +681,532 @@ class MCPRegistry:
                 else:
                     raw_tools = raw  # já é uma lista
 
-                # limpa ferramentas antigas
-                if server_info.config.name in self.server_tools:
-                    for t in self.server_tools[server_info.config.name]:
-                        self.tools.pop(f"{server_info.config.name}.{t}", None)
-
-                # adiciona novas ferramentas
-                tool_names = set()
+                # normaliza o catálogo recebido antes de tocar no atual
+                schemas: Dict[str, ToolSchema] = {}
                 for tool in raw_tools:
                     t_name = tool.get(name_field)
                     t_desc = tool.get(desc_field, "")
                     if not t_name:
                         continue
-                    schema = ToolSchema(
+                    schemas[t_name] = ToolSchema(
                     name=t_name,
                     description=t_desc,
                     parameters=tool.get("parameters", {}),
+                    tags=self._tool_tags(tool, tags_field),
                     server_name=server_name,
                     full_name=f"{server_name}.{t_name}"  # 👈 aqui!
                     )
 
-                    self.tools[schema.full_name] = schema
-                    tool_names.add(t_name)
-
-                self.server_tools[server_info.config.name] = tool_names
-                server_info.tools_count = len(tool_names)
+                await self._apply_tool_list(server_info, schemas, digest, self._validators(response), started)
+            else:
+                self._record_refresh(server_name, "error", started)
 
-                
         except Exception as e:
+            self._record_refresh(server_name, "error", started)
             logger.error(
                 "server_tools_refresh_failed",
                 server_name=server_name,
                 error=str(e)
             )
+
+    async def _refresh_mcp_tools(self, server_info: MCPServerInfo, base_url: str, started: float) -> None:
+        """Fetch a native MCP server's tools with ``tools/list``, following its pages, and apply them."""
+        config = server_info.config
+        server_name = config.name
+        session = self.sessions.session_for(config, base_url)
+        raw_tools: List[Dict[str, Any]] = []
+        cursor: Optional[str] = None
+        seen: Set[str] = set()
+        while True:
+            result = await session.request(
+                "tools/list", {"cursor": cursor} if cursor else None, timeout=float(config.timeout)
+            )
+            raw_tools += result.get("tools") or []
+            cursor = result.get("nextCursor")
+            # cursor repetido: servidor com paginação quebrada não prende o refresh
+            if not cursor or cursor in seen:
+                break
+            seen.add(cursor)
+
+        digest = hashlib.sha256(
+            json.dumps(raw_tools, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        ).hexdigest()
+        if digest == self._tools_digests.get(server_name):
+            server_info.stale = False
+            self._record_refresh(server_name, "unchanged", started)
+            return
+        schemas = {
+            tool["name"]: ToolSchema(
+                name=tool["name"],
+                description=tool.get("description") or "",
+                parameters=tool.get("inputSchema") or {},
+                tags=self._tool_tags(tool, config.response_map.get("tool_tags_field", "tags")),
+                server_name=server_name,
+                full_name=f"{server_name}.{tool['name']}",
+            )
+            for tool in raw_tools
+            if tool.get("name")
+        }
+        await self._apply_tool_list(server_info, schemas, digest, {}, started)
+
+    async def _apply_tool_list(
+        self,
+        server_info: MCPServerInfo,
+        schemas: Dict[str, ToolSchema],
+        digest: str,
+        validators: Dict[str, str],
+        started: float,
+    ) -> None:
+        """Apply a freshly fetched tool list and remember how to revalidate it."""
+        server_name = server_info.config.name
+        added, removed, changed = self._apply_server_tools(server_name, schemas)
+        server_info.stale = False
+        self._tools_digests[server_name] = digest
+        self._tools_validators[server_name] = validators
+        self._record_refresh(
+            server_name,
+            "changed" if added or removed or changed else "unchanged",
+            started,
+            added=len(added),
+            removed=len(removed),
+            changed=len(changed),
+        )
+        if self._search_stale:
+            await self.rebuild_search_index()
+
+    def _on_mcp_notification(self, server_name: str, method: str, params: Dict[str, Any]) -> None:
+        """Handle a notification from a server's MCP session."""
+        if method != TOOLS_LIST_CHANGED or server_name not in self.servers:
+            return
+        # o agendador sonda o servidor já e relista as ferramentas (avisos seguidos viram um refresh)
+        self._tools_changed.add(server_name)
+        if server_name not in self._probing:
+            self._next_probe[server_name] = time.monotonic()
+        self._wakeup.set()
+        logger.info("server_tools_changed", server_name=server_name)
+
+    def _apply_server_tools(
+        self, server_name: str, schemas: Dict[str, ToolSchema]
+    ) -> Tuple[Set[str], Set[str], Set[str]]:
+        """Replace a server's tools with ``schemas`` (keyed by short name), touching only what changed.
+
+        Returns the added, removed and changed tool names. When there are
+        more changes than ``SEARCH_REBUILD_THRESHOLD`` the search index is
+        left stale for the caller to rebuild.
+        """
+        # diff contra o catálogo atual do servidor
+        previous = self.server_tools.get(server_name, set())
+        added = schemas.keys() - previous
+        removed = previous - schemas.keys()
+        changed = {
+            t for t in schemas.keys() & previous
+            if self.tools.get(f"{server_name}.{t}") != schemas[t]
+        }
+
+        # muitas mudanças: o índice de busca é reconstruído numa thread depois
+        if len(added) + len(removed) + len(changed) > self.SEARCH_REBUILD_THRESHOLD:
+            self._search_stale = True
+
+        # aplica tudo sem await no meio: ninguém vê um catálogo pela metade
+        for t in removed:
+            self._drop_tool(f"{server_name}.{t}")
+        for t in added | changed:
+            self._put_tool(schemas[t])
+        self.server_tools[server_name] = set(schemas)
+        server_info = self.servers.get(server_name)
+        if server_info is not None:
+            server_info.tools_count = len(schemas)
+
+        if added or removed or changed:
+            self.invalidate_catalog()
+        # avisa quem depende do catálogo (ex.: cache) sobre ferramentas que sumiram
+        # (alteradas também: resultados em cache podem não valer mais)
+        self._notify_tools_removed({f"{server_name}.{t}" for t in removed | changed})
+        return set(added), removed, changed
+
+    def encode_snapshot(self, generation: int = 0) -> bytes:
+        """Serialize the catalog and server statuses (see :mod:`app.core.snapshot`)."""
+        tags: Dict[str, List[str]] = defaultdict(list)
+        for tag, full_names in self._tools_by_tag.items():
+            for full_name in full_names:
+                tags[full_name].append(tag)
+        records: Dict[str, List[Tuple[str, bytes, List[str]]]] = defaultdict(list)
+        for server_name, name, record in self.tools.records():
+            records[server_name].append((name, record, tags.get(f"{server_name}.{name}", [])))
+        upstream = {
+            name: {"digest": self._tools_digests.get(name), "validators": self._tools_validators.get(name, {})}
+            for name in self.servers
+        }
+        return encode_snapshot(self.servers.values(), records, self.catalog_version, generation, upstream)
+
+    async def load_snapshot(self, snapshot: SnapshotReader, restore: bool = False) -> int:
+        """Adopt the statuses and tools of a snapshot.
+
+        Only servers registered here with the same configuration are
+        taken, and only those whose tools changed since the last snapshot
+        are touched. A server without tools yet gets them without
+        decoding (records are decoded on first use); one that already has
+        tools gets only the differences. ``restore`` marks the servers
+        stale until their upstream is revalidated, and keeps the tool
+        list validators so that revalidation can be a conditional request.
+        Returns the number of servers whose tools were replaced.
+        """
+        replaced = 0
+        adopted = False
+        for name, entry in snapshot.servers.items():
+            server_info = self.servers.get(name)
+            if server_info is None or entry.config_digest != config_digest(server_info.config):
+                continue
+            for field, value in entry.status.items():
+                if field != "status" and field in MCPServerInfo.model_fields:
+                    setattr(server_info, field, value)
+            self._set_status(server_info, ServerStatus(entry.status["status"]))
+            if restore:
+                server_info.stale = True
+                if entry.upstream.get("digest"):
+                    self._tools_digests[name] = entry.upstream["digest"]
+                    self._tools_validators[name] = entry.upstream.get("validators", {})
+            elif server_info.status != ServerStatus.CONNECTING and name not in self._warmup:
+                # o líder já fez o primeiro probe deste servidor
+                self._warmup[name] = {"state": "done", "started": None, "duration_ms": None}
+            if self._snapshot_digests.get(name) == entry.digest:
+                continue
+            if self.server_tools.get(name):
+                schemas = {tool.name: tool for tool in snapshot.tools(name)}
+                self._apply_server_tools(name, schemas)
+            else:
+                self._adopt_server_tools(snapshot, name)
+                adopted = True
+            self._snapshot_digests[name] = entry.digest
+            replaced += 1
+        if adopted:
+            self._sorted_names = sorted(self.tools)
+            self._search_stale = True
+            self.invalidate_catalog()
+        if self._search_stale and (self._search_task is None or self._search_task.done()):
+            # o catálogo já responde; a busca é reconstruída em segundo plano
+            self._search_task = asyncio.create_task(self.rebuild_search_index())
+        return replaced
+
+    def _adopt_server_tools(self, snapshot: SnapshotReader, server_name: str) -> None:
+        """Give a server without tools the tools of a snapshot, leaving them encoded."""
+        names = snapshot.tool_names(server_name)
+        full_names = [f"{server_name}.{name}" for name in names]
+        self.tools.add_lazy(snapshot, server_name, full_names)
+        for tag, indexes in snapshot.servers[server_name].tags.items():
+            self._tools_by_tag[tag].update([full_names[i] for i in indexes])
+        self.server_tools[server_name] = set(names)
+        self.servers[server_name].tools_count = len(names)
+
+    async def restore_snapshot(self) -> int:
+        """Serve the catalog persisted by the previous run, stale until each server is revalidated.
+
+        Returns the number of servers restored.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        started = time.perf_counter()
+        try:
+            snapshot = SnapshotReader(self.snapshot_path)
+            restored = await self.load_snapshot(snapshot, restore=True)
+        except (OSError, ValueError, KeyError, SnapshotError) as e:
+            logger.warning("catalog_snapshot_restore_failed", path=self.snapshot_path, error=str(e))
+            return 0
+        # o arquivo já contém este estado: não precisa regravar
+        self._persist_dirty = False
+        logger.info(
+            "catalog_snapshot_restored",
+            servers=restored,
+            tools=len(self.tools),
+            written_at=snapshot.written_at,
+            duration_ms=(time.perf_counter() - started) * 1000,
+        )
+        return restored
+
+    def _schedule_persist(self) -> None:
+        """Write the snapshot file shortly, once for a burst of changes."""
+        if not self.snapshot_path or self._shutdown:
+            return
+        self._persist_dirty = True
+        if self._persist_task is None or self._persist_task.done():
+            try:
+                self._persist_task = asyncio.get_running_loop().create_task(self._persist_loop())
+            except RuntimeError:
+                # sem event loop (uso síncrono em testes/scripts): grava no shutdown
+                pass
+
+    async def _persist_loop(self) -> None:
+        # mudanças feitas durante uma gravação pedem outra
+        while self._persist_dirty:
+            await asyncio.sleep(self.PERSIST_DELAY)
+            if not self._persist_dirty:
+                break
+            self._persist_dirty = False
+            await self.persist_snapshot()
+
+    async def persist_snapshot(self) -> None:
+        """Write the catalog and server statuses to ``snapshot_path`` atomically."""
+        if not self.snapshot_path:
+            return
+        started = time.perf_counter()
+        try:
+            data = self.encode_snapshot()
+            await asyncio.to_thread(write_snapshot, self.snapshot_path, data)
+        except OSError as e:
+            logger.warning("catalog_snapshot_persist_failed", path=self.snapshot_path, error=str(e))
+            return
+        logger.debug(
+            "catalog_snapshot_persisted",
+            tools=len(self.tools),
+            size=len(data),
+            duration_ms=(time.perf_counter() - started) * 1000,
+        )
+
+    @staticmethod
+    def _tool_tags(tool: Dict[str, Any], tags_field: str) -> List[str]:
+        """Collect a tool's tags (list or single value) and its category, if any."""
+        raw_tags = tool.get(tags_field) or []
+        if isinstance(raw_tags, str):
+            raw_tags = [raw_tags]
+        tags = {str(tag) for tag in raw_tags}
+        if tool.get("category"):
+            tags.add(str(tool["category"]))
+        return sorted(tags)
+
+    @staticmethod
+    def _validators(response) -> Dict[str, str]:
+        """Return the conditional request headers for the next fetch of a tool list."""
+        headers: Dict[str, str] = {}
+        if response.headers.get("etag"):
+            headers["If-None-Match"] = response.headers["etag"]
+        if response.headers.get("last-modified"):
+            headers["If-Modified-Since"] = response.headers["last-modified"]
+        return headers
+
+    def _forget_catalog_state(self, server_name: str) -> None:
+        """Drop the validators and hash of a server's last tool list."""
+        self._tools_validators.pop(server_name, None)
+        self._tools_digests.pop(server_name, None)
+        self._snapshot_digests.pop(server_name, None)
+
+    def _record_refresh(
+        self,
+        server_name: str,
+        result: str,
+        started: float,
+        added: int = 0,
+        removed: int = 0,
+        changed: int = 0,
+    ) -> None:
+        """Keep the outcome of a tool list refresh for metrics."""
+        duration_ms = (time.perf_counter() - started) * 1000
+        self.metrics.refresh_duration.observe(duration_ms / 1000, server=server_name, result=result)
+        self._refresh_stats[server_name] = {
+            "result": result,
+            "added": added,
+            "removed": removed,
+            "changed": changed,
+            "duration_ms": duration_ms,
+            "refreshed_at": datetime.now(UTC).isoformat(),
+        }
+        self._refresh_totals[f"refreshes_{result}"] += 1
+        self._refresh_totals["tools_added"] += added
+        self._refresh_totals["tools_removed"] += removed
+        self._refresh_totals["tools_changed"] += changed
+        logger.debug(
+            "server_tools_refreshed",
+            server_name=server_name,
+            result=result,
+            added=added,
+            removed=removed,
+            changed=changed,
+            duration_ms=duration_ms,
+        )
+
+    def refresh_stats(self) -> Dict[str, Any]:
+        """Return catalog refresh totals and the last refresh of each server."""
+        return {
+            "totals": dict(self._refresh_totals),
+            "servers": {name: dict(stats) for name, stats in self._refresh_stats.items()},
+        }
     
-    async def start_background_refresh(self, interval: int = 60) -> None:
-        """Start periodic background refresh for server health and tools."""
+    async def start_background_refresh(self) -> None:
+        """Start the health check scheduler."""
         if self._refresh_task and not self._refresh_task.done():
             return
             
-        self._refresh_task = asyncio.create_task(
-            self._background_refresh_loop(interval)
-        )
+        self._refresh_task = asyncio.create_task(self._scheduler_loop())
         
-        logger.info("background_refresh_started", interval=interval)
-    
-    async def _background_refresh_loop(self, interval: int) -> None:
-        """Run periodic refresh loop until shutdown is requested."""
+        logger.info("background_refresh_started", servers=len(self.servers))
+
+    async def _scheduler_loop(self) -> None:
+        """Probe each server when it is due, until shutdown is requested.
+
+        Every server has its own schedule (``health_interval``, with
+        jitter), so probes are spread over time instead of hitting every
+        upstream at once.
+        """
         while not self._shutdown:
             try:
-                await self.refresh_all_servers()
-                await asyncio.sleep(interval)
+                now = time.monotonic()
+                wake_at = now + 1.0
+                for server_name in list(self.servers.keys()):
+                    if server_name in self._probing:
+                        continue
+                    due = self._next_probe.setdefault(server_name, now)
+                    if due <= now:
+                        self._probing[server_name] = asyncio.create_task(self._scheduled_probe(server_name))
+                    else:
+                        wake_at = min(wake_at, due)
+                # acorda pelo menos a cada segundo para ver servidores novos (ou antes, com um aviso)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(0.01, wake_at - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error("background_refresh_error", error=str(e))
-                await asyncio.sleep(5)  # Retry em 5 segundos
+                await asyncio.sleep(1)
+
+    async def _scheduled_probe(self, server_name: str) -> None:
+        """Run one scheduled liveness probe, refreshing the catalog when it is due."""
+        try:
+            async with self._probe_slots:
+                server_info = self.servers.get(server_name)
+                if not server_info:
+                    return
+                # servidor voltando (ou nunca visto online) também recarrega o catálogo
+                refresh_tools = (
+                    time.monotonic() >= self._next_tools.get(server_name, 0.0)
+                    or not server_info.available
+                    or server_name in self._tools_changed
+                )
+                # aviso que chegar durante este probe agenda outro
+                self._tools_changed.discard(server_name)
+                recent_success = time.monotonic() - self._last_call_success.get(server_name, float("-inf"))
+                if not refresh_tools and server_info.available and recent_success < server_info.config.health_interval:
+                    # o tráfego real já mostra que o servidor responde
+                    self._refresh_totals["probes_skipped"] += 1
+                else:
+                    await self._check_server_health(server_name, refresh_tools=refresh_tools)
+            self._schedule_after_probe(server_name, refreshed_tools=refresh_tools)
+        finally:
+            # o servidor pode ter sido removido e registrado de novo com outro probe
+            if self._probing.get(server_name) is asyncio.current_task():
+                self._probing.pop(server_name, None)
+
+    def _schedule_after_probe(self, server_name: str, refreshed_tools: bool) -> None:
+        """Set a server's next probe: its interval when healthy, exponential backoff when failing."""
+        server_info = self.servers.get(server_name)
+        if not server_info:
+            return
+        config = server_info.config
+        now = time.monotonic()
+        if server_info.available:
+            server_info.consecutive_failures = 0
+            delay = config.health_interval
+            if refreshed_tools:
+                if config.transport != "rest" and self.sessions.watches_tools(
+                    config, self.replicas_for(server_name).primary().url
+                ):
+                    # o upstream avisa quando a lista muda (tools/list_changed): sem polling
+                    self._next_tools[server_name] = float("inf")
+                else:
+                    self._next_tools[server_name] = now + self._jittered(
+                        config.tools_refresh_interval, config.health_jitter
+                    )
+        else:
+            server_info.consecutive_failures += 1
+            # primeira nova tentativa logo; depois dobra até o teto
+            delay = min(
+                config.health_retry_interval * 2 ** (server_info.consecutive_failures - 1),
+                config.health_backoff_max,
+            )
+        self._next_probe[server_name] = now + self._jittered(delay, config.health_jitter)
+        if server_name in self._tools_changed:
+            self._next_probe[server_name] = now
+
+    def record_call_result(self, server_name: str, success: bool, latency_ms: float) -> None:
+        """Feed the outcome of a real tool call into the server's passive health.
+
+        Updates the EWMA error rate and latency and marks the server
+        DEGRADED (or back ONLINE) from them. After
+        ``passive_offline_failures`` consecutive failed calls the server is
+        taken out of rotation and re-probed soon, without waiting for its
+        next scheduled probe.
+        """
+        server_info = self.servers.get(server_name)
+        if not server_info:
+            return
+        config = server_info.config
+        alpha = self.PASSIVE_EWMA_ALPHA
+        server_info.error_rate = (1 - alpha) * server_info.error_rate + alpha * (0.0 if success else 1.0)
+
+        if success:
+            server_info.consecutive_call_failures = 0
+            server_info.latency_ewma_ms = (
+                latency_ms
+                if server_info.latency_ewma_ms is None
+                else (1 - alpha) * server_info.latency_ewma_ms + alpha * latency_ms
+            )
+            server_info.last_success = datetime.now(UTC).isoformat()
+            self._last_call_success[server_name] = time.monotonic()
+        else:
+            server_info.consecutive_call_failures += 1
+
+        if not server_info.available:
+            return
+        if server_info.consecutive_call_failures >= config.passive_offline_failures:
+            self._set_status(server_info, ServerStatus.ERROR)
+            server_info.error_message = f"{server_info.consecutive_call_failures} consecutive call failures"
+            self._next_probe[server_name] = time.monotonic() + config.health_retry_interval
+            logger.warning("server_marked_offline", server_name=server_name, reason="call_failures")
+        else:
+            status = self._passive_status(server_info)
+            if status != server_info.status:
+                self._set_status(server_info, status)
+                logger.info("server_status_changed", server_name=server_name, status=status, source="calls")
+
+    @staticmethod
+    def _passive_status(server_info: MCPServerInfo) -> ServerStatus:
+        """Return ONLINE or DEGRADED from a reachable server's call error rate and latency.
+
+        A DEGRADED server returns to ONLINE only once its error rate is
+        below half the threshold, so the status does not flap.
+        """
+        config = server_info.config
+        error_limit = config.degraded_error_rate
+        if server_info.status == ServerStatus.DEGRADED:
+            error_limit /= 2
+        slow = (
+            config.degraded_latency_ms is not None
+            and server_info.latency_ewma_ms is not None
+            and server_info.latency_ewma_ms > config.degraded_latency_ms
+        )
+        return ServerStatus.DEGRADED if server_info.error_rate >= error_limit or slow else ServerStatus.ONLINE
+
+    @staticmethod
+    def _jittered(delay: float, jitter: float) -> float:
+        """Spread ``delay`` by ±``jitter`` (a fraction) so probes do not synchronize."""
+        return delay * (1 + random.uniform(-jitter, jitter))
     
     async def shutdown(self) -> None:
         """Stop background tasks and close HTTP resources."""
         self._shutdown = True
         
-        if self._refresh_task and not self._refresh_task.done():
-            self._refresh_task.cancel()
-            try:
-                await self._refresh_task
-            except asyncio.CancelledError:
-                pass
+        for task in [self._refresh_task, self._persist_task, self._search_task, *self._probing.values()]:
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         
-        await self._client.aclose()
+        if self._persist_dirty:
+            # grava o que mudou desde a última gravação: o próximo início parte daqui
+            await self.persist_snapshot()
+        await self.sessions.aclose()
+        await self.pools.aclose()
         logger.info("registry_shutdown_complete")
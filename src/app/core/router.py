@@ -1,49 +1,144 @@
 """Router para executar ferramentas MCP."""
 
+import asyncio
+import json
+import random
 import time
-from collections import defaultdict
-from typing import Any, Dict
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 import httpx
 import structlog
-from app.models.schemas import ToolCallRequest, ToolCallResponse, ServerStatus
+from app.models.schemas import ToolCallRequest, ToolCallResponse
+from app.core.adaptive import AdaptiveLimit, adaptive_limit
+from app.core.budget import RequestBudget
+from app.core.bulkhead import Bulkhead, BulkheadRejected
+from app.core.cache import ToolResultCache, call_key
+from app.core.latency import LatencyWindow
+from app.core.mcp_session import MCPError
+from app.core.metrics import HubMetrics, error_code
+from app.core.timing import phase, record
+from app.core.pools import request_timeout
 from app.core.registry import MCPRegistry
+from app.core.state import StateBackend
 from app.models.schemas import MCPServerConfig
 
 logger = structlog.get_logger(__name__)
 
+# prazo restante (ms) da chamada: aceito dos clientes e repassado ao upstream
+DEADLINE_HEADER = "X-Timeout-Ms"
+# retries permitidos por segundo mesmo com pouco tráfego
+RETRY_FLOOR_PER_SECOND = 1.0
+# erros decididos pelo próprio hub: não contam contra a saúde do servidor
+LOCAL_ERRORS = frozenset({"deadline_exceeded", "server_overloaded"})
+# a ferramenta rodou e respondeu com erro (MCP ``isError``): o servidor está saudável
+TOOL_ERROR = "tool_error"
+
+# segundos que a chamada corrente passou em tentativas ao upstream (tasks filhas compartilham a lista)
+_upstream_seconds: ContextVar[Optional[List[float]]] = ContextVar("upstream_seconds", default=None)
+
 
 class MCPRouter:
     """Route tool calls from hub clients to MCP servers."""
     
-    def __init__(self, registry: MCPRegistry):
+    def __init__(
+        self,
+        registry: MCPRegistry,
+        cache: Optional[ToolResultCache] = None,
+        state: Optional[StateBackend] = None,
+        metrics: Optional[HubMetrics] = None,
+    ):
         self.registry = registry
-        self._client = httpx.AsyncClient(timeout=60.0)
-        self._failure_counts: Dict[str, int] = defaultdict(int)
-        self._circuit_open_until: Dict[str, float] = {}
+        self.cache = cache
+        self.state = state or StateBackend()
+        self.metrics = metrics or registry.metrics
+        # mesmo pool do registry: health checks e chamadas reutilizam as conexões
+        self.pools = registry.pools
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # latências recentes por ferramenta e orçamento de hedges por servidor
+        self._latency: Dict[str, LatencyWindow] = {}
+        self._hedge_budgets: Dict[str, RequestBudget] = {}
+        self._retry_budgets: Dict[str, RequestBudget] = {}
+        self._bulkheads: Dict[str, Bulkhead] = {}
+        self._bulkhead_settings: Dict[str, Tuple[Any, ...]] = {}
+        self._adaptive: Dict[str, AdaptiveLimit] = {}
+
+        if self.cache is not None:
+            registry.add_tool_removed_listener(self.cache.invalidate_tool)
+        registry.add_tool_removed_listener(lambda full_name: self._latency.pop(full_name, None))
+        registry.add_server_removed_listener(self._forget_server)
     
 
+    def _forget_server(self, server_name: str) -> None:
+        """Drop the bulkhead, adaptive limit and budgets of an unregistered server.
+
+        Calls still running keep the objects they already hold.
+        """
+        for per_server in (
+            self._bulkheads, self._bulkhead_settings, self._adaptive, self._hedge_budgets, self._retry_budgets
+        ):
+            per_server.pop(server_name, None)
+
     def _is_circuit_open(self, server_name: str) -> bool:
         """Return True when circuit breaker is open for a server."""
-        return self._circuit_open_until.get(server_name, 0) > time.time()
+        return self.state.circuit_open_until(server_name) > time.time()
 
     def _record_success(self, server_name: str) -> None:
         """Reset failure counters after successful call."""
-        self._failure_counts[server_name] = 0
-        self._circuit_open_until.pop(server_name, None)
+        if self.state.failure_count(server_name):
+            self.state.reset_failures(server_name)
+        if self.state.circuit_open_until(server_name):
+            self.state.close_circuit(server_name)
 
     def _record_failure(self, server_name: str, fail_threshold: int, reset_seconds: int) -> None:
         """Track failures and open the circuit when threshold is reached."""
-        self._failure_counts[server_name] += 1
-        if self._failure_counts[server_name] >= fail_threshold:
-            self._circuit_open_until[server_name] = time.time() + reset_seconds
+        if self.state.record_failure(server_name) >= fail_threshold:
+            self.state.open_circuit(server_name, time.time() + reset_seconds)
+
+    async def execute_tool(
+        self,
+        request: ToolCallRequest,
+        deadline: Optional[float] = None
+    ) -> ToolCallResponse:
+        """Execute a tool call request against the resolved MCP server.
+
+        ``deadline`` (``time.monotonic``) defaults to ``request.timeout_ms``
+        from now and caps the whole call, retries included.
+        """
+        started = time.perf_counter()
+        upstream_seconds = [0.0]
+        token = _upstream_seconds.set(upstream_seconds)
+        try:
+            response = await self._execute_tool(request, deadline)
+        finally:
+            _upstream_seconds.reset(token)
 
-    async def execute_tool(self, request: ToolCallRequest) -> ToolCallResponse:
-        """Execute a tool call request against the resolved MCP server."""
+        elapsed = time.perf_counter() - started
+        server = response.server_name
+        # nomes fora do catálogo (tool_not_found) não viram labels
+        tool_name = request.tool[len(server) + 1:] if request.tool.startswith(f"{server}.") else ""
+        self.metrics.tool_calls.inc(server=server, tool=tool_name, result=error_code(response.error))
+        self.metrics.call_duration.observe(elapsed, server=server, tool=tool_name)
+        if upstream_seconds[0]:
+            self.metrics.hub_overhead.observe(max(0.0, elapsed - upstream_seconds[0]), server=server)
+        return response
+
+    async def _execute_tool(
+        self,
+        request: ToolCallRequest,
+        deadline: Optional[float]
+    ) -> ToolCallResponse:
+        """Run one tool call (see :meth:`execute_tool`)."""
         start_time = time.time()
+        if deadline is None:
+            deadline = self._deadline(request)
+        # True quando a resposta vem de uma chamada ao upstream disparada por outro request
+        shared = False
         
         try:
             # Busca informações da ferramenta
-            tool = await self.registry.get_tool(request.tool)
+            with phase("lookup"):
+                tool = await self.registry.get_tool(request.tool)
+                server_info = await self.registry.get_server_info(tool.server_name) if tool else None
             if not tool:
                 return ToolCallResponse(
                     success=False,
@@ -53,7 +148,6 @@ class MCPRouter:
                 )
             
             # Busca informações do servidor
-            server_info = await self.registry.get_server_info(tool.server_name)
             if not server_info:
                 return ToolCallResponse(
                     success=False,
@@ -62,8 +156,19 @@ class MCPRouter:
                     execution_time_ms=(time.time() - start_time) * 1000
                 )
             
+            # Resultado em cache dispensa a chamada ao upstream
+            cache_key = None
+            if self.cache is not None and self.cache.enabled and server_info.config.is_cacheable(tool.name):
+                with phase("cache"):
+                    cache_key = self.cache.make_key(tool.full_name, request.arguments)
+                    cached = self.cache.get(cache_key)
+                if cached is not None:
+                    cached.server_name = tool.server_name
+                    cached.execution_time_ms = (time.time() - start_time) * 1000
+                    return cached
+
             # Verifica se servidor está online
-            if server_info.status != ServerStatus.ONLINE:
+            if not server_info.available:
                 return ToolCallResponse(
                     success=False,
                     error="server_offline",
@@ -79,20 +184,42 @@ class MCPRouter:
                     execution_time_ms=(time.time() - start_time) * 1000,
                 )
 
-            # Executa a ferramenta
-            response = await self._call_mcp_tool(
-                server_info.config,
-                tool.name,
-                request.arguments
-            )
-
-            if response.success:
-                self._record_success(tool.server_name)
+            # Executa a ferramenta (agrupando chamadas idênticas de ferramentas idempotentes)
+            if server_info.config.is_idempotent(tool.name):
+                task, shared = self._join_inflight(
+                    cache_key or call_key(tool.full_name, request.arguments),
+                    server_info.config,
+                    tool.name,
+                    request.arguments,
+                    deadline,
+                )
+                # cada chamador espera até o próprio prazo e recebe sua própria cópia
+                response = await self._within_deadline(asyncio.shield(task), deadline)
+                response = response.model_copy() if response else self._deadline_exceeded()
             else:
-                self._record_failure(
-                    tool.server_name,
-                    server_info.config.circuit_breaker_failures,
-                    server_info.config.circuit_breaker_reset_seconds,
+                response = await self._call_mcp_tool(
+                    server_info.config,
+                    tool.name,
+                    request.arguments,
+                    deadline
+                )
+
+            if response.error == "deadline_exceeded":
+                self.state.incr("deadline_exceeded_total")
+            # só quem disparou a chamada ao upstream conta para o circuit breaker e a saúde passiva;
+            # prazo esgotado e carga rejeitada pelo hub não são falhas do servidor, nem erro da ferramenta
+            if not shared and response.error not in LOCAL_ERRORS:
+                served = response.success or response.error == TOOL_ERROR
+                if served:
+                    self._record_success(tool.server_name)
+                else:
+                    self._record_failure(
+                        tool.server_name,
+                        server_info.config.circuit_breaker_failures,
+                        server_info.config.circuit_breaker_reset_seconds,
+                    )
+                self.registry.record_call_result(
+                    tool.server_name, served, (time.time() - start_time) * 1000
                 )
 
             
@@ -108,16 +235,20 @@ class MCPRouter:
             
             response.execution_time_ms = execution_time
             response.server_name = tool.server_name
+
+            if cache_key is not None and response.success:
+                self.cache.set(tool.full_name, cache_key, response)
             
             return response
             
         except (httpx.RequestError, ValueError, TypeError) as e:
-            if "tool" in locals() and "server_info" in locals():
+            if "tool" in locals() and "server_info" in locals() and not shared:
                 self._record_failure(
                     tool.server_name,
                     server_info.config.circuit_breaker_failures,
                     server_info.config.circuit_breaker_reset_seconds,
                 )
+                self.registry.record_call_result(tool.server_name, False, (time.time() - start_time) * 1000)
             logger.error(
                 "tool_execution_failed",
                 tool_name=request.tool,
@@ -131,14 +262,283 @@ class MCPRouter:
                 execution_time_ms=(time.time() - start_time) * 1000
             )
     
-    async def _call_mcp_tool(
+    async def open_stream(
         self,
+        request: ToolCallRequest
+    ) -> Tuple[ToolCallResponse, Optional[AsyncIterator[bytes]]]:
+        """Start a tool call whose upstream body is forwarded without being parsed.
+
+        Returns the call outcome and, when the upstream answered 200, an
+        iterator over the hub envelope::
+
+            {"success": true, "server_name": ..., "upstream": <upstream body>, "execution_time_ms": ...}
+
+        The upstream body is copied chunk by chunk, so memory stays bounded
+        whatever the size of the result. Streamed calls bypass the result
+        cache and request coalescing. The iterator must be consumed or
+        closed to release the upstream connection.
+
+        Native MCP servers answer in one JSON-RPC message, so their calls
+        run as regular calls and ``upstream`` is the ``CallToolResult``.
+        """
+        start_time = time.time()
+        deadline = self._deadline(request)
+        tool = await self.registry.get_tool(request.tool)
+        if not tool:
+            return self._failed("tool_not_found", "unknown", start_time), None
+        server_info = await self.registry.get_server_info(tool.server_name)
+        if not server_info:
+            return self._failed("server_not_found", tool.server_name, start_time), None
+        if not server_info.available:
+            return self._failed("server_offline", tool.server_name, start_time), None
+        if self._is_circuit_open(tool.server_name):
+            return self._failed("circuit_open", tool.server_name, start_time), None
+        if server_info.config.transport != "rest":
+            response = await self.execute_tool(request, deadline)
+            return response, self._replay(response) if response.success else None
+
+        remaining = self._remaining(deadline)
+        if remaining is not None and remaining <= 0:
+            self.state.incr("deadline_exceeded_total")
+            return self._failed("deadline_exceeded", tool.server_name, start_time), None
+
+        config = server_info.config
+        bulkhead = self._bulkhead(config)
+        try:
+            await bulkhead.acquire(remaining)
+        except BulkheadRejected as e:
+            logger.warning("tool_call_shed", server_name=config.name, reason=e.reason)
+            return self._failed("server_overloaded", tool.server_name, start_time), None
+
+        base_url, replica_done = self._pick_replica(config)
+        url, payload = self._call_request(config, tool.name, request.arguments, base_url)
+        self.state.incr("upstream_calls_total")
+        client = self.pools.client_for(config, base_url)
+        try:
+            upstream = await client.send(
+                client.build_request(
+                    "POST",
+                    url,
+                    json=payload,
+                    headers=self._deadline_headers(remaining),
+                    timeout=request_timeout(config, remaining),
+                ),
+                stream=True,
+            )
+        except httpx.TimeoutException:
+            error = "timeout"
+        except httpx.RequestError as e:
+            error = str(e)
+        except BaseException:
+            bulkhead.release()
+            replica_done(None)
+            raise
+        else:
+            if upstream.status_code == 200:
+                response = ToolCallResponse(
+                    success=True,
+                    server_name=tool.server_name,
+                    execution_time_ms=(time.time() - start_time) * 1000,
+                )
+                return response, self._forward_stream(upstream, config, start_time, replica_done, bulkhead)
+            await upstream.aclose()
+            error = f"http_error_{upstream.status_code}"
+            replica_done(upstream.status_code < 500)
+        replica_done(False)  # timeout ou erro de conexão (sem efeito se já informado acima)
+        bulkhead.release()
+
+        self._record_failure(tool.server_name, config.circuit_breaker_failures, config.circuit_breaker_reset_seconds)
+        self.registry.record_call_result(tool.server_name, False, (time.time() - start_time) * 1000)
+        logger.error("tool_stream_failed", tool_name=request.tool, error=error)
+        return self._failed(error, tool.server_name, start_time), None
+
+    async def _forward_stream(
+        self,
+        upstream: httpx.Response,
+        config: MCPServerConfig,
+        start_time: float,
+        replica_done: Callable[[Optional[bool]], None],
+        bulkhead: Bulkhead
+    ) -> AsyncIterator[bytes]:
+        """Wrap an open upstream response body in the hub envelope, chunk by chunk.
+
+        The call keeps its bulkhead slot until the body is fully forwarded.
+        """
+        completed = False
+        try:
+            yield b'{"success":true,"server_name":' + json.dumps(config.name).encode() + b',"upstream":'
+            empty = True
+            async for chunk in upstream.aiter_bytes():
+                if chunk:
+                    empty = False
+                    yield chunk
+            if empty:
+                yield b"null"
+            completed = True
+            execution_time = (time.time() - start_time) * 1000
+            yield b',"execution_time_ms":' + json.dumps(execution_time).encode() + b"}"
+        except httpx.RequestError as e:
+            # o status 200 já foi enviado: resta interromper a resposta ao cliente
+            logger.error("tool_stream_interrupted", server_name=config.name, error=str(e))
+            raise
+        finally:
+            await upstream.aclose()
+            bulkhead.release()
+            replica_done(completed)
+            if completed:
+                self._record_success(config.name)
+            else:
+                self._record_failure(
+                    config.name,
+                    config.circuit_breaker_failures,
+                    config.circuit_breaker_reset_seconds,
+                )
+            self.registry.record_call_result(config.name, completed, (time.time() - start_time) * 1000)
+
+    @staticmethod
+    async def _replay(response: ToolCallResponse) -> AsyncIterator[bytes]:
+        """Render a completed call in the envelope of :meth:`open_stream`."""
+        yield b'{"success":true,"server_name":' + json.dumps(response.server_name).encode() + b',"upstream":'
+        yield json.dumps(response.result).encode()
+        yield b',"execution_time_ms":' + json.dumps(response.execution_time_ms).encode() + b"}"
+
+    @staticmethod
+    def _failed(error: str, server_name: str, start_time: float) -> ToolCallResponse:
+        """Build a failed call response."""
+        return ToolCallResponse(
+            success=False,
+            error=error,
+            server_name=server_name,
+            execution_time_ms=(time.time() - start_time) * 1000,
+        )
+
+    async def execute_batch(self, requests: List[ToolCallRequest]) -> List[ToolCallResponse]:
+        """Execute several tool calls concurrently and return results in request order."""
+        results: List[Optional[ToolCallResponse]] = [None] * len(requests)
+        async for index, response in self.iter_batch(requests):
+            results[index] = response
+        return results
+
+    async def iter_batch(
+        self,
+        requests: List[ToolCallRequest]
+    ) -> AsyncIterator[Tuple[int, ToolCallResponse]]:
+        """Yield ``(index, response)`` pairs as the calls of a batch complete.
+
+        Calls are fanned out concurrently, limited per server by
+        ``MCPServerConfig.batch_concurrency``. The limit applies to this
+        batch only; concurrent batches each get their own. A failing call is
+        reported in its own response and never aborts the rest of the batch.
+        """
+        # resolve servidor e semáforo de cada chamada antes de disparar qualquer task
+        semaphores: Dict[str, asyncio.Semaphore] = {}
+        targets: List[Tuple[str, asyncio.Semaphore]] = []
+        for request in requests:
+            tool = await self.registry.get_tool(request.tool)
+            server_name = tool.server_name if tool else request.tool.split(".", 1)[0]
+            if server_name not in semaphores:
+                server_info = await self.registry.get_server_info(server_name)
+                limit = server_info.config.batch_concurrency if server_info else len(requests)
+                semaphores[server_name] = asyncio.Semaphore(max(1, limit))
+            targets.append((server_name, semaphores[server_name]))
+        # o prazo de cada chamada conta desde a chegada do lote, incluindo a espera pelo semáforo
+        deadlines = [self._deadline(request) for request in requests]
+
+        async def run(index: int, request: ToolCallRequest) -> Tuple[int, ToolCallResponse]:
+            server_name, semaphore = targets[index]
+            async with semaphore:
+                try:
+                    return index, await self.execute_tool(request, deadlines[index])
+                except Exception as e:
+                    logger.error("batch_item_failed", tool_name=request.tool, error=str(e))
+                    return index, ToolCallResponse(
+                        success=False,
+                        error="execution_failed",
+                        server_name=server_name,
+                    )
+
+        tasks = [asyncio.create_task(run(i, r)) for i, r in enumerate(requests)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # cliente desistiu do lote: não deixa chamadas órfãs rodando
+            for task in tasks:
+                task.cancel()
+
+    def _join_inflight(
+        self,
+        key: str,
         config: MCPServerConfig,
         tool_name: str,
-        arguments: Dict[str, Any]
-    ) -> ToolCallResponse:
-        """Perform the HTTP request to the target MCP server call endpoint."""
-        base_url = str(config.url).rstrip("/")
+        arguments: Dict[str, Any],
+        deadline: Optional[float] = None
+    ) -> Tuple[asyncio.Task, bool]:
+        """Share one upstream request among identical concurrent calls.
+
+        Returns the task performing the upstream call and whether it was
+        started by another request. The call runs in its own task, so a
+        cancelled waiter never cancels the request the others depend on;
+        waiters should await it through ``asyncio.shield``. The shared
+        request runs under the deadline of the call that started it.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.state.incr("coalesced_calls_total")
+        else:
+            task = asyncio.create_task(self._call_mcp_tool(config, tool_name, arguments, deadline))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish_inflight(key, t))
+        return task, shared
+
+    def _finish_inflight(self, key: str, task: asyncio.Task) -> None:
+        """Forget a completed in-flight call and consume its exception, if any."""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    def _pick_replica(
+        self,
+        config: MCPServerConfig,
+        exclude: Optional[str] = None
+    ) -> Tuple[Optional[str], Callable[[Optional[bool]], None]]:
+        """Choose the replica for a call, avoiding the ``exclude`` URL when possible.
+
+        Returns its base URL (None for the server's single ``url``) and a
+        callback reporting whether the replica served the call; the
+        callback also records the latency and frees the replica's slot.
+        ``None`` means the call was abandoned: only the slot is freed.
+        """
+        replicas = self.registry.replicas_for(config.name)
+        if replicas is None:
+            return None, lambda success: None
+        replica = replicas.pick(exclude=exclude)
+        replicas.start(replica)
+        started = time.perf_counter()
+        finished = False
+
+        def done(success: Optional[bool]) -> None:
+            nonlocal finished
+            if not finished:
+                finished = True
+                if success is None:
+                    replicas.cancel(replica)
+                else:
+                    replicas.finish(replica, success, (time.perf_counter() - started) * 1000)
+
+        return replica.url, done
+
+    @staticmethod
+    def _call_request(
+        config: MCPServerConfig,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        base_url: Optional[str] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Return the URL and JSON payload of a call to an MCP server (or one of its replicas)."""
+        base_url = base_url or str(config.url).rstrip("/")
         call_endpoint = config.endpoints.get("call", "/call")
 
         tool_field = config.payload_map.get("tool_field", "tool")
@@ -148,42 +548,421 @@ class MCPRouter:
             tool_field: tool_name,
             args_field: arguments
         }
+        return f"{base_url}{call_endpoint}", payload
 
+    async def _call_mcp_tool(
+        self,
+        config: MCPServerConfig,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        deadline: Optional[float] = None
+    ) -> ToolCallResponse:
+        """Call a tool on its MCP server, hedging and retrying idempotent tools when configured.
+
+        Connection errors and 5xx answers of idempotent tools are retried
+        up to ``call_retries`` times, with full-jitter exponential backoff,
+        while the server's retry budget allows it. ``deadline``
+        (``time.monotonic``) caps all attempts together; no retry starts
+        that could not finish its backoff before it.
+
+        The whole call holds one slot of the server's bulkhead; when none
+        frees up in time it fails with ``server_overloaded``. With
+        ``adaptive_concurrency`` the call's latency and outcome then
+        adjust the bulkhead's limit.
+        """
+        bulkhead = self._bulkhead(config)
+        try:
+            with phase("queue"):
+                await bulkhead.acquire(self._remaining(deadline))
+        except BulkheadRejected as e:
+            logger.warning("tool_call_shed", server_name=config.name, tool_name=tool_name, reason=e.reason)
+            return ToolCallResponse(success=False, error="server_overloaded", server_name="")
+        in_flight = bulkhead.in_flight
+        started = time.perf_counter()
+        try:
+            response = await self._call_with_retries(config, tool_name, arguments, deadline)
+        finally:
+            bulkhead.release()
+
+        limiter = self._adaptive.get(config.name)
+        if limiter is not None and response.error not in LOCAL_ERRORS:
+            # 4xx é erro do pedido, não sinal de sobrecarga do servidor
+            dropped = not response.success and response.error != TOOL_ERROR and not (
+                (response.error or "").startswith(("http_error_4", "mcp_error_"))
+            )
+            bulkhead.limit = limiter.update((time.perf_counter() - started) * 1000, dropped, in_flight)
+        return response
+
+    async def _call_with_retries(
+        self,
+        config: MCPServerConfig,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        deadline: Optional[float]
+    ) -> ToolCallResponse:
+        """Run the attempts of one call (see :meth:`_call_mcp_tool`)."""
+        retries = config.call_retries if config.is_idempotent(tool_name) else 0
+        budget = self._retry_budget(config)
+        budget.deposit()
+        attempt = 0
+        while True:
+            if config.hedges(tool_name):
+                call = self._hedged_call(config, tool_name, arguments, deadline)
+            else:
+                call = self._call_upstream(config, tool_name, arguments, deadline=deadline)
+            attempt_started = time.perf_counter()
+            try:
+                outcome = await self._within_deadline(call, deadline)
+            finally:
+                attempt_seconds = time.perf_counter() - attempt_started
+                record("upstream", attempt_seconds)
+                upstream_seconds = _upstream_seconds.get()
+                if upstream_seconds is not None:
+                    upstream_seconds[0] += attempt_seconds
+            if outcome is None:
+                return self._deadline_exceeded()
+            response, retryable = outcome
+            if response.success or not retryable or attempt >= retries:
+                return response
+
+            backoff = random.uniform(0, config.retry_backoff_ms * 2 ** attempt) / 1000
+            if deadline is not None and time.monotonic() + backoff >= deadline:
+                return response
+            if not budget.try_spend():
+                self.state.incr("retry_budget_exhausted_total")
+                return response
+            self.state.incr("retries_total")
+            logger.info("tool_call_retry", server_name=config.name, tool_name=tool_name, error=response.error)
+            await asyncio.sleep(backoff)
+            attempt += 1
+
+    def _bulkhead(self, config: MCPServerConfig) -> Bulkhead:
+        """Return a server's bulkhead (rebuilt when its settings change)."""
+        settings = (
+            config.max_in_flight,
+            config.max_queue,
+            config.queue_timeout,
+            config.adaptive_concurrency,
+            config.adaptive_min_limit,
+            config.adaptive_max_limit,
+        )
+        bulkhead = self._bulkheads.get(config.name)
+        if bulkhead is None or self._bulkhead_settings.get(config.name) != settings:
+            limiter = adaptive_limit(config)
+            if limiter is None:
+                self._adaptive.pop(config.name, None)
+                limit = config.max_in_flight
+            else:
+                self._adaptive[config.name] = limiter
+                limit = limiter.limit
+            bulkhead = self._bulkheads[config.name] = Bulkhead(limit, config.max_queue, config.queue_timeout)
+            self._bulkhead_settings[config.name] = settings
+        return bulkhead
+
+    def bulkhead_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return in-flight, queued and shed counts of every server called."""
+        return {name: bulkhead.stats() for name, bulkhead in self._bulkheads.items()}
+
+    def concurrency_limits(self) -> Dict[str, Dict[str, Any]]:
+        """Return the learned limit, and its recent history, of every adaptive server."""
+        return {name: limiter.stats() for name, limiter in self._adaptive.items()}
+
+    def retry_after(self, server_name: str) -> int:
+        """Seconds a client whose call was shed should wait before retrying."""
+        bulkhead = self._bulkheads.get(server_name)
+        return bulkhead.retry_after() if bulkhead else 1
+
+    def _retry_budget(self, config: MCPServerConfig) -> RequestBudget:
+        """Return a server's retry budget (rebuilt when its ratio changes)."""
+        budget = self._retry_budgets.get(config.name)
+        if budget is None or budget.ratio != config.retry_budget:
+            budget = self._retry_budgets[config.name] = RequestBudget(
+                config.retry_budget, min_per_second=RETRY_FLOOR_PER_SECOND
+            )
+        return budget
+
+    def retry_stats(self) -> Dict[str, Dict[str, float]]:
+        """Return the retry budget counters of every server called."""
+        return {name: budget.stats() for name, budget in self._retry_budgets.items()}
+
+    @staticmethod
+    def _deadline(request: ToolCallRequest) -> Optional[float]:
+        """Turn a request's ``timeout_ms`` into a ``time.monotonic`` deadline."""
+        if request.timeout_ms is None:
+            return None
+        return time.monotonic() + request.timeout_ms / 1000
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        """Return the seconds left before ``deadline`` (None without one)."""
+        return None if deadline is None else deadline - time.monotonic()
+
+    @staticmethod
+    def _deadline_headers(remaining: Optional[float]) -> Dict[str, str]:
+        """Return the header telling the upstream how long the hub will wait."""
+        if remaining is None:
+            return {}
+        return {DEADLINE_HEADER: str(max(1, int(remaining * 1000)))}
+
+    @staticmethod
+    def _deadline_exceeded() -> ToolCallResponse:
+        """Build the response of a call whose deadline ran out."""
+        return ToolCallResponse(success=False, error="deadline_exceeded", server_name="")
+
+    @staticmethod
+    async def _within_deadline(awaitable: Any, deadline: Optional[float]) -> Any:
+        """Await ``awaitable`` until ``deadline``; None when the deadline passes first."""
+        if deadline is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            return None
+
+    async def _hedged_call(
+        self,
+        config: MCPServerConfig,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        deadline: Optional[float] = None
+    ) -> Tuple[ToolCallResponse, bool]:
+        """Call an idempotent tool, racing a second request when the first is slow.
+
+        After the hedge delay (the tool's ``hedge_percentile`` latency, or
+        ``hedge_delay_ms`` until enough calls were seen) a second request
+        goes to another replica, or another connection of the same one,
+        if the server's hedge budget allows it. The first successful
+        response wins and the other request is cancelled. Returns the
+        response and whether its failure may be retried.
+        """
+        budget = self._hedge_budget(config)
+        budget.deposit()
+        delay = self._hedge_delay(config, tool_name)
+        first = self._pick_replica(config)
+        primary = asyncio.create_task(self._call_upstream(config, tool_name, arguments, first, deadline))
+        tasks = [primary]
+        try:
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait(tasks, timeout=delay / 1000)
+            if done:
+                return primary.result()
+
+            if not budget.try_spend():
+                self.state.incr("hedges_budget_exhausted_total")
+                return await primary
+            self.state.incr("hedges_sent_total")
+            second = self._pick_replica(config, exclude=first[0])
+            tasks.append(asyncio.create_task(self._call_upstream(config, tool_name, arguments, second, deadline)))
+
+            winner: Optional[Tuple[asyncio.Task, Tuple[ToolCallResponse, bool]]] = None
+            pending = set(tasks)
+            while pending and (winner is None or not winner[1][0].success):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if winner is None or (task.result()[0].success and not winner[1][0].success):
+                        winner = (task, task.result())
+            if winner[0] is not primary and winner[1][0].success:
+                self.state.incr("hedges_won_total")
+            return winner[1]
+        finally:
+            # a requisição perdedora é cancelada (libera a conexão e o slot da réplica)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _hedge_delay(self, config: MCPServerConfig, tool_name: str) -> Optional[float]:
+        """Return how long (ms) to wait before hedging a call, or None to not hedge."""
+        if config.hedge_percentile:
+            window = self._latency.get(f"{config.name}.{tool_name}")
+            delay = window.percentile(config.hedge_percentile) if window else None
+            if delay is not None:
+                return delay
+        return config.hedge_delay_ms
+
+    def _hedge_budget(self, config: MCPServerConfig) -> RequestBudget:
+        """Return a server's hedge budget (rebuilt when its ratio changes)."""
+        budget = self._hedge_budgets.get(config.name)
+        if budget is None or budget.ratio != config.hedge_budget:
+            budget = self._hedge_budgets[config.name] = RequestBudget(config.hedge_budget)
+        return budget
+
+    def hedge_stats(self) -> Dict[str, Dict[str, float]]:
+        """Return the hedge budget counters of every server that hedged calls."""
+        return {name: budget.stats() for name, budget in self._hedge_budgets.items()}
+
+    async def _call_upstream(
+        self,
+        config: MCPServerConfig,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        replica: Optional[Tuple[Optional[str], Callable[[Optional[bool]], None]]] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[ToolCallResponse, bool]:
+        """Perform one HTTP request to the target MCP server call endpoint.
+
+        Returns the response and whether its failure may be retried: the
+        request never reached the tool (connection refused or reset,
+        connect timeout) or the server answered 5xx (but not 501). Read
+        timeouts are not retried, as the tool may still be running.
+        """
+        base_url, replica_done = replica or self._pick_replica(config)
+        remaining = self._remaining(deadline)
+        if config.transport != "rest":
+            return await self._call_session(config, tool_name, arguments, base_url, replica_done, remaining)
+        url, payload = self._call_request(config, tool_name, arguments, base_url)
+        self.state.incr("upstream_calls_total")
+        started = time.perf_counter()
+
+        # réplica com problema: erro de conexão, timeout ou 5xx (4xx é culpa do request)
+        replica_ok: Optional[bool] = False
         try:
-            response = await self._client.post(
-                f"{base_url}{call_endpoint}",
+            response = await self.pools.client_for(config, base_url).post(
+                url,
                 json=payload,
-                timeout=config.timeout
+                headers=self._deadline_headers(remaining),
+                timeout=request_timeout(config, remaining),
+            )
+            replica_ok = response.status_code < 500
+            self.metrics.upstream_duration.observe(
+                time.perf_counter() - started,
+                server=config.name,
+                result="ok" if response.status_code == 200 else f"http_error_{response.status_code}",
             )
 
             if response.status_code == 200:
                 data = response.json()
+                self._record_latency(config, tool_name, started)
                 return ToolCallResponse(
                     success=True,
                     result=data.get("result"),
                     server_name=""  # será preenchido em execute_tool
-                )
+                ), False
             else:
                 return ToolCallResponse(
                     success=False,
                     error=f"http_error_{response.status_code}",
                     server_name=""
-                )
-        except httpx.TimeoutException:
+                ), response.status_code >= 500 and response.status_code != 501
+        except httpx.TimeoutException as e:
+            self.metrics.upstream_duration.observe(time.perf_counter() - started, server=config.name, result="timeout")
             return ToolCallResponse(
                 success=False,
                 error="timeout",
                 server_name=""
-            )
+            ), isinstance(e, httpx.ConnectTimeout)
         except httpx.RequestError as e:
+            self.metrics.upstream_duration.observe(
+                time.perf_counter() - started, server=config.name, result="connection_error"
+            )
             return ToolCallResponse(
                 success=False,
                 error=str(e),
                 server_name=""
+            ), isinstance(e, httpx.TransportError)
+        except asyncio.CancelledError:
+            replica_ok = None  # hedge perdedor ou chamador desistiu: não conta como falha
+            raise
+        finally:
+            replica_done(replica_ok)
+
+    async def _call_session(
+        self,
+        config: MCPServerConfig,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        base_url: Optional[str],
+        replica_done: Callable[[Optional[bool]], None],
+        remaining: Optional[float]
+    ) -> Tuple[ToolCallResponse, bool]:
+        """Call a tool with ``tools/call`` on the server's MCP session (see :meth:`_call_upstream`).
+
+        The result is the MCP ``CallToolResult`` (``content``,
+        ``structuredContent``...). A tool reporting ``isError`` fails with
+        ``tool_error`` and a JSON-RPC error answer with ``mcp_error_<code>``;
+        neither is retried nor held against the replica.
+        """
+        session = self.registry.sessions.session_for(config, base_url)
+        self.state.incr("upstream_calls_total")
+        started = time.perf_counter()
+        replica_ok: Optional[bool] = False
+        try:
+            try:
+                result = await session.request(
+                    "tools/call",
+                    {"name": tool_name, "arguments": arguments},
+                    timeout=request_timeout(config, remaining).read,
+                )
+            except MCPError as e:
+                replica_ok = True
+                self.metrics.upstream_duration.observe(
+                    time.perf_counter() - started, server=config.name, result="mcp_error"
+                )
+                return ToolCallResponse(
+                    success=False,
+                    result={"message": e.message, "data": e.data},
+                    error=f"mcp_error_{e.code}",
+                    server_name=""
+                ), False
+            except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+                self.metrics.upstream_duration.observe(
+                    time.perf_counter() - started, server=config.name, result="timeout"
+                )
+                return ToolCallResponse(
+                    success=False,
+                    error="timeout",
+                    server_name=""
+                ), isinstance(e, httpx.ConnectTimeout)
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                replica_ok = status < 500
+                self.metrics.upstream_duration.observe(
+                    time.perf_counter() - started, server=config.name, result=f"http_error_{status}"
+                )
+                return ToolCallResponse(
+                    success=False,
+                    error=f"http_error_{status}",
+                    server_name=""
+                ), status >= 500 and status != 501
+            except httpx.RequestError as e:
+                self.metrics.upstream_duration.observe(
+                    time.perf_counter() - started, server=config.name, result="connection_error"
+                )
+                return ToolCallResponse(
+                    success=False,
+                    error=str(e),
+                    server_name=""
+                ), isinstance(e, httpx.TransportError)
+
+            replica_ok = True
+            failed = bool(result.get("isError"))
+            self.metrics.upstream_duration.observe(
+                time.perf_counter() - started, server=config.name, result=TOOL_ERROR if failed else "ok"
             )
+            self._record_latency(config, tool_name, started)
+            return ToolCallResponse(
+                success=not failed,
+                result=result,
+                error=TOOL_ERROR if failed else None,
+                server_name=""  # será preenchido em execute_tool
+            ), False
+        except asyncio.CancelledError:
+            replica_ok = None  # hedge perdedor ou chamador desistiu: não conta como falha
+            raise
+        finally:
+            replica_done(replica_ok)
+
+    def _record_latency(self, config: MCPServerConfig, tool_name: str, started: float) -> None:
+        """Feed a successful call's latency to the window hedging percentiles come from."""
+        if config.hedge_percentile:
+            full_name = f"{config.name}.{tool_name}"
+            window = self._latency.get(full_name)
+            if window is None:
+                window = self._latency[full_name] = LatencyWindow()
+            window.record((time.perf_counter() - started) * 1000)
 
-    
     async def shutdown(self) -> None:
-        """Close the shared HTTP client."""
-        await self._client.aclose()
+        """Cancel in-flight shared calls (connection pools belong to the registry)."""
+        for task in list(self._inflight.values()):
+            task.cancel()
         logger.info("router_shutdown_complete")
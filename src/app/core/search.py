@@ -0,0 +1,212 @@
+"""Índice invertido com ranking BM25 para busca de ferramentas."""
+
+import heapq
+import math
+import re
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Tuple
+
+from app.models.schemas import ToolSchema
+
+# peso de cada campo na frequência dos termos (BM25F simplificado)
+NAME_WEIGHT = 3.0
+PARAMETER_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+
+_CAMEL = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+_WORD = re.compile(r"[^\W_]+")
+
+# palavras frequentes demais para distinguir ferramentas (descrições em inglês)
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this "
+    "to was were will with which you your can if into not".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase terms, breaking snake_case, kebab-case and camelCase."""
+    return [
+        word
+        for word in (w.lower() for w in _WORD.findall(_CAMEL.sub(" ", text)))
+        if word not in STOPWORDS
+    ]
+
+
+def parameter_names(parameters: Dict[str, Any]) -> List[str]:
+    """Return the parameter names of a tool (JSON Schema ``properties`` or a flat mapping)."""
+    properties = parameters.get("properties")
+    if isinstance(properties, dict):
+        return list(properties)
+    return [name for name in parameters if name not in ("type", "required", "additionalProperties")]
+
+
+class ToolSearchIndex:
+    """Inverted index over tool names, descriptions and parameter names, ranked with BM25.
+
+    Tools are added and removed one at a time, so a refresh only touches
+    the tools that changed. Each term keeps, built on first use, its
+    postings ordered by score contribution, so a query stops reading a
+    term once the rest of its postings cannot reach the top ``k``.
+
+    Terms found in more than ``COMMON_TERM_RATIO`` of the tools (and in
+    more than ``COMMON_TERM_CANDIDATES`` of them; "common" terms) only add to the score of tools matched by rarer query terms,
+    as Lucene's CommonTermsQuery does; a query made only of common terms
+    ranks the ``COMMON_TERM_CANDIDATES`` tools where its rarest term
+    weighs most. This keeps every query's cost bounded at any catalog
+    size. The average length used by BM25 is refreshed when it drifts by
+    more than ``AVERAGE_LEN_DRIFT`` from the value the ordered postings
+    used.
+    """
+
+    AVERAGE_LEN_DRIFT = 0.1
+    # termos presentes em mais que esta fração das ferramentas são "comuns"
+    COMMON_TERM_RATIO = 0.05
+    COMMON_TERM_CANDIDATES = 1000
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # termo -> {nome completo -> frequência ponderada}
+        self._postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._doc_terms: Dict[str, Dict[str, float]] = {}
+        self._doc_len: Dict[str, float] = {}
+        self._total_len = 0.0
+        # termo -> [(contribuição, nome completo)] em ordem decrescente
+        self._impacts: Dict[str, List[Tuple[float, str]]] = {}
+        self._average_len = 0.0
+
+    @classmethod
+    def build(cls, tools: Iterable[ToolSchema]) -> "ToolSearchIndex":
+        """Build a new index from a list of tools (safe to run in a worker thread)."""
+        index = cls()
+        for tool in tools:
+            index.add(tool)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def add(self, tool: ToolSchema) -> None:
+        """Index a tool, replacing its previous entry if any."""
+        self.remove(tool.full_name)
+
+        terms: Dict[str, float] = defaultdict(float)
+        for term in tokenize(tool.full_name):
+            terms[term] += NAME_WEIGHT
+        for name in parameter_names(tool.parameters):
+            for term in tokenize(name):
+                terms[term] += PARAMETER_WEIGHT
+        for term in tokenize(tool.description or ""):
+            terms[term] += DESCRIPTION_WEIGHT
+
+        for term, frequency in terms.items():
+            self._postings[term][tool.full_name] = frequency
+            self._impacts.pop(term, None)
+        self._doc_terms[tool.full_name] = terms
+        length = sum(terms.values())
+        self._doc_len[tool.full_name] = length
+        self._total_len += length
+
+    def remove(self, full_name: str) -> None:
+        """Drop a tool from the index (no-op when absent)."""
+        terms = self._doc_terms.pop(full_name, None)
+        if terms is None:
+            return
+        for term in terms:
+            self._impacts.pop(term, None)
+            postings = self._postings[term]
+            postings.pop(full_name, None)
+            if not postings:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(full_name)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Return up to ``k`` ``(full_name, score)`` pairs, best first.
+
+        Terms are read rarest first, each in decreasing order of
+        contribution. Once a term's next posting plus the most the later
+        terms could add falls below the ``k``-th best score so far, no
+        unseen tool can enter the results: the rest of that term is only
+        looked up for tools already found.
+        """
+        count = len(self._doc_len)
+        if not count or k < 1:
+            return []
+
+        weighted: List[Tuple[float, str, Dict[str, float]]] = []
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings:
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                weighted.append((idf, term, postings))
+        if not weighted:
+            return []
+        weighted.sort(key=lambda item: item[0], reverse=True)
+
+        average_len = self._current_average_len()
+        # idf * (k1 + 1) é o máximo que um termo pode somar à nota de uma ferramenta
+        later_bound = sum(idf for idf, _, _ in weighted) * (self.k1 + 1)
+        scores: Dict[str, float] = {}
+        threshold = 0.0
+        next_check = k
+        for idf, term, postings in weighted:
+            later_bound -= idf * (self.k1 + 1)
+            common = len(postings) > max(self.COMMON_TERM_RATIO * count, self.COMMON_TERM_CANDIDATES)
+            if common and scores:
+                # termo comum só pontua ferramentas achadas pelos termos raros (como CommonTermsQuery)
+                for candidate in scores:
+                    frequency = postings.get(candidate)
+                    if frequency:
+                        scores[candidate] += idf * self._impact(frequency, candidate, average_len)
+                continue
+
+            impacts = self._term_impacts(term, postings, average_len)
+            if common:
+                # só termos comuns na consulta: parte das ferramentas em que eles mais pesam
+                impacts = impacts[:self.COMMON_TERM_CANDIDATES]
+            position = 0
+            while position < len(impacts):
+                chunk = impacts[position:position + 64]
+                if len(scores) >= next_check:
+                    # recalcula o limiar em intervalos crescentes: custo linear no total
+                    threshold = heapq.nlargest(k, scores.values())[-1]
+                    next_check = len(scores) + max(64, len(scores) // 4)
+                if len(scores) >= k and idf * chunk[0][0] + later_bound <= threshold:
+                    # nenhuma ferramenta nova alcança o top k: só completa as já encontradas
+                    read = {name for _, name in impacts[:position]}
+                    for candidate in scores.keys() - read:
+                        frequency = postings.get(candidate)
+                        if frequency:
+                            scores[candidate] += idf * self._impact(frequency, candidate, average_len)
+                    break
+                for impact, full_name in chunk:
+                    scores[full_name] = scores.get(full_name, 0.0) + idf * impact
+                position += len(chunk)
+            if len(scores) >= k:
+                threshold = heapq.nlargest(k, scores.values())[-1]
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def _current_average_len(self) -> float:
+        """Return the average tool length used for scoring, refreshing it on drift."""
+        actual = self._total_len / len(self._doc_len) or 1.0
+        if abs(actual - self._average_len) > self.AVERAGE_LEN_DRIFT * self._average_len:
+            self._average_len = actual
+            self._impacts.clear()
+        return self._average_len
+
+    def _impact(self, frequency: float, full_name: str, average_len: float) -> float:
+        """BM25 term-frequency component of one posting."""
+        norm = self.k1 * (1 - self.b + self.b * self._doc_len[full_name] / average_len)
+        return frequency * (self.k1 + 1) / (frequency + norm)
+
+    def _term_impacts(self, term: str, postings: Dict[str, float], average_len: float) -> List[Tuple[float, str]]:
+        """Return a term's postings ordered by contribution, building them on first use."""
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            impacts = sorted(
+                ((self._impact(frequency, name, average_len), name) for name, frequency in postings.items()),
+                reverse=True,
+            )
+            self._impacts[term] = impacts
+        return impacts
@@ -0,0 +1,312 @@
+"""Snapshot binário do catálogo e do status dos servidores, lido via mmap.
+
+Formato (little-endian)::
+
+    magic (8 bytes) | versão do formato (u32) | tamanho do índice (u32)
+    índice JSON (UTF-8): um objeto por servidor, sem as ferramentas
+    por servidor: nomes (separados por "\\n") | tabela u32 (deslocamento, tamanho) | registros
+
+Cada registro é o ``ToolSchema`` em JSON, os mesmos bytes que ``/tools``
+devolve. Carregar um snapshot lê só o índice, os nomes e as tabelas; os
+registros ficam no arquivo mapeado e são decodificados na primeira vez
+que alguém usa a ferramenta (o page cache é compartilhado entre os
+processos que leem o mesmo arquivo).
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections.abc import MutableMapping
+from datetime import UTC, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.models.schemas import MCPServerConfig, MCPServerInfo, ToolSchema
+
+MAGIC = b"MCP1SNAP"
+FORMAT_VERSION = 2
+_HEADER = struct.Struct("<8sII")
+
+
+class SnapshotError(Exception):
+    """A snapshot file is missing, truncated or of an unknown format."""
+
+
+def config_digest(config: MCPServerConfig) -> str:
+    """Fingerprint of a server's configuration (a snapshot only applies to the same config)."""
+    return hashlib.sha256(config.model_dump_json().encode("utf-8")).hexdigest()[:32]
+
+
+def _u32_table(values: List[int]) -> bytes:
+    table = array("I", values)
+    if sys.byteorder == "big":
+        table.byteswap()
+    return table.tobytes()
+
+
+def encode_snapshot(
+    servers: Iterable[MCPServerInfo],
+    records_by_server: Dict[str, List[Tuple[str, bytes, List[str]]]],
+    catalog_version: int,
+    generation: int = 0,
+    upstream: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> bytes:
+    """Serialize server statuses and tool records into the snapshot format.
+
+    ``records_by_server`` maps each server to ``(short name, ToolSchema
+    JSON, tags)`` tuples; ``upstream`` optionally carries, per server, what is
+    needed to revalidate its tool list cheaply (body digest and HTTP
+    validators).
+    """
+    upstream = upstream or {}
+    blob: List[bytes] = []
+    position = 0
+    entries: List[Dict[str, Any]] = []
+    for server_info in servers:
+        name = server_info.config.name
+        records = sorted(records_by_server.get(name, []))
+        names = "\n".join(short for short, _, _ in records).encode("utf-8")
+        table_start = position + len(names)
+        offset = table_start + 8 * len(records)
+        table: List[int] = []
+        tags: Dict[str, List[int]] = {}
+        digest = hashlib.sha256(names)
+        for index, (_, record, tool_tags) in enumerate(records):
+            table += [offset, len(record)]
+            offset += len(record)
+            digest.update(record)
+            for tag in tool_tags:
+                tags.setdefault(tag, []).append(index)
+        blob += [names, _u32_table(table), *(record for _, record, _ in records)]
+        entries.append({
+            "name": name,
+            # a configuração fica de fora: vem do config.yaml de quem lê (e pode ter segredos)
+            "status": server_info.model_dump(mode="json", exclude={"config"}),
+            "config_digest": config_digest(server_info.config),
+            "digest": digest.hexdigest(),
+            "upstream": upstream.get(name, {}),
+            "count": len(records),
+            "names": [position, len(names)],
+            "table": table_start,
+            "tags": tags,
+        })
+        position = offset
+
+    index = json.dumps(
+        {
+            "generation": generation,
+            "catalog_version": catalog_version,
+            "written_at": datetime.now(UTC).isoformat(),
+            "servers": entries,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return b"".join([_HEADER.pack(MAGIC, FORMAT_VERSION, len(index)), index, *blob])
+
+
+def write_snapshot(path: str, data: bytes) -> None:
+    """Replace ``path`` with ``data`` atomically (readers see the old or the new file, never a mix)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ServerEntry:
+    """One server of a snapshot: its status fields, digests and where its tools are."""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.name: str = data["name"]
+        self.status: Dict[str, Any] = data["status"]
+        self.config_digest: str = data["config_digest"]
+        self.digest: str = data["digest"]
+        self.upstream: Dict[str, Any] = data["upstream"]
+        self.count: int = data["count"]
+        self.tags: Dict[str, List[int]] = data["tags"]
+        self._names: Tuple[int, int] = tuple(data["names"])
+        self._table_start: int = data["table"]
+
+
+class SnapshotReader:
+    """A snapshot file mapped in memory.
+
+    Opening parses only the index; names, tables and tool records are
+    read from the mapped pages on demand. Writers replace the file
+    instead of rewriting it, so the mapping stays valid for as long as
+    the reader is referenced (tools not yet decoded keep it alive).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < _HEADER.size:
+                raise SnapshotError(f"snapshot too short: {path}")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # identifica o arquivo: um replace cria outro inode
+        self.file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        try:
+            magic, version, index_len = _HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise SnapshotError(f"unknown snapshot format: {magic!r} v{version}")
+            self._blob_start = _HEADER.size + index_len
+            if self._blob_start > len(self._mm):
+                raise SnapshotError(f"truncated snapshot: {path}")
+            index = json.loads(self._mm[_HEADER.size:self._blob_start])
+        except Exception:
+            self._mm.close()
+            raise
+        self.generation: int = index["generation"]
+        self.catalog_version: int = index["catalog_version"]
+        self.written_at: str = index["written_at"]
+        self.servers: Dict[str, ServerEntry] = {
+            entry["name"]: ServerEntry(entry) for entry in index["servers"]
+        }
+        self._tables: Dict[str, array] = {}
+
+    @property
+    def tools_count(self) -> int:
+        return sum(entry.count for entry in self.servers.values())
+
+    def tool_names(self, server_name: str) -> List[str]:
+        """Return the short names of a server's tools, in record order."""
+        entry = self.servers[server_name]
+        start, length = entry._names
+        if not entry.count:
+            return []
+        start += self._blob_start
+        return self._mm[start:start + length].decode("utf-8").split("\n")
+
+    def record(self, server_name: str, index: int) -> bytes:
+        """Return the JSON record of a server's ``index``-th tool."""
+        offset, length = self._table(server_name)[2 * index:2 * index + 2]
+        start = self._blob_start + offset
+        return self._mm[start:start + length]
+
+    def tool(self, server_name: str, index: int) -> ToolSchema:
+        """Decode a server's ``index``-th tool."""
+        return ToolSchema.model_validate_json(self.record(server_name, index))
+
+    def tools(self, server_name: str) -> Iterator[ToolSchema]:
+        """Decode every tool of a server."""
+        entry = self.servers.get(server_name)
+        for index in range(entry.count if entry else 0):
+            yield self.tool(server_name, index)
+
+    def close(self) -> None:
+        """Unmap the file (only once no tool of it is waiting to be decoded)."""
+        self._mm.close()
+
+    def _table(self, server_name: str) -> array:
+        table = self._tables.get(server_name)
+        if table is None:
+            entry = self.servers[server_name]
+            start = self._blob_start + entry._table_start
+            table = array("I")
+            table.frombytes(self._mm[start:start + 8 * entry.count])
+            if sys.byteorder == "big":
+                table.byteswap()
+            self._tables[server_name] = table
+        return table
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def file_id(path: str) -> Optional[Tuple[int, int, int]]:
+    """Return the identity of the file at ``path`` (None when missing), to detect replacements."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class ToolMap(MutableMapping):
+    """Tools by full name, where tools restored from a snapshot are decoded on first access.
+
+    Behaves like a ``Dict[str, ToolSchema]``. :meth:`add_lazy` registers
+    tools by their place in a :class:`SnapshotReader`; reading one decodes
+    and keeps it, writing or deleting it drops the snapshot reference.
+    """
+
+    def __init__(self) -> None:
+        self._tools: Dict[str, ToolSchema] = {}
+        self._lazy: Dict[str, Tuple[SnapshotReader, str, int]] = {}
+
+    def add_lazy(self, reader: SnapshotReader, server_name: str, full_names: List[str]) -> None:
+        """Register a server's tools still encoded in a snapshot, in record order."""
+        for full_name in full_names:
+            self._tools.pop(full_name, None)
+        self._lazy.update(zip(full_names, ((reader, server_name, index) for index in range(len(full_names)))))
+
+    def __getitem__(self, full_name: str) -> ToolSchema:
+        tool = self._tools.get(full_name)
+        if tool is not None:
+            return tool
+        reader, server_name, index = self._lazy[full_name]
+        tool = reader.tool(server_name, index)
+        # grava antes de tirar da fila: a ferramenta nunca some no meio do caminho
+        self._tools[full_name] = tool
+        self._lazy.pop(full_name, None)
+        return tool
+
+    def __setitem__(self, full_name: str, tool: ToolSchema) -> None:
+        self._tools[full_name] = tool
+        self._lazy.pop(full_name, None)
+
+    def __delitem__(self, full_name: str) -> None:
+        found = self._tools.pop(full_name, None) is not None
+        found = self._lazy.pop(full_name, None) is not None or found
+        if not found:
+            raise KeyError(full_name)
+
+    def __contains__(self, full_name: object) -> bool:
+        return full_name in self._tools or full_name in self._lazy
+
+    def __iter__(self) -> Iterator[str]:
+        # cópia: ler uma ferramenta durante a iteração move ela entre os dicionários
+        return iter([*self._tools, *self._lazy])
+
+    def __len__(self) -> int:
+        return len(self._tools) + len(self._lazy)
+
+    @property
+    def pending(self) -> int:
+        """Number of tools not decoded yet."""
+        return len(self._lazy)
+
+    def records(self) -> Iterator[Tuple[str, str, bytes]]:
+        """Yield ``(server, short name, JSON record)`` of every tool without decoding any."""
+        for tool in list(self._tools.values()):
+            yield tool.server_name, tool.name, tool.model_dump_json().encode("utf-8")
+        for full_name, (reader, server_name, index) in list(self._lazy.items()):
+            yield server_name, full_name[len(server_name) + 1:], reader.record(server_name, index)
+
+    def loader(self) -> Callable[[], List[ToolSchema]]:
+        """Return a function listing every tool, safe to run in a worker thread.
+
+        It decodes pending records without storing them, so the map is
+        never touched outside the event loop.
+        """
+        decoded = list(self._tools.values())
+        lazy = list(self._lazy.values())
+        return lambda: decoded + [reader.tool(server_name, index) for reader, server_name, index in lazy]
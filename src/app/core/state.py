@@ -0,0 +1,418 @@
+"""Estado compartilhado entre workers do Hub (rate limit, circuit breaker, contadores)."""
+
+import asyncio
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from urllib.parse import unquote, urlparse
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+
+class StateBackend:
+    """In-process state for rate limiting, circuit breakers and counters.
+
+    This is the default backend and only sees the current process. Shared
+    backends keep the same synchronous interface (the request hot path
+    never waits on the network) and reconcile with each other in the
+    background.
+    """
+
+    # True quando os contadores já são globais (não somar os de cada worker)
+    shared = False
+
+    def __init__(self) -> None:
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._circuits: Dict[str, float] = {}
+        self._failures: Dict[str, int] = defaultdict(int)
+
+    async def start(self) -> None:
+        """Start background synchronization, if the backend needs it."""
+
+    async def close(self) -> None:
+        """Flush pending state and release resources."""
+
+    # Contadores
+    def incr(self, name: str, amount: int = 1) -> None:
+        """Increment a named counter."""
+        self._counters[name] += amount
+
+    def counters(self) -> Dict[str, int]:
+        """Return the current value of every counter."""
+        return dict(self._counters)
+
+    def counter(self, name: str) -> int:
+        """Return the current value of one counter."""
+        return self._counters.get(name, 0)
+
+    # Circuit breaker
+    def record_failure(self, server_name: str) -> int:
+        """Count a failed call to a server and return its consecutive failures."""
+        self._failures[server_name] += 1
+        return self._failures[server_name]
+
+    def reset_failures(self, server_name: str) -> None:
+        """Forget a server's consecutive failures after a successful call."""
+        self._failures.pop(server_name, None)
+
+    def failure_count(self, server_name: str) -> int:
+        """Return a server's consecutive failures."""
+        return self._failures.get(server_name, 0)
+
+    def open_circuit(self, server_name: str, until: float) -> None:
+        """Mark a server's circuit open until the given epoch time."""
+        self._circuits[server_name] = until
+
+    def close_circuit(self, server_name: str) -> None:
+        """Close a server's circuit."""
+        self._circuits.pop(server_name, None)
+
+    def circuit_open_until(self, server_name: str) -> float:
+        """Return the epoch time until which a server's circuit is open (0 if closed)."""
+        return self._circuits.get(server_name, 0.0)
+
+    def open_circuits(self) -> Dict[str, float]:
+        """Return the circuits that are currently open."""
+        now = time.time()
+        return {name: until for name, until in self._circuits.items() if until > now}
+
+    # Rate limit
+    def allow_rate(self, key: str, limit: int, window_seconds: int = 60, cost: int = 1) -> Tuple[bool, float]:
+        """Check ``cost`` requests for a key against a quota shared by all workers.
+
+        Returns whether the request fits in the current window and the
+        seconds until the window resets. A single process is already fully
+        limited by its local token bucket, so this backend always allows.
+        """
+        return True, 0.0
+
+
+class RedisProtocolError(Exception):
+    """Error reply or protocol violation from a Redis-protocol server."""
+
+
+class RedisProtocolClient:
+    """Minimal asyncio client for the Redis serialization protocol (RESP2).
+
+    Only what the state backend needs: one connection and pipelined
+    commands, so each synchronization is a single network round-trip.
+    """
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """Send commands in one write and read all replies in order."""
+        if not commands:
+            return []
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    await self._connect()
+                return await asyncio.wait_for(self._roundtrip(commands), self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, RedisProtocolError):
+                await self._disconnect()
+                raise
+
+    async def close(self) -> None:
+        """Close the connection."""
+        async with self._lock:
+            await self._disconnect()
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        setup: List[Sequence[Any]] = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            await asyncio.wait_for(self._roundtrip(setup), self.timeout)
+
+    async def _disconnect(self) -> None:
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _roundtrip(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        self._writer.write(b"".join(self._encode(command) for command in commands))
+        await self._writer.drain()
+        replies = [await self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisProtocolError):
+                raise reply
+        return replies
+
+    @staticmethod
+    def _encode(command: Sequence[Any]) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RedisProtocolError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisProtocolError(f"unexpected reply type: {line!r}")
+
+
+class RedisStateBackend(StateBackend):
+    """State shared through a Redis-protocol server with local write-behind caching.
+
+    Reads and writes on the request path only touch local dictionaries.
+    A background task flushes local deltas (``INCRBY``/``HINCRBY``/``HSET``/
+    ``HDEL``, all atomic on the server) and pulls the merged global view in
+    one pipelined round-trip every ``sync_interval`` seconds. If the server
+    is unreachable the backend keeps working with local state only.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, key_prefix: str = "mcp_one", sync_interval: float = 0.25):
+        super().__init__()
+        self.client = RedisProtocolClient(url)
+        self.key_prefix = key_prefix
+        self.sync_interval = sync_interval
+        self.connected = False
+        self._task: Optional[asyncio.Task] = None
+        self._remote_counters: Dict[str, int] = {}
+        self._pending_counters: Dict[str, int] = defaultdict(int)
+        self._sending_counters: Dict[str, int] = {}
+        self._pending_circuits: Dict[str, float] = {}
+        self._remote_failures: Dict[str, int] = {}
+        self._pending_failures: Dict[str, int] = defaultdict(int)
+        self._sending_failures: Dict[str, int] = {}
+        self._pending_failure_resets: Set[str] = set()
+        self._rl_window = 0
+        self._rl_seen: Dict[str, int] = {}
+        self._rl_pending: Dict[str, int] = defaultdict(int)
+        self._rl_sending: Dict[str, int] = {}
+
+    async def start(self) -> None:
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._sync_loop())
+        logger.info("state_backend_started", backend="redis", host=self.client.host, port=self.client.port)
+
+    async def close(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.sync()
+        except Exception as e:
+            logger.warning("state_backend_final_sync_failed", error=str(e))
+        await self.client.close()
+
+    # Contadores
+    def incr(self, name: str, amount: int = 1) -> None:
+        self._pending_counters[name] += amount
+
+    def counters(self) -> Dict[str, int]:
+        merged = dict(self._remote_counters)
+        for local in (self._sending_counters, self._pending_counters):
+            for name, amount in local.items():
+                merged[name] = merged.get(name, 0) + amount
+        return merged
+
+    def counter(self, name: str) -> int:
+        return (
+            self._remote_counters.get(name, 0)
+            + self._sending_counters.get(name, 0)
+            + self._pending_counters.get(name, 0)
+        )
+
+    # Circuit breaker
+    def record_failure(self, server_name: str) -> int:
+        self._pending_failures[server_name] += 1
+        return self.failure_count(server_name)
+
+    def reset_failures(self, server_name: str) -> None:
+        self._remote_failures.pop(server_name, None)
+        self._sending_failures.pop(server_name, None)
+        self._pending_failures.pop(server_name, None)
+        self._pending_failure_resets.add(server_name)
+
+    def failure_count(self, server_name: str) -> int:
+        return (
+            self._remote_failures.get(server_name, 0)
+            + self._sending_failures.get(server_name, 0)
+            + self._pending_failures.get(server_name, 0)
+        )
+
+    def open_circuit(self, server_name: str, until: float) -> None:
+        super().open_circuit(server_name, until)
+        self._pending_circuits[server_name] = until
+
+    def close_circuit(self, server_name: str) -> None:
+        super().close_circuit(server_name)
+        self._pending_circuits[server_name] = 0.0
+
+    # Rate limit
+    def allow_rate(self, key: str, limit: int, window_seconds: int = 60, cost: int = 1) -> Tuple[bool, float]:
+        now = time.time()
+        window = int(now // window_seconds)
+        if window != self._rl_window:
+            self._rl_window = window
+            self._rl_seen.clear()
+            self._rl_sending = {}
+            self._rl_pending.clear()
+
+        reset_after = (window + 1) * window_seconds - now
+        used = self._rl_seen.get(key, 0) + self._rl_sending.get(key, 0) + self._rl_pending.get(key, 0)
+        if used >= limit:
+            return False, reset_after
+        self._rl_pending[key] += cost
+        return True, reset_after
+
+    async def sync(self) -> None:
+        """Push local deltas and pull the global view in one pipelined round-trip."""
+        counters, self._pending_counters = self._pending_counters, defaultdict(int)
+        circuits, self._pending_circuits = self._pending_circuits, {}
+        failures, self._pending_failures = self._pending_failures, defaultdict(int)
+        resets, self._pending_failure_resets = self._pending_failure_resets, set()
+        rl_window, rl_pending = self._rl_window, self._rl_pending
+        self._rl_pending = defaultdict(int)
+
+        counters_key = f"{self.key_prefix}:counters"
+        circuits_key = f"{self.key_prefix}:circuits"
+        failures_key = f"{self.key_prefix}:failures"
+        commands: List[Sequence[Any]] = []
+        for name, amount in counters.items():
+            commands.append(("HINCRBY", counters_key, name, amount))
+        for server_name, until in circuits.items():
+            if until > 0:
+                commands.append(("HSET", circuits_key, server_name, repr(until)))
+            else:
+                commands.append(("HDEL", circuits_key, server_name))
+        rl_keys = list(rl_pending.items())
+        for key, amount in rl_keys:
+            rl_key = f"{self.key_prefix}:rl:{rl_window}:{key}"
+            commands.append(("INCRBY", rl_key, amount))
+            commands.append(("EXPIRE", rl_key, 120))
+        # zera antes de somar: falhas registradas depois do reset continuam contando
+        for server_name in resets:
+            commands.append(("HDEL", failures_key, server_name))
+        for server_name, amount in failures.items():
+            commands.append(("HINCRBY", failures_key, server_name, amount))
+        commands.append(("HGETALL", counters_key))
+        commands.append(("HGETALL", circuits_key))
+        commands.append(("HGETALL", failures_key))
+
+        # enquanto o round-trip não termina, os deltas enviados continuam visíveis
+        self._sending_counters = counters
+        self._sending_failures = dict(failures)
+        self._rl_sending = dict(rl_pending)
+        try:
+            replies = await self.client.pipeline(commands)
+        except Exception:
+            # devolve os deltas para a próxima tentativa
+            for name, amount in counters.items():
+                self._pending_counters[name] += amount
+            for server_name, until in circuits.items():
+                self._pending_circuits.setdefault(server_name, until)
+            for server_name in resets:
+                if server_name not in self._pending_failures:
+                    self._pending_failure_resets.add(server_name)
+            for server_name, amount in failures.items():
+                if server_name not in self._pending_failure_resets:
+                    self._pending_failures[server_name] += amount
+            if rl_window == self._rl_window:
+                for key, amount in rl_pending.items():
+                    self._rl_pending[key] += amount
+            raise
+        finally:
+            self._sending_counters = {}
+            self._sending_failures = {}
+            if rl_window == self._rl_window:
+                self._rl_sending = {}
+
+        offset = len(counters) + len(circuits)
+        if rl_window == self._rl_window:
+            for i, (key, _) in enumerate(rl_keys):
+                self._rl_seen[key] = int(replies[offset + 2 * i])
+
+        self._remote_counters = self._pairs(replies[-3], int)
+        remote_failures = self._pairs(replies[-1], int)
+        for server_name in self._pending_failure_resets:
+            remote_failures.pop(server_name, None)
+        self._remote_failures = remote_failures
+        remote_circuits = self._pairs(replies[-2], float)
+        # alterações locais feitas durante o round-trip continuam valendo
+        for server_name, until in self._pending_circuits.items():
+            if until > 0:
+                remote_circuits[server_name] = until
+            else:
+                remote_circuits.pop(server_name, None)
+        self._circuits = remote_circuits
+
+    async def _sync_loop(self) -> None:
+        while True:
+            try:
+                await self.sync()
+                if not self.connected:
+                    logger.info("state_backend_connected", host=self.client.host)
+                self.connected = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.connected:
+                    logger.warning("state_backend_sync_failed", error=str(e))
+                self.connected = False
+            await asyncio.sleep(self.sync_interval)
+
+    @staticmethod
+    def _pairs(reply: Optional[List[str]], cast: Any) -> Dict[str, Any]:
+        reply = reply or []
+        return {reply[i]: cast(reply[i + 1]) for i in range(0, len(reply) - 1, 2)}
+
+
+def create_state_backend(state_config: Dict[str, Any]) -> StateBackend:
+    """Build the state backend selected by the ``state`` section of config.yaml."""
+    backend = state_config.get("backend", "memory")
+    if backend == "redis":
+        return RedisStateBackend(
+            url=state_config.get("redis_url", "redis://localhost:6379/0"),
+            key_prefix=state_config.get("key_prefix", "mcp_one"),
+            sync_interval=float(state_config.get("sync_interval", 0.25)),
+        )
+    if backend != "memory":
+        logger.warning("unknown_state_backend", backend=backend)
+    return StateBackend()
@@ -0,0 +1,123 @@
+"""Tempo por fase de cada request, exposto no header ``Server-Timing``."""
+
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+_current: ContextVar[Optional["RequestTimer"]] = ContextVar("request_timer", default=None)
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+
+class RequestTimer:
+    """Durations of the phases of one request.
+
+    Phases are summed by name, so a phase entered several times (or by
+    concurrent tasks of the same request) reports its total.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.handler_started: Optional[float] = None
+        self.handler_finished: Optional[float] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add ``seconds`` to phase ``name``."""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def header(self, now: Optional[float] = None) -> str:
+        """Return the ``Server-Timing`` header value (durations in milliseconds).
+
+        ``validate`` is the time before the endpoint ran (routing, body
+        parsing and validation) and ``serialize`` the time between the
+        endpoint returning and the response headers being sent.
+        """
+        now = time.perf_counter() if now is None else now
+        phases: Dict[str, float] = {}
+        if self.handler_started is not None:
+            phases["validate"] = self.handler_started - self.started
+        phases.update(self.phases)
+        if self.handler_finished is not None:
+            phases["serialize"] = now - self.handler_finished
+        phases["total"] = now - self.started
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in phases.items())
+
+
+def current_timer() -> Optional[RequestTimer]:
+    """Return the timer of the current request (None when timing is off)."""
+    return _current.get()
+
+
+def record(name: str, seconds: float) -> None:
+    """Add ``seconds`` to phase ``name`` of the current request, if timed."""
+    timer = _current.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a block as phase ``name`` of the current request (no-op when timing is off)."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+def timed_endpoint(endpoint: F) -> F:
+    """Mark where an endpoint starts and returns, to split validation and serialization."""
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        timer = _current.get()
+        if timer is None:
+            return await endpoint(*args, **kwargs)
+        timer.handler_started = time.perf_counter()
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            timer.handler_finished = time.perf_counter()
+
+    return wrapper  # type: ignore[return-value]
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding a ``Server-Timing`` header when ``enabled()`` is true.
+
+    For streamed responses the header is sent before the body, so
+    ``total`` is the time to the first byte.
+    """
+
+    def __init__(self, app: ASGIApp, enabled: Callable[[], bool]):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.enabled():
+            await self.app(scope, receive, send)
+            return
+
+        timer = RequestTimer()
+        token = _current.set(timer)
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timer.header().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
@@ -0,0 +1,236 @@
+"""Coordenação entre workers: um líder consulta os upstreams e publica o catálogo."""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import structlog
+
+from app.core.metrics import MetricsRegistry
+from app.core.registry import MCPRegistry
+from app.core.snapshot import SnapshotError, SnapshotReader, file_id, write_snapshot
+from app.core.state import StateBackend
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = structlog.get_logger(__name__)
+
+
+class WorkerGroup:
+    """The worker processes of one hub, coordinated through a shared directory.
+
+    The worker holding an exclusive lock on ``leader.lock`` is the
+    leader: only it probes upstreams and refreshes tool lists, and it
+    publishes the catalog and server statuses to ``catalog.snapshot``
+    whenever they change. The other workers never probe; they load that
+    snapshot each time it is replaced and route calls from it. The kernel
+    frees the lock when the leader exits, so another worker takes over
+    within ``sync_interval``. Every worker also writes its counters and
+    labeled metrics to ``metrics/<pid>.json``, so any of them can report
+    totals for all.
+    """
+
+    SNAPSHOT_FILE = "catalog.snapshot"
+    LOCK_FILE = "leader.lock"
+
+    def __init__(self, directory: str, sync_interval: float = 1.0):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.pid = os.getpid()
+        self.leader = False
+        self.snapshot_path = os.path.join(directory, self.SNAPSHOT_FILE)
+        self.metrics_dir = os.path.join(directory, "metrics")
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        self._lock_fd: Optional[int] = None
+        self._registry: Optional[MCPRegistry] = None
+        self._state: Optional[StateBackend] = None
+        self._metrics: Optional[MetricsRegistry] = None
+        self._task: Optional[asyncio.Task] = None
+        self._published_key: Optional[Tuple[Any, ...]] = None
+        self._generation = 0
+        self._loaded_id: Optional[Tuple[int, int, int]] = None
+        self.snapshots_published_total = 0
+        self.snapshots_loaded_total = 0
+
+    def elect(self) -> bool:
+        """Try to become the leader (non-blocking); return whether this worker leads."""
+        if self.leader:
+            return True
+        if fcntl is None:
+            # sem flock não há como eleger: cada worker consulta os upstreams por conta própria
+            self.leader = True
+            return True
+        fd = os.open(os.path.join(self.directory, self.LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(self.pid).encode("ascii"))
+        self._lock_fd = fd
+        self.leader = True
+        logger.info("worker_elected_leader", pid=self.pid)
+        return True
+
+    async def start(self, registry: MCPRegistry, state: StateBackend, metrics: MetricsRegistry) -> None:
+        """Start publishing (leader) or following (others) the shared catalog."""
+        self._registry = registry
+        self._state = state
+        self._metrics = metrics
+        if self.leader:
+            await registry.start_background_refresh()
+        await self.sync()
+        self._task = asyncio.create_task(self._sync_loop())
+        logger.info("worker_started", pid=self.pid, leader=self.leader, directory=self.directory)
+
+    async def close(self) -> None:
+        """Stop syncing, drop this worker's metrics and give up leadership."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            os.unlink(self._metrics_path(self.pid))
+        except OSError:
+            pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.leader = False
+
+    async def sync(self) -> None:
+        """One coordination step: take over leadership if free, publish or load the catalog, dump metrics."""
+        if not self.leader and self.elect():
+            await self._registry.start_background_refresh()
+        if self.leader:
+            await self._publish()
+        else:
+            await self._follow()
+        await asyncio.to_thread(write_snapshot, self._metrics_path(self.pid), self._metrics_dump())
+
+    async def _publish(self) -> None:
+        registry = self._registry
+        key = (
+            registry.catalog_version,
+            # configuração recarregada: os outros só aceitam status com o mesmo config_digest
+            registry.config_version,
+            tuple(
+                (name, info.status, info.tools_count, info.error_message)
+                for name, info in registry.servers.items()
+            ),
+        )
+        if key == self._published_key:
+            return
+        self._generation += 1
+        data = registry.encode_snapshot(self._generation)
+        await asyncio.to_thread(write_snapshot, self.snapshot_path, data)
+        self._published_key = key
+        self.snapshots_published_total += 1
+        logger.debug("catalog_snapshot_published", generation=self._generation, size=len(data))
+
+    async def _follow(self) -> None:
+        current = file_id(self.snapshot_path)
+        if current is None or current == self._loaded_id:
+            return
+        try:
+            # sem fechar: ferramentas ainda não decodificadas apontam para o arquivo mapeado
+            snapshot = SnapshotReader(self.snapshot_path)
+            replaced = await self._registry.load_snapshot(snapshot)
+            self._loaded_id = snapshot.file_id
+        except (OSError, ValueError, KeyError, SnapshotError) as e:
+            logger.warning("catalog_snapshot_load_failed", path=self.snapshot_path, error=str(e))
+            return
+        self.snapshots_loaded_total += 1
+        logger.debug("catalog_snapshot_loaded", servers_replaced=replaced)
+
+    def _metrics_path(self, pid: int) -> str:
+        return os.path.join(self.metrics_dir, f"{pid}.json")
+
+    def _metrics_dump(self) -> bytes:
+        return json.dumps({
+            "pid": self.pid,
+            "leader": self.leader,
+            "written_at": time.time(),
+            # contadores de backend compartilhado já são globais
+            "counters": {} if self._state.shared else self._state.counters(),
+            "series": self._metrics.export(),
+        }).encode("utf-8")
+
+    def aggregate(self) -> Tuple[Dict[str, int], MetricsRegistry]:
+        """Return the counters and labeled metrics summed over every live worker.
+
+        This worker's own values are read live; the others come from
+        their last dump (at most ``sync_interval`` old). Dumps of workers
+        that no longer exist are removed.
+        """
+        counters = dict(self._state.counters())
+        merged = MetricsRegistry(max_series=self._metrics.max_series)
+        merged.merge(self._metrics.export())
+        for entry in os.scandir(self.metrics_dir):
+            pid_text, _, extension = entry.name.partition(".")
+            if extension != "json" or not pid_text.isdigit() or int(pid_text) == self.pid:
+                continue
+            if not _process_alive(int(pid_text)):
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(entry.path, "rb") as f:
+                    dump = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, value in dump.get("counters", {}).items():
+                counters[name] = counters.get(name, 0) + value
+            merged.merge(dump.get("series", {}))
+        return counters, merged
+
+    def stats(self) -> Dict[str, Any]:
+        """Return this worker's role and snapshot activity."""
+        return {
+            "pid": self.pid,
+            "leader": self.leader,
+            "directory": self.directory,
+            "snapshots_published_total": self.snapshots_published_total,
+            "snapshots_loaded_total": self.snapshots_loaded_total,
+        }
+
+    async def _sync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("worker_sync_failed", error=str(e))
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def create_worker_group(hub_config: Dict[str, Any]) -> Optional[WorkerGroup]:
+    """Build the worker group when ``hub.workers`` asks for more than one process."""
+    if int(hub_config.get("workers", 1)) <= 1:
+        return None
+    directory = hub_config.get("worker_dir") or os.path.join(
+        tempfile.gettempdir(), f"mcp_one-{hub_config.get('port', 8000)}"
+    )
+    return WorkerGroup(directory, sync_interval=float(hub_config.get("worker_sync_interval", 1.0)))
@@ -1,29 +1,44 @@
 """Main FastAPI application."""
 
+import asyncio
+import hashlib
+import hmac
+import json
+import signal
+import threading
 import time
-from collections import defaultdict, deque
 from contextlib import asynccontextmanager
 from datetime import UTC, datetime
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
 from typing import List
 import yaml
 import structlog
 from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 
 from app import __version__
 from app.models.schemas import (
     MCPServerConfig,
     ToolCallRequest,
     ToolCallResponse,
+    BatchToolCallRequest,
+    BatchToolCallResponse,
     ListToolsResponse,
+    ToolSearchResponse,
+    ToolSearchResult,
     HubStatus,
     ErrorResponse,
-    ServerStatus,
 )
+from app.core.cache import ToolResultCache
+from app.core.metrics import METRICS, MetricsRegistry
+from app.core.profiler import SamplingProfiler
+from app.core.ratelimit import TokenBucketLimiter
 from app.core.registry import MCPRegistry
-from app.core.router import MCPRouter
+from app.core.router import DEADLINE_HEADER, MCPRouter
+from app.core.state import StateBackend, create_state_backend
+from app.core.timing import ServerTimingMiddleware, phase, timed_endpoint
+from app.core.workers import WorkerGroup, create_worker_group
 
 from pathlib import Path
 
@@ -73,9 +88,17 @@ start_time: float = time.time()
 config: Dict[str, Any] = load_runtime_config()
 
 
+
 # in-memory runtime controls
-_request_buckets: Dict[str, deque] = defaultdict(deque)
-_metrics: Dict[str, int] = defaultdict(int)
+_rate_limiter: Optional[TokenBucketLimiter] = None
+# contadores, circuitos e cota de rate limit (compartilháveis entre workers)
+state: StateBackend = StateBackend()
+# coordenação entre processos quando hub.workers > 1
+worker_group: Optional[WorkerGroup] = None
+# recarga do config.yaml (watcher, SIGHUP e /admin/reload): uma de cada vez
+_reload_lock = asyncio.Lock()
+_config_watch_task: Optional[asyncio.Task] = None
+_reload_tasks: Set[asyncio.Task] = set()
 
 
 def _authorize_request(request: Request) -> None:
@@ -96,152 +119,259 @@ def _authorize_request(request: Request) -> None:
             raise HTTPException(status_code=401, detail="unauthorized")
 
 
-def _enforce_rate_limit(request: Request) -> None:
-    """Apply simple in-memory per-client rate limiting."""
+def _rate_limit_key(request: Request, key_by: str) -> str:
+    """Return the limiter key: the caller's validated credential when asked, else its IP.
+
+    Only credentials that ``_authorize_request`` checks against the hub
+    configuration are used, so a client cannot get a fresh bucket by
+    sending an arbitrary header value.
+    """
+    if key_by == "api_key":
+        hub = config.get("hub", {})
+        credential = None
+        if hub.get("api_key"):
+            credential = request.headers.get("x-api-key")
+        elif hub.get("bearer_token"):
+            credential = request.headers.get("authorization")
+        if credential:
+            # não guarda a credencial em claro na tabela do limiter
+            return "key:" + hashlib.sha256(credential.encode("utf-8")).hexdigest()[:32]
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def _get_rate_limiter() -> Optional[TokenBucketLimiter]:
+    """Build the rate limiter from config on first use."""
+    global _rate_limiter
     rl = config.get("rate_limit", {})
     if not rl.get("enabled", False):
+        return None
+    if _rate_limiter is None:
+        _rate_limiter = TokenBucketLimiter(
+            requests_per_minute=int(rl.get("requests_per_minute", 100)),
+            burst_size=rl.get("burst_size"),
+            max_keys=int(rl.get("max_clients", 10000)),
+        )
+    return _rate_limiter
+
+
+def _enforce_rate_limit(request: Request, cost: int = 1) -> None:
+    """Apply per-client token bucket rate limiting, charging ``cost`` tokens."""
+    limiter = _get_rate_limiter()
+    if limiter is None:
         return
 
-    limit = int(rl.get("requests_per_minute", 100))
-    now = time.time()
-    client = request.client.host if request.client else "unknown"
-    bucket = _request_buckets[client]
-
-    while bucket and now - bucket[0] > 60:
-        bucket.popleft()
-
-
-
-# in-memory runtime controls
-_request_buckets: Dict[str, deque] = defaultdict(deque)
-_metrics: Dict[str, int] = defaultdict(int)
-
-
-def _authorize_request(request: Request) -> None:
-    """Authorize incoming request when API key is configured."""
-    api_key = config.get("hub", {}).get("api_key")
-    if not api_key:
-        return
-    provided = request.headers.get("x-api-key")
-    if provided != api_key:
-        raise HTTPException(status_code=401, detail="unauthorized")
-
-
-def _enforce_rate_limit(request: Request) -> None:
-    """Apply simple in-memory per-client rate limiting."""
-    rl = config.get("rate_limit", {})
-    if not rl.get("enabled", False):
-        return
-
-    limit = int(rl.get("requests_per_minute", 100))
-    now = time.time()
-    client = request.client.host if request.client else "unknown"
-    bucket = _request_buckets[client]
-
-    while bucket and now - bucket[0] > 60:
-        bucket.popleft()
-
-    if len(bucket) >= limit:
-        raise HTTPException(status_code=429, detail="rate_limit_exceeded")
-
-    bucket.append(now)
-
-
-def protect_request(request: Request) -> None:
-    """Run request protections: auth then rate limit."""
-    _authorize_request(request)
-    _enforce_rate_limit(request)
+    key = _rate_limit_key(request, config.get("rate_limit", {}).get("key_by", "ip"))
+    decision = limiter.acquire(key, cost=cost)
+    if decision.allowed:
+        # cota por minuto compartilhada entre workers/réplicas (no-op em memória)
+        allowed, reset_after = state.allow_rate(key, limiter.limit, cost=cost)
+        if allowed:
+            return
+        decision = decision._replace(allowed=False, remaining=0, retry_after=reset_after)
+
+    raise HTTPException(
+        status_code=429,
+        detail="rate_limit_exceeded",
+        headers=decision.headers(),
+    )
 
 
+def protect_request(request: Request, cost: int = 1) -> None:
+    """Run request protections: auth then rate limit.
 
-@asynccontextmanager
-async def lifespan(_app: FastAPI):
+    ``cost`` is the number of tool calls the request performs, so a batch
+    is charged like the individual calls it replaces.
+    """
+    with phase("protect"):
+        _authorize_request(request)
+        _enforce_rate_limit(request, cost)
 
 
-# in-memory runtime controls
-_request_buckets: Dict[str, deque] = defaultdict(deque)
-_metrics: Dict[str, int] = defaultdict(int)
+def _authorize_admin(request: Request) -> None:
+    """Allow admin endpoints only to callers presenting ``hub.admin_token``.
 
-
-def _authorize_request(request: Request) -> None:
-    """Authorize incoming request when API key is configured."""
-    api_key = config.get("hub", {}).get("api_key")
-    if not api_key:
-        return
-    provided = request.headers.get("x-api-key")
-    if provided != api_key:
+    Admin endpoints do not exist (404) when no admin token is configured.
+    """
+    admin_token = config.get("hub", {}).get("admin_token")
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="not_found")
+    provided = request.headers.get("authorization", "")
+    if not hmac.compare_digest(provided.encode("utf-8"), f"Bearer {admin_token}".encode("utf-8")):
         raise HTTPException(status_code=401, detail="unauthorized")
 
 
-def _enforce_rate_limit(request: Request) -> None:
-    """Apply simple in-memory per-client rate limiting."""
-    rl = config.get("rate_limit", {})
-    if not rl.get("enabled", False):
-        return
-
-    limit = int(rl.get("requests_per_minute", 100))
-    now = time.time()
-    client = request.client.host if request.client else "unknown"
-    bucket = _request_buckets[client]
-
-    while bucket and now - bucket[0] > 60:
-        bucket.popleft()
-
-    if len(bucket) >= limit:
-        raise HTTPException(status_code=429, detail="rate_limit_exceeded")
-
-    bucket.append(now)
-
-
-def protect_request(request: Request) -> None:
-    """Run request protections: auth then rate limit."""
-    _authorize_request(request)
-    _enforce_rate_limit(request)
-
-
-
-@asynccontextmanager
-async def lifespan(_app: FastAPI):
-@asynccontextmanager
-async def lifespan(_app: FastAPI):
-config: dict = {}
+def _config_file_id() -> Optional[Tuple[int, int]]:
+    """Return the modification time and size of CONFIG_PATH (None when missing)."""
+    try:
+        stat = CONFIG_PATH.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+async def reload_config() -> Dict[str, Any]:
+    """Re-read CONFIG_PATH and apply what changed without restarting.
+
+    Servers are diffed against the registry (see
+    ``MCPRegistry.update_servers``); auth, rate limit, metrics and timing
+    settings apply from the next request. Cache, state backend, workers,
+    CORS and the listen address still need a restart. An unreadable or
+    invalid file raises ValueError and leaves the running configuration
+    untouched.
+    """
+    global config, _rate_limiter
+    async with _reload_lock:
+        if _config_file_id() is None:
+            # sem arquivo não é "zero servidores": mantém o que está rodando
+            raise ValueError(f"config file not found: {CONFIG_PATH}")
+        try:
+            new_config = load_runtime_config()
+            configs = [MCPServerConfig(**server_config) for server_config in new_config.get("servers", [])]
+        except (yaml.YAMLError, TypeError, AttributeError) as e:
+            raise ValueError(str(e)) from e
+        names = [server_config.name for server_config in configs]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"duplicate server names: {', '.join(duplicates)}")
+
+        if new_config.get("rate_limit") != config.get("rate_limit"):
+            # limiter reconstruído com os novos limites no próximo request
+            _rate_limiter = None
+        config = new_config
+        METRICS.set_max_series(int(config.get("metrics", {}).get("max_series", 2000)))
+        # seguidores não sondam: o status dos servidores novos vem do snapshot do líder
+        leader = worker_group is None or worker_group.leader
+        changes = await registry.update_servers(configs, probe=leader)
+    logger.info("config_reloaded", path=str(CONFIG_PATH), **{key: len(names) for key, names in changes.items()})
+    return changes
+
+
+async def _reload_logged(source: str) -> None:
+    """Reload the configuration, logging (not raising) a rejected file."""
+    try:
+        await reload_config()
+    except ValueError as e:
+        logger.error("config_reload_failed", source=source, path=str(CONFIG_PATH), error=str(e))
+
+
+async def _watch_config(interval: float) -> None:
+    """Reload the configuration whenever CONFIG_PATH changes on disk."""
+    seen = _config_file_id()
+    while True:
+        await asyncio.sleep(interval)
+        current = _config_file_id()
+        if current is None or current == seen:
+            continue
+        seen = current
+        try:
+            await _reload_logged("watch")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("config_reload_failed", source="watch", error=str(e))
+
+
+def _on_sighup() -> None:
+    task = asyncio.get_running_loop().create_task(_reload_logged("signal"))
+    _reload_tasks.add(task)
+    task.add_done_callback(_reload_tasks.discard)
+
+
+def _install_reload_signal() -> bool:
+    """Reload the configuration on SIGHUP, where the platform and event loop allow it."""
+    if not hasattr(signal, "SIGHUP"):
+        return False
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, _on_sighup)
+    except (NotImplementedError, RuntimeError, ValueError):
+        # Windows ou loop fora da thread principal
+        return False
+    return True
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize and tear down shared application resources."""
-    global registry, router, start_time, config
+    global registry, router, start_time, config, _rate_limiter, state, worker_group, _config_watch_task
     
     start_time = time.time()
 
     # Carrega configuração
     config = load_runtime_config()
+    _rate_limiter = None
+    state = create_state_backend(config.get("state", {}))
+    await state.start()
+    METRICS.set_max_series(int(config.get("metrics", {}).get("max_series", 2000)))
 
     
-    # Inicializa registry e router
-    registry = MCPRegistry()
-    router = MCPRouter(registry)
+    # Inicializa registry, cache e router
+    cache_config = config.get("cache", {})
+    cache = ToolResultCache(
+        max_size=cache_config.get("max_size", 1000),
+        ttl=cache_config.get("ttl", 300),
+        enabled=cache_config.get("enabled", False),
+    )
+    snapshot_path = config.get("hub", {}).get("snapshot_path")
+    if snapshot_path:
+        # caminho relativo é relativo ao config.yaml
+        snapshot_path = str(CONFIG_PATH.parent / snapshot_path)
+    registry = MCPRegistry(
+        max_concurrent_probes=config.get("hub", {}).get("max_concurrent_probes", 10),
+        snapshot_path=snapshot_path,
+    )
+    router = MCPRouter(registry, cache=cache, state=state)
+
+    # com vários workers só o líder consulta os upstreams; os outros seguem o snapshot dele
+    worker_group = create_worker_group(config.get("hub", {}))
+    leader = worker_group is None or worker_group.elect()
     
-    # Registra servidores MCP
-    for server_config in config.get("servers", []):
-        mcp_config = MCPServerConfig(**server_config)
-        await registry.register_server(mcp_config)
+    # Registra servidores MCP: todos em paralelo, esperando no máximo startup_timeout;
+    # os que não responderem a tempo terminam em segundo plano (progresso em /ready)
+    warming = await registry.register_servers(
+        [MCPServerConfig(**server_config) for server_config in config.get("servers", [])],
+        timeout=float(config.get("hub", {}).get("startup_timeout", 5.0)),
+        probe=leader,
+    )
+    
+    # Inicia o agendador de health checks
+    if worker_group is None:
+        await registry.start_background_refresh()
+    else:
+        await worker_group.start(registry, state, METRICS)
     
-    # Inicia refresh automático
-    await registry.start_background_refresh(interval=60)
+    # mudanças no config.yaml valem sem reiniciar (0 desliga o watcher; SIGHUP e /admin/reload seguem)
+    watch_interval = float(config.get("hub", {}).get("config_watch_interval", 0))
+    if watch_interval > 0:
+        _config_watch_task = asyncio.create_task(_watch_config(watch_interval))
+    reload_signal = _install_reload_signal()
     
     logger.info(
         "mcp_hub_started",
         version=__version__,
         servers_count=len(config.get("servers", [])),
+        servers_online=registry.servers_online,
+        servers_warming_up=warming,
         port=config.get("hub", {}).get("port", 8000)
     )
     
     yield
     
     # Cleanup
-    await registry.shutdown()
+    if reload_signal:
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+    if _config_watch_task is not None:
+        _config_watch_task.cancel()
+        try:
+            await _config_watch_task
+        except asyncio.CancelledError:
+            pass
+        _config_watch_task = None
+    # o router cancela suas chamadas antes de o registry fechar os pools compartilhados
+    if worker_group is not None:
+        await worker_group.close()
     await router.shutdown()
+    await registry.shutdown()
+    await state.close()
     
     logger.info("mcp_hub_shutdown_complete")
 
@@ -265,6 +395,13 @@ if config.get("hub", {}).get("cors_enabled", True):
     )
 
 
+# Server-Timing por request (opt-in: hub.server_timing)
+app.add_middleware(
+    ServerTimingMiddleware,
+    enabled=lambda: bool(config.get("hub", {}).get("server_timing", False)),
+)
+
+
 # Dependency para obter registry
 def get_registry() -> MCPRegistry:
     return registry
@@ -283,7 +420,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             error="http_error",
             message=exc.detail,
             timestamp=datetime.now(UTC).isoformat()
-        ).model_dump()
+        ).model_dump(),
+        headers=getattr(exc, "headers", None),
     )
 
 
@@ -303,9 +441,8 @@ async def general_exception_handler(request: Request, exc: Exception):
 # Endpoints
 @app.get("/")
 async def root(request: Request):
-    protect_request(request)
-async def root():
     """Return basic metadata and health of the hub service."""
+    protect_request(request)
     return {
         "name": "MCP one",
         "version": __version__,
@@ -329,39 +466,75 @@ async def health_check(request: Request):
 async def get_status(request: Request, reg: MCPRegistry = Depends(get_registry)):
     protect_request(request)
     """Retorna status detalhado do Hub."""
-    servers = await reg.list_servers()
-    tools = await reg.list_tools()
-    
     return HubStatus(
         version=__version__,
         uptime_seconds=time.time() - start_time,
-        servers_count=len(servers),
-        servers_online=len([s for s in servers if s.status == ServerStatus.ONLINE]),
-        tools_count=len(tools),
-        last_refresh=datetime.now(UTC).isoformat()
+        servers_count=len(reg.servers),
+        servers_online=reg.servers_online,
+        tools_count=reg.tools_count,
+        last_refresh=datetime.now(UTC).isoformat(),
+        concurrency_limits=_concurrency_limits(),
     )
 
 
 @app.get("/tools", response_model=ListToolsResponse)
+@timed_endpoint
 async def list_tools(
     request: Request,
     server: Optional[str] = None,
+    prefix: Optional[str] = None,
+    tag: Optional[str] = None,
     reg: MCPRegistry = Depends(get_registry)
 ):
+    """Lista todas as ferramentas disponíveis.
+
+    The body comes from the registry's pre-serialized catalog snapshot.
+    It carries a strong ETag, so a client polling with ``If-None-Match``
+    gets ``304 Not Modified`` until the catalog changes. ``prefix`` (of
+    the full ``server.tool`` name) and ``tag`` are answered from the
+    registry indexes.
+    """
     protect_request(request)
-    """Lista todas as ferramentas disponíveis."""
-    tools = await reg.list_tools(server_name=server)
-    servers = await reg.list_servers()
-    
-    return ListToolsResponse(
-        tools=tools,
-        total_count=len(tools),
-        servers_online=len([s for s in servers if s.status == ServerStatus.ONLINE]),
-        last_updated=datetime.now(UTC).isoformat()
-    )
+    with phase("catalog"):
+        snapshot = reg.catalog_snapshot()
+        if prefix or tag:
+            view = snapshot.filtered(await reg.list_tools(server_name=server, prefix=prefix, tag=tag))
+        else:
+            view = snapshot.view(server)
+    use_gzip = view.gzip_body is not None and "gzip" in request.headers.get("accept-encoding", "")
+    headers = {
+        "ETag": view.gzip_etag if use_gzip else view.etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if view.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(view.gzip_body, media_type="application/json", headers=headers)
+    return Response(view.body, media_type="application/json", headers=headers)
+
+
+@app.get("/tools/search", response_model=ToolSearchResponse)
+async def search_tools(
+    request: Request,
+    q: str,
+    k: int = 10,
+    reg: MCPRegistry = Depends(get_registry)
+):
+    """Busca as ferramentas mais relevantes para uma consulta (BM25).
+
+    Names, descriptions and parameter names are indexed; ``k`` is
+    capped at 100.
+    """
+    protect_request(request)
+    hits = await reg.search_tools(q, k=max(1, min(k, 100)))
+    results = [ToolSearchResult(**tool.model_dump(), score=score) for tool, score in hits]
+    return ToolSearchResponse(query=q, results=results, total_count=len(results))
 
 
 @app.post("/call", response_model=ToolCallResponse)
+@timed_endpoint
 async def call_tool(
     request: ToolCallRequest,
     http_request: Request,
@@ -369,21 +542,177 @@ async def call_tool(
 ):
     """Executa uma ferramenta em um servidor MCP."""
     protect_request(http_request)
-    _metrics["call_requests_total"] += 1
+    _apply_deadline_header(http_request, [request])
     response = await rt.execute_tool(request)
+    _record_call_metrics(response)
+    return _overloaded_response(response, rt) or response
+
+
+@app.post("/call/stream", response_model=ToolCallResponse)
+@timed_endpoint
+async def call_tool_stream(
+    request: ToolCallRequest,
+    http_request: Request,
+    rt: MCPRouter = Depends(get_router)
+):
+    """Executa uma ferramenta repassando o corpo do upstream sem bufferizar.
+
+    The upstream body is embedded unparsed under ``upstream`` in the hub
+    envelope. Failures detected before the upstream answers are returned
+    as a regular ``ToolCallResponse``.
+    """
+    protect_request(http_request)
+    _apply_deadline_header(http_request, [request])
+    response, body = await rt.open_stream(request)
+    _record_call_metrics(response)
+    if body is None:
+        return _overloaded_response(response, rt) or response
+    return StreamingResponse(body, media_type="application/json")
+
+
+@app.post("/call/batch", response_model=BatchToolCallResponse)
+async def call_tools_batch(
+    request: BatchToolCallRequest,
+    http_request: Request,
+    stream: bool = False,
+    rt: MCPRouter = Depends(get_router)
+):
+    """Executa várias ferramentas em paralelo.
+
+    With ``stream=true`` each result is sent as an NDJSON line (with its
+    ``index`` in the batch) as soon as it finishes; otherwise the results
+    are returned together, in request order.
+    """
+    max_calls = int(config.get("batch", {}).get("max_calls", 100))
+    if len(request.calls) > max_calls:
+        raise HTTPException(status_code=413, detail="batch_too_large")
+    protect_request(http_request, cost=len(request.calls))
+    _apply_deadline_header(http_request, request.calls)
+    state.incr("batch_requests_total")
+
+    if stream:
+        async def ndjson() -> AsyncIterator[str]:
+            async for index, response in rt.iter_batch(request.calls):
+                _record_call_metrics(response)
+                yield json.dumps({"index": index, **response.model_dump(mode="json")}) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    batch_start = time.time()
+    results = await rt.execute_batch(request.calls)
+    for response in results:
+        _record_call_metrics(response)
+    success_count = len([r for r in results if r.success])
+    return BatchToolCallResponse(
+        results=results,
+        success_count=success_count,
+        failure_count=len(results) - success_count,
+        execution_time_ms=(time.time() - batch_start) * 1000,
+    )
+
+
+def _overloaded_response(response: ToolCallResponse, rt: MCPRouter) -> Optional[JSONResponse]:
+    """Turn a call shed by the server's bulkhead into a 503 with ``Retry-After``."""
+    if response.error != "server_overloaded":
+        return None
+    return JSONResponse(
+        status_code=503,
+        content=response.model_dump(mode="json"),
+        headers={"Retry-After": str(rt.retry_after(response.server_name))},
+    )
+
+
+def _apply_deadline_header(http_request: Request, calls: List[ToolCallRequest]) -> None:
+    """Use the ``X-Timeout-Ms`` header as the deadline of calls without ``timeout_ms``."""
+    value = http_request.headers.get(DEADLINE_HEADER)
+    if value is None:
+        return
+    try:
+        timeout_ms = float(value)
+    except ValueError:
+        timeout_ms = 0.0
+    if not timeout_ms > 0:
+        raise HTTPException(status_code=400, detail="invalid_timeout")
+    for call in calls:
+        if call.timeout_ms is None:
+            call.timeout_ms = timeout_ms
+
+
+def _record_call_metrics(response: ToolCallResponse) -> None:
+    """Count a finished tool call in the hub metrics."""
+    state.incr("call_requests_total")
     if response.success:
-        _metrics["call_success_total"] += 1
+        state.incr("call_success_total")
     else:
-        _metrics["call_failure_total"] += 1
-    return response
+        state.incr("call_failure_total")
+
+
+_profile_lock = asyncio.Lock()
+
+
+@app.get("/admin/profile")
+async def admin_profile(request: Request, seconds: float = 5.0, interval_ms: float = 5.0):
+    """Sample the event loop thread and return collapsed stacks.
+
+    Runs for ``seconds`` (0.1 to 60) taking one sample every
+    ``interval_ms`` (1 to 100) while the hub keeps serving requests. The
+    output feeds ``flamegraph.pl`` or speedscope. Requires
+    ``hub.admin_token``; one profile runs at a time.
+    """
+    _authorize_admin(request)
+    _enforce_rate_limit(request)
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="profile_in_progress")
+
+    async with _profile_lock:
+        profiler = SamplingProfiler(
+            threading.get_ident(), interval=min(max(interval_ms, 1.0), 100.0) / 1000
+        )
+        stop = threading.Event()
+        try:
+            await asyncio.to_thread(profiler.run, min(max(seconds, 0.1), 60.0), stop)
+        finally:
+            # cliente desistiu: a thread de amostragem para junto
+            stop.set()
+
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={
+            "Content-Disposition": 'attachment; filename="mcp-one-profile.collapsed"',
+            "X-Profile-Samples": str(profiler.sample_count),
+        },
+    )
+
+
+@app.post("/admin/reload")
+async def admin_reload(request: Request):
+    """Re-read config.yaml and apply the server changes it brings.
+
+    Returns the servers added, removed, updated and unchanged; an
+    invalid file is rejected with 400 and changes nothing. Requires
+    ``hub.admin_token``.
+    """
+    _authorize_admin(request)
+    _enforce_rate_limit(request)
+    try:
+        changes = await reload_config()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid_config: {e}")
+    return {"config_version": registry.config_version, **changes}
 
 
 @app.get("/servers")
 async def list_servers(request: Request, reg: MCPRegistry = Depends(get_registry)):
     protect_request(request)
-    """Lista todos os servidores registrados."""
+    """Lista todos os servidores registrados, com as estatísticas de cada réplica."""
     servers = await reg.list_servers()
-    return {"servers": servers}
+    replicas = reg.replica_stats()
+    return {
+        "servers": [
+            {**server.model_dump(mode="json"), "replicas": replicas.get(server.config.name, [])}
+            for server in servers
+        ]
+    }
 
 
 @app.post("/servers/refresh")
@@ -396,28 +725,98 @@ async def refresh_servers(request: Request, reg: MCPRegistry = Depends(get_regis
 
 @app.get("/ready")
 async def readiness(request: Request):
-    """Readiness probe based on upstream MCP availability."""
+    """Readiness probe based on upstream MCP availability, with the warm-up progress of each server."""
     protect_request(request)
-    servers = await registry.list_servers()
-    online = len([s for s in servers if s.status == ServerStatus.ONLINE])
+    online = registry.servers_online
     return {
-        "ready": online > 0 if servers else True,
+        "ready": online > 0 if registry.servers else True,
         "servers_online": online,
-        "servers_total": len(servers),
+        "servers_total": len(registry.servers),
+        "warm_up": registry.warmup_stats(),
     }
 
 
+def _pool_stats() -> List[Dict[str, Any]]:
+    """Return upstream connection pool statistics when the registry is initialized."""
+    return registry.pools.stats() if "registry" in globals() else []
+
+
+def _session_stats() -> Dict[str, List[Dict[str, Any]]]:
+    """Return the MCP sessions of native MCP servers when the registry is initialized."""
+    return registry.sessions.stats() if "registry" in globals() else {}
+
+
+def _concurrency_limits() -> Dict[str, Dict[str, Any]]:
+    """Return the adaptive concurrency limits when the router is initialized."""
+    return router.concurrency_limits() if "router" in globals() else {}
+
+
+def _replica_stats() -> Dict[str, List[Dict[str, Any]]]:
+    """Return per-replica statistics when the registry is initialized."""
+    return registry.replica_stats() if "registry" in globals() else {}
+
+
+def _refresh_stats() -> Dict[str, Any]:
+    """Return catalog refresh statistics when the registry is initialized."""
+    return registry.refresh_stats() if "registry" in globals() else {"totals": {}, "servers": {}}
+
+
+def _cache_stats() -> Dict[str, Any]:
+    """Return tool result cache statistics when the router is initialized."""
+    cache = getattr(router, "cache", None) if "router" in globals() else None
+    if cache is None:
+        return {"enabled": False, "size": 0, "hits": 0, "misses": 0, "evictions": 0}
+    return cache.stats()
+
+
+def _aggregated_metrics() -> Tuple[Dict[str, int], MetricsRegistry]:
+    """Return the counters and labeled metrics of every worker (this process when single)."""
+    if worker_group is None:
+        return state.counters(), METRICS
+    return worker_group.aggregate()
+
+
 @app.get("/metrics")
 async def metrics(request: Request):
-    """Basic operational metrics endpoint (JSON)."""
+    """Basic operational metrics endpoint (JSON).
+
+    Counters and ``series`` cover every worker; the other sections
+    (pools, bulkheads, cache...) are those of the worker answering.
+    """
     protect_request(request)
+    counters, series = _aggregated_metrics()
     return {
         "uptime_seconds": time.time() - start_time,
-        "call_requests_total": _metrics.get("call_requests_total", 0),
-        "call_success_total": _metrics.get("call_success_total", 0),
-        "call_failure_total": _metrics.get("call_failure_total", 0),
-        "tracked_clients": len(_request_buckets),
-        "open_circuits": len(getattr(router, "_circuit_open_until", {})) if "router" in globals() else 0,
+        "worker": worker_group.stats() if worker_group is not None else None,
+        "call_requests_total": counters.get("call_requests_total", 0),
+        "call_success_total": counters.get("call_success_total", 0),
+        "call_failure_total": counters.get("call_failure_total", 0),
+        "batch_requests_total": counters.get("batch_requests_total", 0),
+        "tracked_clients": len(_rate_limiter) if _rate_limiter is not None else 0,
+        "open_circuits": len(state.open_circuits()),
+        "upstream_calls_total": counters.get("upstream_calls_total", 0),
+        "coalesced_calls_total": counters.get("coalesced_calls_total", 0),
+        "hedging": {
+            "sent_total": counters.get("hedges_sent_total", 0),
+            "won_total": counters.get("hedges_won_total", 0),
+            "budget_exhausted_total": counters.get("hedges_budget_exhausted_total", 0),
+            "budgets": router.hedge_stats() if "router" in globals() else {},
+        },
+        "retries": {
+            "retries_total": counters.get("retries_total", 0),
+            "budget_exhausted_total": counters.get("retry_budget_exhausted_total", 0),
+            "budgets": router.retry_stats() if "router" in globals() else {},
+        },
+        "deadline_exceeded_total": counters.get("deadline_exceeded_total", 0),
+        "bulkheads": router.bulkhead_stats() if "router" in globals() else {},
+        "concurrency_limits": _concurrency_limits(),
+        "cache": _cache_stats(),
+        "pools": _pool_stats(),
+        "mcp_sessions": _session_stats(),
+        "catalog_refresh": _refresh_stats(),
+        "replicas": _replica_stats(),
+        # as mesmas séries com labels de /metrics/prometheus
+        "series": series.snapshot(),
     }
 
 
@@ -425,34 +824,181 @@ async def metrics(request: Request):
 async def metrics_prometheus(request: Request):
     """Prometheus-compatible plaintext metrics endpoint."""
     protect_request(request)
+    counters, series = _aggregated_metrics()
     lines = [
         "# HELP mcp_one_uptime_seconds Uptime in seconds",
         "# TYPE mcp_one_uptime_seconds gauge",
         f"mcp_one_uptime_seconds {time.time() - start_time}",
         "# HELP mcp_one_call_requests_total Total call requests",
         "# TYPE mcp_one_call_requests_total counter",
-        f"mcp_one_call_requests_total {_metrics.get('call_requests_total', 0)}",
+        f"mcp_one_call_requests_total {counters.get('call_requests_total', 0)}",
         "# HELP mcp_one_call_success_total Total successful call requests",
         "# TYPE mcp_one_call_success_total counter",
-        f"mcp_one_call_success_total {_metrics.get('call_success_total', 0)}",
+        f"mcp_one_call_success_total {counters.get('call_success_total', 0)}",
         "# HELP mcp_one_call_failure_total Total failed call requests",
         "# TYPE mcp_one_call_failure_total counter",
-        f"mcp_one_call_failure_total {_metrics.get('call_failure_total', 0)}",
+        f"mcp_one_call_failure_total {counters.get('call_failure_total', 0)}",
+        "# HELP mcp_one_batch_requests_total Total batch call requests",
+        "# TYPE mcp_one_batch_requests_total counter",
+        f"mcp_one_batch_requests_total {counters.get('batch_requests_total', 0)}",
         "# HELP mcp_one_open_circuits Number of open upstream circuits",
         "# TYPE mcp_one_open_circuits gauge",
-        f"mcp_one_open_circuits {len(getattr(router, '_circuit_open_until', {})) if 'router' in globals() else 0}",
+        f"mcp_one_open_circuits {len(state.open_circuits())}",
+    ]
+    lines += [
+        "# HELP mcp_one_upstream_calls_total Tool call requests sent to upstream servers",
+        "# TYPE mcp_one_upstream_calls_total counter",
+        f"mcp_one_upstream_calls_total {counters.get('upstream_calls_total', 0)}",
+        "# HELP mcp_one_coalesced_calls_total Tool calls that shared an identical in-flight upstream request",
+        "# TYPE mcp_one_coalesced_calls_total counter",
+        f"mcp_one_coalesced_calls_total {counters.get('coalesced_calls_total', 0)}",
+        "# HELP mcp_one_hedges_sent_total Hedge requests sent for slow idempotent tool calls",
+        "# TYPE mcp_one_hedges_sent_total counter",
+        f"mcp_one_hedges_sent_total {counters.get('hedges_sent_total', 0)}",
+        "# HELP mcp_one_hedges_won_total Hedged calls answered by the hedge request",
+        "# TYPE mcp_one_hedges_won_total counter",
+        f"mcp_one_hedges_won_total {counters.get('hedges_won_total', 0)}",
+        "# HELP mcp_one_hedges_budget_exhausted_total Hedges not sent because the hedge budget was spent",
+        "# TYPE mcp_one_hedges_budget_exhausted_total counter",
+        f"mcp_one_hedges_budget_exhausted_total {counters.get('hedges_budget_exhausted_total', 0)}",
+        "# HELP mcp_one_retries_total Tool call retries sent after connection errors or 5xx",
+        "# TYPE mcp_one_retries_total counter",
+        f"mcp_one_retries_total {counters.get('retries_total', 0)}",
+        "# HELP mcp_one_retry_budget_exhausted_total Retries not sent because the retry budget was spent",
+        "# TYPE mcp_one_retry_budget_exhausted_total counter",
+        f"mcp_one_retry_budget_exhausted_total {counters.get('retry_budget_exhausted_total', 0)}",
+        "# HELP mcp_one_deadline_exceeded_total Tool calls that ran out of their client deadline",
+        "# TYPE mcp_one_deadline_exceeded_total counter",
+        f"mcp_one_deadline_exceeded_total {counters.get('deadline_exceeded_total', 0)}",
+    ]
+    cache_stats = _cache_stats()
+    lines += [
+        "# HELP mcp_one_cache_entries Tool results currently cached",
+        "# TYPE mcp_one_cache_entries gauge",
+        f"mcp_one_cache_entries {cache_stats['size']}",
+        "# HELP mcp_one_cache_hits_total Tool calls served from cache",
+        "# TYPE mcp_one_cache_hits_total counter",
+        f"mcp_one_cache_hits_total {cache_stats['hits']}",
+        "# HELP mcp_one_cache_misses_total Cacheable tool calls not found in cache",
+        "# TYPE mcp_one_cache_misses_total counter",
+        f"mcp_one_cache_misses_total {cache_stats['misses']}",
+        "# HELP mcp_one_cache_evictions_total Cache entries evicted by the size bound",
+        "# TYPE mcp_one_cache_evictions_total counter",
+        f"mcp_one_cache_evictions_total {cache_stats['evictions']}",
     ]
-    return "\n".join(lines) + "\n"
+
+    pool_gauges = [
+        ("in_flight", "gauge", "Requests currently holding an upstream pool slot"),
+        ("waiting", "gauge", "Requests waiting for an upstream pool slot"),
+        ("max_connections", "gauge", "Configured connections of the upstream pool"),
+        ("max_concurrent", "gauge", "Concurrent requests the pool admits (streams with HTTP/2)"),
+        ("utilization", "gauge", "Fraction of the upstream pool in use"),
+        ("requests_total", "counter", "Requests sent through the upstream pool"),
+        ("wait_seconds_total", "counter", "Total time spent waiting for an upstream pool slot"),
+        ("max_wait_seconds", "gauge", "Longest wait for an upstream pool slot"),
+    ]
+    pools = _pool_stats()
+    for name, kind, help_text in pool_gauges:
+        lines += [
+            f"# HELP mcp_one_pool_{name} {help_text}",
+            f"# TYPE mcp_one_pool_{name} {kind}",
+        ]
+        lines += [
+            f'mcp_one_pool_{name}{{pool="{p["pool"]}",profile="{p["profile"]}"}} {p[name]}'
+            for p in pools
+        ]
+
+    refresh_totals = _refresh_stats()["totals"]
+    lines += [
+        "# HELP mcp_one_catalog_refreshes_total Tool list refreshes by outcome",
+        "# TYPE mcp_one_catalog_refreshes_total counter",
+    ]
+    lines += [
+        f'mcp_one_catalog_refreshes_total{{result="{result}"}} {refresh_totals.get(f"refreshes_{result}", 0)}'
+        for result in ("changed", "unchanged", "not_modified", "error")
+    ]
+    lines += [
+        "# HELP mcp_one_catalog_tool_changes_total Tools added, removed or changed by refreshes",
+        "# TYPE mcp_one_catalog_tool_changes_total counter",
+    ]
+    lines += [
+        f'mcp_one_catalog_tool_changes_total{{change="{change}"}} {refresh_totals.get(f"tools_{change}", 0)}'
+        for change in ("added", "removed", "changed")
+    ]
+
+    bulkheads = router.bulkhead_stats() if "router" in globals() else {}
+    bulkhead_metrics = [
+        ("in_flight", "gauge", "Tool calls holding a slot of the server's bulkhead"),
+        ("queued", "gauge", "Tool calls waiting for a slot of the server's bulkhead"),
+        ("limit", "gauge", "Maximum tool calls in flight to the server"),
+        ("admitted_total", "counter", "Tool calls admitted by the server's bulkhead"),
+    ]
+    for name, kind, help_text in bulkhead_metrics:
+        lines += [
+            f"# HELP mcp_one_bulkhead_{name} {help_text}",
+            f"# TYPE mcp_one_bulkhead_{name} {kind}",
+        ]
+        lines += [
+            f'mcp_one_bulkhead_{name}{{server="{server}"}} {"+Inf" if b[name] is None else b[name]}'
+            for server, b in bulkheads.items()
+        ]
+    lines += [
+        "# HELP mcp_one_bulkhead_shed_total Tool calls rejected with 503 by the server's bulkhead",
+        "# TYPE mcp_one_bulkhead_shed_total counter",
+    ]
+    lines += [
+        f'mcp_one_bulkhead_shed_total{{server="{server}",reason="{reason}"}} {count}'
+        for server, b in bulkheads.items()
+        for reason, count in b["shed_total"].items()
+    ]
+
+    limits = _concurrency_limits()
+    lines += [
+        "# HELP mcp_one_concurrency_limit Concurrency limit learned for the server",
+        "# TYPE mcp_one_concurrency_limit gauge",
+    ]
+    lines += [
+        f'mcp_one_concurrency_limit{{server="{server}",algorithm="{l["algorithm"]}"}} {l["limit"]}'
+        for server, l in limits.items()
+    ]
+    lines += [
+        "# HELP mcp_one_concurrency_limit_drops_total Failed calls seen by the adaptive concurrency limit",
+        "# TYPE mcp_one_concurrency_limit_drops_total counter",
+    ]
+    lines += [
+        f'mcp_one_concurrency_limit_drops_total{{server="{server}"}} {l["drops_total"]}'
+        for server, l in limits.items()
+    ]
+
+    replica_metrics = [
+        ("outstanding", "gauge", "Requests in flight to the replica"),
+        ("latency_ewma_ms", "gauge", "EWMA latency of calls to the replica"),
+        ("requests_total", "counter", "Tool calls sent to the replica"),
+        ("failures_total", "counter", "Tool calls the replica failed (errors, timeouts, 5xx)"),
+        ("ejections_total", "counter", "Times the replica was ejected from balancing"),
+        ("ejected", "gauge", "1 while the replica is ejected"),
+        ("healthy", "gauge", "1 when the replica passed its last health probe"),
+    ]
+    replicas = _replica_stats()
+    for name, kind, help_text in replica_metrics:
+        lines += [
+            f"# HELP mcp_one_replica_{name} {help_text}",
+            f"# TYPE mcp_one_replica_{name} {kind}",
+        ]
+        lines += [
+            f'mcp_one_replica_{name}{{server="{server}",replica="{r["url"]}"}} {float(r[name] or 0):g}'
+            for server, server_replicas in replicas.items()
+            for r in server_replicas
+        ]
+
+    lines += series.render_prometheus()
+    return PlainTextResponse("\n".join(lines) + "\n")
 
 
 def main():
     """Run the service using runtime hub configuration."""
     import uvicorn
 
-    runtime_config = load_runtime_config()
-    hub_config = runtime_config.get("hub", {})
-
-    
     # Carrega configuração
     try:
         with open(CONFIG_PATH, "r") as f:
@@ -468,6 +1014,11 @@ def main():
         host=hub_config.get("host", "0.0.0.0"),
         port=hub_config.get("port", 8000),
         reload=False,
+        # cada worker é um processo; o líder entre eles consulta os upstreams
+        workers=int(hub_config.get("workers", 1)),
+        # "auto" usa uvloop e httptools quando instalados (uvicorn[standard])
+        loop=hub_config.get("loop", "auto"),
+        http=hub_config.get("http", "auto"),
         log_level=hub_config.get("log_level", "info").lower(),
     )
 
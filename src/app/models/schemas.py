@@ -1,6 +1,7 @@
 """Pydantic models for MCP Hub."""
 
-from typing import Any, Dict, List, Optional, Union
+from fnmatch import fnmatchcase
+from typing import Any, Dict, List, Literal, Optional, Union
 from pydantic import BaseModel, Field, HttpUrl, field_validator
 from enum import Enum
 
@@ -10,10 +11,36 @@ class MCPServerConfig(BaseModel):
     description: Optional[str] = None
     enabled: bool = True
     timeout: int = 30
+    # protocolo com o upstream: REST próprio (endpoints/payload_map) ou MCP nativo por JSON-RPC,
+    # com sessão persistente ("streamable_http": url é o endpoint MCP; "sse": url é o stream SSE)
+    transport: Literal["rest", "streamable_http", "sse"] = "rest"
     retry_attempts: int = 3
     circuit_breaker_failures: int = 5
     circuit_breaker_reset_seconds: int = 30
 
+    # réplicas adicionais do mesmo servidor (além de `url`) e balanceamento entre elas
+    replicas: List[HttpUrl] = []
+    load_balancing: Literal["p2c", "least_outstanding"] = "p2c"
+    replica_eject_failures: int = Field(3, ge=1)
+    replica_eject_seconds: float = Field(30.0, gt=0)
+
+    # bulkhead: chamadas simultâneas ao servidor (None: sem limite) e fila de espera
+    max_in_flight: Optional[int] = Field(50, ge=1)
+    max_queue: int = Field(100, ge=0)
+    queue_timeout: float = Field(1.0, gt=0)  # segundos na fila antes de rejeitar com 503
+    # limite aprendido da latência e dos erros; max_in_flight vira só o valor inicial
+    adaptive_concurrency: Optional[Literal["aimd", "gradient"]] = None
+    adaptive_min_limit: int = Field(1, ge=1)
+    adaptive_max_limit: int = Field(200, ge=1)
+
+    # pool de conexões (compartilhado por todos os servidores do mesmo host)
+    max_connections: int = Field(20, ge=1)
+    max_keepalive_connections: int = Field(10, ge=0)
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    connect_timeout: float = 5.0
+    read_timeout: Optional[float] = None  # padrão: `timeout`
+
     endpoints: Dict[str, str] = {
         "health": "/health",
         "tools": "/tools",
@@ -31,10 +58,59 @@ class MCPServerConfig(BaseModel):
         "args_field": "arguments"
     }
 
+    # ferramentas (nomes ou padrões glob) cujos resultados podem ir para o cache
+    cacheable_tools: List[str] = []
+
+    # agendamento de health checks (segundos): liveness, catálogo e backoff após falhas
+    health_interval: float = Field(15.0, gt=0)
+    tools_refresh_interval: float = Field(300.0, gt=0)
+    health_retry_interval: float = Field(2.0, gt=0)
+    health_backoff_max: float = Field(120.0, gt=0)
+    health_jitter: float = Field(0.1, ge=0, le=1)
+
+    # saúde passiva, a partir das chamadas reais
+    degraded_error_rate: float = Field(0.2, gt=0, le=1)
+    degraded_latency_ms: Optional[float] = None
+    passive_offline_failures: int = Field(5, ge=1)
+
+    # máximo de chamadas simultâneas a este servidor dentro de um mesmo /call/batch
+    batch_concurrency: int = Field(10, ge=1)
+
+    # ferramentas sem efeitos colaterais: chamadas idênticas concorrentes são agrupadas
+    idempotent_tools: List[str] = []
+
+    # hedging (só ferramentas idempotentes): segunda requisição quando a primeira demora
+    hedge_delay_ms: Optional[float] = Field(None, gt=0)
+    hedge_percentile: Optional[float] = Field(None, gt=0, lt=100)
+    hedge_budget: float = Field(0.1, ge=0, le=1)  # hedges ≤ esta fração das chamadas
+
+    # retries de ferramentas idempotentes (erro de conexão ou 5xx), com backoff e orçamento
+    call_retries: int = Field(2, ge=0)
+    retry_backoff_ms: float = Field(50.0, ge=0)
+    retry_budget: float = Field(0.1, ge=0, le=1)  # retries ≤ esta fração das chamadas
+
+    def replica_urls(self) -> List[str]:
+        """Return the base URL of every replica, `url` first, without duplicates."""
+        urls = [str(self.url).rstrip("/")] + [str(url).rstrip("/") for url in self.replicas]
+        return list(dict.fromkeys(urls))
+
+    def hedges(self, tool_name: str) -> bool:
+        """Return True when slow calls to ``tool_name`` may be hedged."""
+        return bool(self.hedge_delay_ms or self.hedge_percentile) and self.is_idempotent(tool_name)
+
+    def is_cacheable(self, tool_name: str) -> bool:
+        """Return True when results of ``tool_name`` may be served from cache."""
+        return any(fnmatchcase(tool_name, pattern) for pattern in self.cacheable_tools)
+
+    def is_idempotent(self, tool_name: str) -> bool:
+        """Return True when ``tool_name`` may be deduplicated or re-sent safely."""
+        return any(fnmatchcase(tool_name, pattern) for pattern in self.idempotent_tools)
+
 
 class ServerStatus(str, Enum):
     """Status do servidor MCP."""
     ONLINE = "online"
+    DEGRADED = "degraded"  # responde, mas com erros ou latência acima do limite
     OFFLINE = "offline"
     ERROR = "error"
     CONNECTING = "connecting"
@@ -48,6 +124,21 @@ class MCPServerInfo(BaseModel):
     error_message: Optional[str] = None
     tools_count: int = 0
     response_time_ms: Optional[float] = None
+    consecutive_failures: int = 0
+
+    # medidas passivas das chamadas reais
+    error_rate: float = 0.0
+    latency_ewma_ms: Optional[float] = None
+    last_success: Optional[str] = None
+    consecutive_call_failures: int = 0
+
+    # status e ferramentas vindos do snapshot em disco, ainda não confirmados pelo upstream
+    stale: bool = False
+
+    @property
+    def available(self) -> bool:
+        """Return True when calls may be routed to the server (ONLINE or DEGRADED)."""
+        return self.status in (ServerStatus.ONLINE, ServerStatus.DEGRADED)
 
 
 class ToolSchema(BaseModel):
@@ -57,6 +148,7 @@ class ToolSchema(BaseModel):
     parameters: Dict[str, Any] = Field(default_factory=dict)
     server_name: str = Field(..., description="Nome do servidor que possui a ferramenta")
     full_name: str = Field(..., description="Nome completo: server.tool")
+    tags: List[str] = Field(default_factory=list, description="Tags/categorias da ferramenta")
     
     @field_validator('full_name', mode='before')
     @classmethod
@@ -71,6 +163,9 @@ class ToolCallRequest(BaseModel):
     """Request para chamar uma ferramenta."""
     tool: str = Field(..., description="Nome completo da ferramenta (server.tool)")
     arguments: Dict[str, Any] = Field(default_factory=dict, description="Argumentos da ferramenta")
+    timeout_ms: Optional[float] = Field(
+        None, gt=0, description="Prazo total da chamada (todas as tentativas), repassado ao upstream"
+    )
     
     @field_validator('tool')
     @classmethod
@@ -87,6 +182,20 @@ class ToolCallResponse(BaseModel):
     error: Optional[str] = Field(None, description="Mensagem de erro se houver")
     execution_time_ms: Optional[float] = Field(None, description="Tempo de execução")
     server_name: str = Field(..., description="Servidor que executou a ferramenta")
+    cached: bool = Field(False, description="Se o resultado veio do cache do Hub")
+
+
+class BatchToolCallRequest(BaseModel):
+    """Request para chamar várias ferramentas em paralelo."""
+    calls: List[ToolCallRequest] = Field(..., min_length=1, description="Chamadas a executar")
+
+
+class BatchToolCallResponse(BaseModel):
+    """Response de um lote de chamadas, na mesma ordem do request."""
+    results: List[ToolCallResponse] = Field(..., description="Resultado de cada chamada")
+    success_count: int = Field(..., description="Chamadas bem-sucedidas")
+    failure_count: int = Field(..., description="Chamadas com falha")
+    execution_time_ms: float = Field(..., description="Tempo total do lote")
 
 
 class HubStatus(BaseModel):
@@ -97,6 +206,9 @@ class HubStatus(BaseModel):
     servers_online: int = Field(..., description="Número de servidores online")
     tools_count: int = Field(..., description="Total de ferramentas disponíveis")
     last_refresh: str = Field(..., description="Último refresh dos servidores")
+    concurrency_limits: Dict[str, Dict[str, Any]] = Field(
+        default_factory=dict, description="Limite de concorrência aprendido por servidor e seu histórico"
+    )
 
 
 class ListToolsResponse(BaseModel):
@@ -107,6 +219,18 @@ class ListToolsResponse(BaseModel):
     last_updated: str = Field(..., description="Última atualização")
 
 
+class ToolSearchResult(ToolSchema):
+    """Ferramenta encontrada pela busca, com sua relevância."""
+    score: float = Field(..., description="Relevância BM25 para a consulta")
+
+
+class ToolSearchResponse(BaseModel):
+    """Response da busca de ferramentas."""
+    query: str = Field(..., description="Consulta recebida")
+    results: List[ToolSearchResult] = Field(..., description="Ferramentas mais relevantes primeiro")
+    total_count: int = Field(..., description="Número de resultados")
+
+
 class ErrorResponse(BaseModel):
     """Response de erro padronizada."""
     error: str = Field(..., description="Tipo do erro")
@@ -1,13 +1,73 @@
 """Tests for MCP one."""
 
+import json
+import os
+import threading
+import time
+import httpx
 import pytest
 import asyncio
 from unittest.mock import AsyncMock, MagicMock
 from fastapi.testclient import TestClient
-from app.main import app
-from app.models.schemas import MCPServerConfig, ToolCallRequest
+from app.main import app, get_router
+from app.models.schemas import (
+    ListToolsResponse,
+    MCPServerConfig,
+    MCPServerInfo,
+    ServerStatus,
+    ToolCallRequest,
+    ToolCallResponse,
+    ToolSchema,
+)
+from app.core.adaptive import AIMDLimit, GradientLimit
+from app.core.budget import RequestBudget
+from app.core.bulkhead import Bulkhead, BulkheadRejected
+from app.core.cache import ToolResultCache
+from app.core.latency import LatencyWindow
+from app.core.metrics import METRICS, OVERFLOW_LABEL, HubMetrics, MetricsRegistry
+from app.core.pools import MeteredTransport, UpstreamPools
+from app.core.profiler import SamplingProfiler
+from app.core.ratelimit import TokenBucketLimiter
+from app.core.search import ToolSearchIndex, tokenize
+from app.core.snapshot import SnapshotReader, write_snapshot
+from app.core.state import RedisStateBackend, StateBackend
 from app.core.registry import MCPRegistry
 from app.core.router import MCPRouter
+from app.core.workers import WorkerGroup
+
+
+def mock_upstream(pools):
+    """Route every upstream request made through ``pools`` to an AsyncMock client."""
+    client = AsyncMock()
+    pools.client_for = MagicMock(return_value=client)
+    return client
+
+
+def upstream_response(status_code=200, json=None, headers=None):
+    """Build a real httpx response, as the registry reads bodies and headers."""
+    return httpx.Response(
+        status_code, json=json, headers=headers, request=httpx.Request("GET", "http://localhost:3000")
+    )
+
+
+def add_online_server(registry, name="test_server", tools=("test_tool",), **config):
+    """Register an ONLINE server and its tools directly in the registry."""
+    server_config = MCPServerConfig(name=name, url="http://localhost:3000", **config)
+    registry.servers[name] = MCPServerInfo(config=server_config)
+    registry._set_status(registry.servers[name], ServerStatus.ONLINE)
+    registry.server_tools[name] = set(tools)
+    for tool_name in tools:
+        registry._put_tool(ToolSchema(name=tool_name, server_name=name, full_name=f"{name}.{tool_name}"))
+    registry.invalidate_catalog()
+    return server_config
+
+
+def disable_rate_limit(monkeypatch):
+    """Keep endpoint tests from spending the shared per-IP rate limit."""
+    import app.main as main_module
+
+    monkeypatch.setattr(main_module, "config", {"rate_limit": {"enabled": False}})
+    monkeypatch.setattr(main_module, "_rate_limiter", None)
 
 
 class TestMCPRegistry:
@@ -34,9 +94,8 @@ class TestMCPRegistry:
     async def test_register_server(self, registry, server_config):
         """Test server registration."""
         # Mock HTTP client
-        registry._client = AsyncMock()
-        registry._client.get.return_value.status_code = 200
-        registry._client.get.return_value.json.return_value = {"tools": []}
+        registry_upstream = mock_upstream(registry.pools)
+        registry_upstream.get.return_value = upstream_response(json={"tools": []})
         
         result = await registry.register_server(server_config)
         
@@ -48,7 +107,7 @@ class TestMCPRegistry:
     async def test_unregister_server(self, registry, server_config):
         """Test server unregistration."""
         # Register first
-        registry._client = AsyncMock()
+        registry_upstream = mock_upstream(registry.pools)
         await registry.register_server(server_config)
         
         # Then unregister
@@ -60,7 +119,7 @@ class TestMCPRegistry:
     @pytest.mark.asyncio
     async def test_list_servers(self, registry, server_config):
         """Test listing servers."""
-        registry._client = AsyncMock()
+        registry_upstream = mock_upstream(registry.pools)
         await registry.register_server(server_config)
         
         servers = await registry.list_servers()
@@ -71,9 +130,8 @@ class TestMCPRegistry:
     @pytest.mark.asyncio
     async def test_list_tools(self, registry, server_config):
         """Test listing tools."""
-        registry._client = AsyncMock()
-        registry._client.get.return_value.status_code = 200
-        registry._client.get.return_value.json.return_value = {
+        registry_upstream = mock_upstream(registry.pools)
+        registry_upstream.get.return_value = upstream_response(json={
             "tools": [
                 {
                     "name": "test_tool",
@@ -81,7 +139,7 @@ class TestMCPRegistry:
                     "parameters": {"param1": "string"}
                 }
             ]
-        }
+        })
         
         await registry.register_server(server_config)
         await registry._refresh_server_tools("test_server")
@@ -93,6 +151,464 @@ class TestMCPRegistry:
         assert tools[0].full_name == "test_server.test_tool"
 
 
+class TestHealthScheduler:
+    """Tests for the per-server health check scheduler."""
+
+    @pytest.mark.asyncio
+    async def test_failing_server_backs_off(self):
+        """A failing server is re-probed quickly, then with exponential backoff up to the cap."""
+        registry = MCPRegistry()
+        add_online_server(registry, health_retry_interval=1, health_backoff_max=3, health_jitter=0)
+
+        async def fail(server_name, refresh_tools=True):
+            registry._set_status(registry.servers[server_name], ServerStatus.ERROR)
+
+        registry._check_server_health = fail
+        delays = []
+        for _ in range(4):
+            await registry._scheduled_probe("test_server")
+            delays.append(round(registry._next_probe["test_server"] - time.monotonic()))
+
+        assert delays == [1, 2, 3, 3]
+        assert registry.servers["test_server"].consecutive_failures == 4
+
+    @pytest.mark.asyncio
+    async def test_catalog_has_its_own_cadence(self):
+        """Healthy servers are probed every health_interval; tools only when their interval is due."""
+        registry = MCPRegistry()
+        add_online_server(registry, health_interval=10, tools_refresh_interval=300, health_jitter=0)
+        calls = []
+
+        async def ok(server_name, refresh_tools=True):
+            calls.append(refresh_tools)
+
+        registry._check_server_health = ok
+        await registry._scheduled_probe("test_server")
+        await registry._scheduled_probe("test_server")
+
+        assert calls == [True, False]
+        assert round(registry._next_probe["test_server"] - time.monotonic()) == 10
+        assert round(registry._next_tools["test_server"] - time.monotonic()) == 300
+
+    @pytest.mark.asyncio
+    async def test_probes_are_capped(self):
+        """No more than max_concurrent_probes health checks run at once."""
+        registry = MCPRegistry(max_concurrent_probes=2)
+        for i in range(6):
+            add_online_server(registry, name=f"s{i}", tools=())
+        active = peak = 0
+
+        async def slow(server_name, refresh_tools=True):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+        registry._check_server_health = slow
+        await registry.start_background_refresh()
+        await asyncio.sleep(0.1)
+        await registry.shutdown()
+
+        assert peak == 2
+        assert set(registry._next_probe) == {f"s{i}" for i in range(6)}
+
+
+    @pytest.mark.asyncio
+    async def test_startup_registers_concurrently_with_deadline(self):
+        """Servers are probed in parallel; a slow one keeps warming up after the startup deadline."""
+        registry = MCPRegistry()
+        release = asyncio.Event()
+
+        async def check(server_name, refresh_tools=True):
+            if server_name == "slow":
+                await release.wait()
+            registry._set_status(registry.servers[server_name], ServerStatus.ONLINE)
+
+        registry._check_server_health = check
+        configs = [MCPServerConfig(name=name, url="http://localhost:3000") for name in ("fast", "slow")]
+        started = time.monotonic()
+        assert await registry.register_servers(configs, timeout=0.05) == 1
+        assert time.monotonic() - started < 1
+
+        warmup = registry.warmup_stats()
+        assert warmup["done"] == 1 and warmup["total"] == 2
+        assert warmup["servers"]["slow"]["state"] == "probing"
+        # o agendador não sonda de novo um servidor ainda no primeiro probe
+        assert "slow" in registry._probing
+
+        release.set()
+        await asyncio.sleep(0.01)
+        assert registry.warmup_stats()["done"] == 2
+        assert registry.servers_online == 2 and not registry._probing
+
+
+class TestPassiveHealth:
+    """Tests for health tracking from real call outcomes."""
+
+    def test_errors_degrade_then_take_offline(self):
+        """Call failures degrade a server, and enough in a row take it out of rotation."""
+        registry = MCPRegistry()
+        add_online_server(registry, degraded_error_rate=0.15, passive_offline_failures=3, health_retry_interval=1)
+        info = registry.servers["test_server"]
+
+        registry.record_call_result("test_server", True, 10.0)
+        registry.record_call_result("test_server", False, 10.0)
+        registry.record_call_result("test_server", False, 10.0)
+        assert info.status == ServerStatus.DEGRADED
+        assert registry.servers_online == 1
+
+        registry.record_call_result("test_server", False, 10.0)
+        assert info.status == ServerStatus.ERROR
+        assert registry.servers_online == 0
+        assert registry._next_probe["test_server"] - time.monotonic() <= 1
+
+    def test_recovers_with_hysteresis(self):
+        """A degraded server is ONLINE again once its error rate falls well below the threshold."""
+        registry = MCPRegistry()
+        add_online_server(registry, degraded_error_rate=0.2, degraded_latency_ms=500)
+        info = registry.servers["test_server"]
+        info.error_rate = 0.25
+        registry.record_call_result("test_server", True, 20.0)
+        assert info.status == ServerStatus.DEGRADED
+
+        for _ in range(10):
+            registry.record_call_result("test_server", True, 20.0)
+        assert info.status == ServerStatus.ONLINE
+        assert info.latency_ewma_ms == pytest.approx(20.0)
+        assert info.last_success is not None
+
+        for _ in range(30):
+            registry.record_call_result("test_server", True, 2000.0)
+        assert info.status == ServerStatus.DEGRADED
+
+    @pytest.mark.asyncio
+    async def test_recent_traffic_skips_probe(self):
+        """Scheduled probes are skipped while real calls keep succeeding."""
+        registry = MCPRegistry()
+        add_online_server(registry, health_interval=30)
+        registry._next_tools["test_server"] = time.monotonic() + 300
+        registry._check_server_health = AsyncMock()
+
+        registry.record_call_result("test_server", True, 5.0)
+        await registry._scheduled_probe("test_server")
+
+        registry._check_server_health.assert_not_called()
+        assert registry.refresh_stats()["totals"]["probes_skipped"] == 1
+
+    @pytest.mark.asyncio
+    async def test_router_reports_call_outcomes(self):
+        """Upstream failures seen by the router reach the registry right away."""
+        registry = MCPRegistry()
+        add_online_server(registry, passive_offline_failures=2)
+        router = MCPRouter(registry)
+        mock_upstream(router.pools).post.return_value = MagicMock(status_code=503)
+
+        for _ in range(2):
+            await router.execute_tool(ToolCallRequest(tool="test_server.test_tool"))
+        response = await router.execute_tool(ToolCallRequest(tool="test_server.test_tool"))
+
+        assert registry.servers["test_server"].status == ServerStatus.ERROR
+        assert response.error == "server_offline"
+
+
+class TestReplicas:
+    """Tests for per-server replicas and load balancing."""
+
+    REPLICAS = ["http://replica-b:3000", "http://replica-c:3000"]
+
+    def test_p2c_avoids_slow_and_busy_replicas(self):
+        """Power of two choices sends calls to the replica with the lowest latency × load."""
+        registry = MCPRegistry()
+        add_online_server(registry, replicas=self.REPLICAS[:1])
+        replicas = registry.replicas_for("test_server")
+        fast, slow = replicas.replicas
+        replicas.finish(fast, True, 10.0)
+        replicas.finish(slow, True, 500.0)
+
+        assert {replicas.pick().url for _ in range(20)} == {fast.url}
+        for _ in range(60):
+            replicas.start(fast)
+        assert replicas.pick() is slow
+
+    def test_ejects_failing_replica_and_readmits_it(self):
+        """Consecutive failures eject a replica for a while; every replica is used if all are out."""
+        registry = MCPRegistry()
+        add_online_server(registry, replicas=self.REPLICAS, replica_eject_failures=2, replica_eject_seconds=10)
+        replicas = registry.replicas_for("test_server")
+        bad = replicas.replicas[0]
+
+        for _ in range(2):
+            replicas.start(bad)
+            replicas.finish(bad, False, 5.0)
+        assert bad.stats()["ejected"] and bad.ejections_total == 1
+        assert bad not in {replicas.pick() for _ in range(30)}
+
+        bad.ejected_until = time.monotonic() - 1
+        assert bad in {replicas.pick() for _ in range(30)}
+
+        for replica in replicas.replicas:
+            replicas.mark_health(replica, False)
+        assert replicas.pick() in replicas.replicas
+
+    @pytest.mark.asyncio
+    async def test_health_probes_every_replica(self):
+        """A server stays ONLINE while any replica answers; dead replicas leave rotation."""
+        registry = MCPRegistry()
+        add_online_server(registry, replicas=self.REPLICAS)
+        registry._refresh_server_tools = AsyncMock()
+        upstream = mock_upstream(registry.pools)
+
+        async def health(url, **kwargs):
+            if "replica-b" in url:
+                raise httpx.ConnectError("connection refused")
+            return upstream_response()
+
+        upstream.get.side_effect = health
+        await registry._check_server_health("test_server")
+
+        info = registry.servers["test_server"]
+        assert info.status == ServerStatus.ONLINE
+        assert "replica-b" in info.error_message
+        stats = {r["url"]: r["healthy"] for r in registry.replica_stats()["test_server"]}
+        assert stats == {"http://localhost:3000": True, "http://replica-b:3000": False, "http://replica-c:3000": True}
+        assert registry.replicas_for("test_server").primary().url == "http://localhost:3000"
+
+    @pytest.mark.asyncio
+    async def test_router_spreads_calls_and_reports_outcomes(self):
+        """Calls go to the picked replica's URL and its outcome feeds the balancer."""
+        registry = MCPRegistry()
+        add_online_server(registry, replicas=self.REPLICAS[:1], replica_eject_failures=1)
+        router = MCPRouter(registry)
+        upstream = mock_upstream(router.pools)
+
+        async def call(url, **kwargs):
+            if "replica-b" in url:
+                return MagicMock(status_code=503)
+            return MagicMock(status_code=200, json=MagicMock(return_value={"result": "ok"}))
+
+        upstream.post.side_effect = call
+        for _ in range(10):
+            await router.execute_tool(ToolCallRequest(tool="test_server.test_tool"))
+
+        stats = {r["url"]: r for r in registry.replica_stats()["test_server"]}
+        assert stats["http://replica-b:3000"]["ejected"]
+        assert stats["http://replica-b:3000"]["requests_total"] <= 2
+        assert stats["http://localhost:3000"]["outstanding"] == 0
+        assert stats["http://localhost:3000"]["requests_total"] >= 8
+
+
+class TestRegistryIndexes:
+    """Tests for the registry's secondary indexes."""
+
+    @pytest.mark.asyncio
+    async def test_filters_and_counts(self):
+        """Tools can be listed by server, prefix and tag; counts follow status changes."""
+        registry = MCPRegistry()
+        add_online_server(registry, name="github", tools=())
+        add_online_server(registry, name="jira", tools=("issue_get",))
+        upstream = mock_upstream(registry.pools)
+        upstream.get.return_value = upstream_response(json={"tools": [
+            {"name": "issue_get", "tags": ["issues"]},
+            {"name": "issue_list", "tags": "issues", "category": "read"},
+            {"name": "repo_get", "category": "read"},
+        ]})
+        await registry._refresh_server_tools("github")
+
+        names = lambda tools: [t.full_name for t in tools]
+        assert names(await registry.list_tools(prefix="github.issue")) == ["github.issue_get", "github.issue_list"]
+        assert names(await registry.list_tools(tag="read")) == ["github.issue_list", "github.repo_get"]
+        assert names(await registry.list_tools(server_name="github", tag="issues", prefix="github.issue_l")) == [
+            "github.issue_list"
+        ]
+        assert names(await registry.list_tools(server_name="jira")) == ["jira.issue_get"]
+
+        assert (registry.tools_count, registry.servers_online) == (4, 2)
+        registry._set_status(registry.servers["jira"], ServerStatus.ERROR)
+        await registry.unregister_server("github")
+        assert (registry.tools_count, registry.servers_online) == (1, 0)
+        assert await registry.list_tools(tag="read") == []
+        assert await registry.list_tools(prefix="github.") == []
+
+    def test_tools_endpoint_filters(self, monkeypatch):
+        """GET /tools accepts prefix and tag filters."""
+        import app.main as main_module
+
+        registry = MCPRegistry()
+        add_online_server(registry, tools=("read_file", "write_file", "list_dir"))
+        monkeypatch.setattr(main_module, "registry", registry, raising=False)
+        disable_rate_limit(monkeypatch)
+
+        data = TestClient(app).get("/tools?prefix=test_server.read").json()
+        assert [t["name"] for t in data["tools"]] == ["read_file"]
+        assert data["total_count"] == 1
+
+
+class TestToolSearch:
+    """Tests for ranked tool search."""
+
+    TOOLS = [
+        {"name": "read_file", "description": "Read the contents of a file", "parameters": {"path": "string"}},
+        {"name": "writeFile", "description": "Write text to a file", "parameters": {"path": "string"}},
+        {"name": "list_issues", "description": "List open GitHub issues", "parameters": {"repo": "string"}},
+    ]
+
+    def test_tokenize_splits_identifiers(self):
+        """snake_case, camelCase and stop words are handled by the tokenizer."""
+        assert tokenize("getHTTPResponse read_file-v2 the") == ["get", "http", "response", "read", "file", "v2"]
+
+    def test_ranking_and_removal(self):
+        """Name matches outrank description matches and removed tools disappear."""
+        index = ToolSearchIndex.build(
+            ToolSchema(server_name="fs", full_name="", **tool) for tool in self.TOOLS
+        )
+        assert [name for name, _ in index.search("read file")][:2] == ["fs.read_file", "fs.writeFile"]
+        assert [name for name, _ in index.search("github repo")] == ["fs.list_issues"]
+
+        index.remove("fs.read_file")
+        assert "fs.read_file" not in [name for name, _ in index.search("read file")]
+        assert index.search("nothing matches") == []
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("rebuild_threshold", [500, 1])
+    async def test_registry_keeps_index_current(self, rebuild_threshold):
+        """Refreshes update the index, incrementally or by a threaded rebuild."""
+        registry = MCPRegistry()
+        registry.SEARCH_REBUILD_THRESHOLD = rebuild_threshold
+        add_online_server(registry, name="fs", tools=())
+        tools = list(self.TOOLS)
+        upstream = mock_upstream(registry.pools)
+        upstream.get.side_effect = lambda url, **kwargs: upstream_response(json={"tools": tools})
+        await registry._refresh_server_tools("fs")
+
+        hits = await registry.search_tools("issues", k=5)
+        assert [(tool.full_name, score > 0) for tool, score in hits] == [("fs.list_issues", True)]
+
+        tools[2] = {"name": "list_pull_requests", "description": "List pull requests"}
+        await registry._refresh_server_tools("fs")
+        assert await registry.search_tools("issues") == []
+        assert len(registry.search_index) == 3
+
+    def test_search_endpoint(self, monkeypatch):
+        """GET /tools/search returns scored tools, best first."""
+        import app.main as main_module
+
+        registry = MCPRegistry()
+        add_online_server(registry, name="fs", tools=("read_file", "delete_file", "stat"))
+        monkeypatch.setattr(main_module, "registry", registry, raising=False)
+        disable_rate_limit(monkeypatch)
+
+        data = TestClient(app).get("/tools/search", params={"q": "delete", "k": 2}).json()
+        assert data["total_count"] == 1
+        assert data["results"][0]["full_name"] == "fs.delete_file"
+        assert data["results"][0]["score"] > 0
+
+
+class TestCatalogSnapshot:
+    """Tests for the pre-serialized /tools catalog."""
+
+    @staticmethod
+    def registry_serving(tools):
+        """Registry with one ONLINE server whose /tools endpoint returns ``tools``."""
+        registry = MCPRegistry()
+        add_online_server(registry, tools=())
+        upstream = mock_upstream(registry.pools)
+        upstream.get.side_effect = lambda url, **kwargs: upstream_response(json={"tools": tools})
+        return registry
+
+    @pytest.mark.asyncio
+    async def test_unchanged_refresh_keeps_snapshot(self):
+        """Only a refresh that changes the catalog produces a new version."""
+        tools = [{"name": "a", "description": "A"}]
+        registry = self.registry_serving(tools)
+        await registry._refresh_server_tools("test_server")
+        snapshot = registry.catalog_snapshot()
+
+        await registry._refresh_server_tools("test_server")
+        assert registry.catalog_snapshot() is snapshot
+
+        tools.append({"name": "b"})
+        await registry._refresh_server_tools("test_server")
+        changed = registry.catalog_snapshot()
+        assert changed.version > snapshot.version
+        assert json.loads(changed.view().body)["total_count"] == 2
+        # o corpo montado a partir dos registros é o mesmo que o modelo serializaria
+        assert changed.view().body == ListToolsResponse(
+            tools=list(registry.tools.values()),
+            total_count=2,
+            servers_online=1,
+            last_updated=changed.last_updated,
+        ).model_dump_json().encode("utf-8")
+
+    @pytest.mark.asyncio
+    async def test_refresh_applies_diff(self):
+        """A refresh applies only the differences and records their counts."""
+        tools = [{"name": "a"}, {"name": "b"}, {"name": "c", "description": "old"}]
+        registry = self.registry_serving(tools)
+        removed = []
+        registry.add_tool_removed_listener(removed.append)
+        await registry._refresh_server_tools("test_server")
+        kept = registry.tools["test_server.a"]
+
+        tools[1:] = [{"name": "c", "description": "new"}, {"name": "d"}]
+        await registry._refresh_server_tools("test_server")
+
+        assert registry.tools["test_server.a"] is kept
+        assert set(registry.tools) == {"test_server.a", "test_server.c", "test_server.d"}
+        assert registry.tools["test_server.c"].description == "new"
+        assert sorted(removed) == ["test_server.b", "test_server.c"]
+        last = registry.refresh_stats()["servers"]["test_server"]
+        assert (last["result"], last["added"], last["removed"], last["changed"]) == ("changed", 1, 1, 1)
+
+        await registry._refresh_server_tools("test_server")
+        assert registry.refresh_stats()["servers"]["test_server"]["result"] == "unchanged"
+
+    @pytest.mark.asyncio
+    async def test_refresh_uses_conditional_request(self):
+        """The ETag of a tool list is sent back and a 304 keeps the catalog."""
+        registry = MCPRegistry()
+        add_online_server(registry, tools=())
+        upstream = mock_upstream(registry.pools)
+        upstream.get.return_value = upstream_response(json={"tools": [{"name": "a"}]}, headers={"ETag": '"v1"'})
+        await registry._refresh_server_tools("test_server")
+
+        upstream.get.return_value = upstream_response(304)
+        await registry._refresh_server_tools("test_server")
+
+        assert upstream.get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+        assert list(registry.tools) == ["test_server.a"]
+        assert registry.refresh_stats()["totals"]["refreshes_not_modified"] == 1
+
+    def test_etag_and_not_modified(self, monkeypatch):
+        """GET /tools sends an ETag and answers 304 to a matching If-None-Match."""
+        import app.main as main_module
+
+        registry = MCPRegistry()
+        add_online_server(registry, tools=("a", "b"))
+        add_online_server(registry, name="other", tools=[f"t{i}" for i in range(40)])
+        monkeypatch.setattr(main_module, "registry", registry, raising=False)
+        disable_rate_limit(monkeypatch)
+        client = TestClient(app)
+
+        first = client.get("/tools", headers={"Accept-Encoding": "identity"})
+        assert first.status_code == 200
+        assert first.json()["total_count"] == 42
+        etag = first.headers["etag"]
+
+        again = client.get("/tools", headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.content == b""
+
+        zipped = client.get("/tools", headers={"Accept-Encoding": "gzip"})
+        assert zipped.headers["content-encoding"] == "gzip"
+        assert zipped.headers["etag"] != etag
+        assert zipped.json()["total_count"] == 42
+
+        view = client.get("/tools?server=test_server")
+        assert [t["full_name"] for t in view.json()["tools"]] == ["test_server.a", "test_server.b"]
+        assert view.headers["etag"] != etag
+
+
 class TestMCPRouter:
     """Tests for MCPRouter."""
     
@@ -118,16 +634,17 @@ class TestMCPRouter:
         
         registry.get_server_info = AsyncMock(return_value=MagicMock(
             status="online",
-            config=MagicMock(
+            config=MCPServerConfig(
+                name="test_server",
                 url="http://localhost:3000",
                 timeout=30
             )
         ))
         
         # Mock HTTP client
-        router._client = AsyncMock()
-        router._client.post.return_value.status_code = 200
-        router._client.post.return_value.json.return_value = {
+        router_upstream = mock_upstream(router.pools)
+        router_upstream.post.return_value = MagicMock(status_code=200)
+        router_upstream.post.return_value.json.return_value = {
             "result": "Tool executed successfully"
         }
         
@@ -158,6 +675,1419 @@ class TestMCPRouter:
         assert response.error == "tool_not_found"
 
 
+class TestHedging:
+    """Tests for hedged requests on idempotent tools."""
+
+    @staticmethod
+    def hedged_router(**config):
+        registry = MCPRegistry()
+        add_online_server(
+            registry, replicas=["http://replica-b:3000"], idempotent_tools=["test_tool"], **config
+        )
+        router = MCPRouter(registry)
+        upstream = mock_upstream(router.pools)
+        urls = []
+
+        async def call(url, **kwargs):
+            urls.append(url)
+            if len(urls) == 1:
+                await asyncio.sleep(5)  # primeira requisição "presa" no upstream
+            return MagicMock(status_code=200, json=MagicMock(return_value={"result": len(urls)}))
+
+        upstream.post.side_effect = call
+        return registry, router, urls
+
+    @pytest.mark.asyncio
+    async def test_slow_call_is_hedged_to_another_replica(self):
+        """The hedge answers first, the slow request is cancelled and nothing counts as a failure."""
+        registry, router, urls = self.hedged_router(hedge_delay_ms=20, hedge_budget=1.0)
+
+        response = await asyncio.wait_for(router.execute_tool(ToolCallRequest(tool="test_server.test_tool")), 1)
+
+        assert response.success and response.result == 2
+        assert len(urls) == 2 and urls[0] != urls[1]
+        assert router.state.counter("hedges_sent_total") == 1
+        assert router.state.counter("hedges_won_total") == 1
+        stats = registry.replica_stats()["test_server"]
+        assert [r["outstanding"] for r in stats] == [0, 0]
+        assert sum(r["failures_total"] for r in stats) == 0
+
+    @pytest.mark.asyncio
+    async def test_budget_caps_hedges(self):
+        """No hedge is sent once the budget is spent; the call waits for its only request."""
+        registry, router, urls = self.hedged_router(hedge_delay_ms=20, hedge_budget=0.0)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(router.execute_tool(ToolCallRequest(tool="test_server.test_tool")), 0.2)
+
+        assert len(urls) == 1
+        assert router.state.counter("hedges_sent_total") == 0
+        assert router.state.counter("hedges_budget_exhausted_total") == 1
+
+    def test_delay_follows_tool_percentile(self):
+        """With enough samples the hedge delay is the tool's latency percentile."""
+        registry = MCPRegistry()
+        config = add_online_server(registry, idempotent_tools=["*"], hedge_percentile=90, hedge_delay_ms=500)
+        router = MCPRouter(registry)
+        assert router._hedge_delay(config, "test_tool") == 500
+
+        router._latency["test_server.test_tool"] = window = LatencyWindow(min_samples=10)
+        for latency in range(1, 101):
+            window.record(float(latency))
+        assert router._hedge_delay(config, "test_tool") == 91.0
+
+    def test_request_budget_ratio(self):
+        """Extra requests are limited to the configured fraction of regular ones."""
+        budget = RequestBudget(0.1)
+        allowed = 0
+        for _ in range(100):
+            budget.deposit()
+            allowed += budget.try_spend()
+        assert allowed == 10
+        assert budget.stats()["denied"] == 90
+
+
+class TestRetriesAndDeadlines:
+    """Tests for call retries, retry budgets and client deadlines."""
+
+    @pytest.mark.asyncio
+    async def test_connection_reset_is_retried_for_idempotent_tools(self):
+        """A reset connection is retried for idempotent tools only."""
+        registry = MCPRegistry()
+        add_online_server(registry, tools=("read", "write"), idempotent_tools=["read"], retry_backoff_ms=1)
+        router = MCPRouter(registry)
+        upstream = mock_upstream(router.pools)
+        ok = MagicMock(status_code=200, json=MagicMock(return_value={"result": "ok"}))
+        upstream.post.side_effect = [httpx.ReadError("connection reset"), ok]
+
+        response = await router.execute_tool(ToolCallRequest(tool="test_server.read"))
+        assert response.success and upstream.post.call_count == 2
+        assert router.state.counter("retries_total") == 1
+
+        upstream.post.side_effect = [httpx.ReadError("connection reset"), ok]
+        response = await router.execute_tool(ToolCallRequest(tool="test_server.write"))
+        assert not response.success and upstream.post.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_retry_budget_limits_amplification(self):
+        """During an outage retries stay within the budget instead of multiplying the load."""
+        registry = MCPRegistry()
+        add_online_server(
+            registry, idempotent_tools=["*"], call_retries=3, retry_backoff_ms=0,
+            circuit_breaker_failures=1000, passive_offline_failures=1000,
+        )
+        router = MCPRouter(registry)
+        mock_upstream(router.pools).post.return_value = MagicMock(status_code=503)
+
+        for i in range(50):
+            await router.execute_tool(ToolCallRequest(tool="test_server.test_tool", arguments={"i": i}))
+
+        # 10% das chamadas mais o piso de 1 retry/s
+        assert router.state.counter("retries_total") <= 50 * 0.1 + 2
+        assert router.state.counter("retry_budget_exhausted_total") > 0
+
+    @pytest.mark.asyncio
+    async def test_deadline_caps_call_and_is_propagated(self):
+        """The client deadline bounds the call, reaches the upstream and does not trip the breaker."""
+        registry = MCPRegistry()
+        add_online_server(registry, circuit_breaker_failures=1)
+        router = MCPRouter(registry)
+        upstream = mock_upstream(router.pools)
+
+        async def slow(url, **kwargs):
+            await asyncio.sleep(5)
+
+        upstream.post.side_effect = slow
+        started = time.monotonic()
+        response = await router.execute_tool(ToolCallRequest(tool="test_server.test_tool", timeout_ms=50))
+
+        assert response.error == "deadline_exceeded"
+        assert time.monotonic() - started < 1
+        assert 0 < int(upstream.post.call_args.kwargs["headers"]["X-Timeout-Ms"]) <= 50
+        assert upstream.post.call_args.kwargs["timeout"].read <= 0.05
+        assert not router._is_circuit_open("test_server")
+        assert router.state.counter("deadline_exceeded_total") == 1
+
+    def test_deadline_header(self, monkeypatch):
+        """X-Timeout-Ms sets the deadline of calls; invalid values are rejected."""
+        disable_rate_limit(monkeypatch)
+        router = MagicMock()
+        router.execute_tool = AsyncMock(return_value=ToolCallResponse(success=True, server_name="s"))
+        app.dependency_overrides[get_router] = lambda: router
+        try:
+            client = TestClient(app)
+            body = {"tool": "s.t"}
+            assert client.post("/call", json=body, headers={"X-Timeout-Ms": "250"}).status_code == 200
+            assert router.execute_tool.call_args.args[0].timeout_ms == 250
+            assert client.post("/call", json=body, headers={"X-Timeout-Ms": "soon"}).status_code == 400
+        finally:
+            app.dependency_overrides.clear()
+
+
+class TestBulkheads:
+    """Tests for per-server concurrency limits and load shedding."""
+
+    @pytest.mark.asyncio
+    async def test_queue_then_shed(self):
+        """Calls beyond the limit queue FIFO up to max_queue; the rest are shed at once."""
+        bulkhead = Bulkhead(limit=1, max_queue=1, queue_timeout=0.05)
+        await bulkhead.acquire()
+        waiter = asyncio.create_task(bulkhead.acquire())
+        await asyncio.sleep(0)
+        assert (bulkhead.in_flight, bulkhead.queued) == (1, 1)
+
+        with pytest.raises(BulkheadRejected) as shed:
+            await bulkhead.acquire()
+        assert shed.value.reason == "queue_full" and shed.value.retry_after == 1
+
+        bulkhead.release()
+        await waiter
+        assert (bulkhead.in_flight, bulkhead.queued) == (1, 0)
+
+        with pytest.raises(BulkheadRejected) as shed:
+            await bulkhead.acquire()
+        assert shed.value.reason == "queue_timeout"
+        assert bulkhead.stats()["shed_total"] == {"queue_full": 1, "queue_timeout": 1}
+        assert bulkhead.queued == 0
+
+        bulkhead.limit = 2
+        await bulkhead.acquire()
+        assert bulkhead.in_flight == 2
+
+    @pytest.mark.asyncio
+    async def test_router_sheds_without_blaming_server(self):
+        """A burst to a slow server is shed with server_overloaded and leaves its health alone."""
+        registry = MCPRegistry()
+        add_online_server(registry, max_in_flight=1, max_queue=1, queue_timeout=5, circuit_breaker_failures=1)
+        router = MCPRouter(registry)
+        release = asyncio.Event()
+
+        async def slow(url, **kwargs):
+            await release.wait()
+            return MagicMock(status_code=200, json=MagicMock(return_value={"result": "ok"}))
+
+        mock_upstream(router.pools).post.side_effect = slow
+        calls = [
+            asyncio.create_task(router.execute_tool(ToolCallRequest(tool="test_server.test_tool")))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0.01)
+        assert router.bulkhead_stats()["test_server"]["queued"] == 1
+        release.set()
+        results = await asyncio.gather(*calls)
+
+        assert sorted(r.error or "ok" for r in results) == ["ok", "ok", "server_overloaded"]
+        assert not router._is_circuit_open("test_server")
+        assert registry.servers["test_server"].consecutive_call_failures == 0
+        assert router.bulkhead_stats()["test_server"]["in_flight"] == 0
+
+    def test_overloaded_call_returns_503(self, monkeypatch):
+        """/call answers 503 with Retry-After when the call was shed."""
+        disable_rate_limit(monkeypatch)
+        router = MagicMock()
+        router.execute_tool = AsyncMock(
+            return_value=ToolCallResponse(success=False, error="server_overloaded", server_name="s")
+        )
+        router.retry_after.return_value = 2
+        app.dependency_overrides[get_router] = lambda: router
+        try:
+            response = TestClient(app).post("/call", json={"tool": "s.t"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "2"
+        assert response.json()["error"] == "server_overloaded"
+
+
+class TestAdaptiveConcurrency:
+    """Tests for per-server concurrency limits learned from latency and errors."""
+
+    def test_aimd_grows_under_load_and_backs_off(self):
+        """AIMD adds about one per limit of busy successful calls and cuts on failures."""
+        limit = AIMDLimit(initial=10, min_limit=2, max_limit=50)
+        for _ in range(100):
+            limit.update(10.0, dropped=False, in_flight=10)
+        assert 15 <= limit.limit <= 25
+
+        idle = limit.limit
+        limit.update(10.0, dropped=False, in_flight=1)
+        assert limit.limit == idle
+
+        for _ in range(50):
+            limit.update(10.0, dropped=True, in_flight=10)
+        assert limit.limit == 2
+        assert [entry["limit"] for entry in limit.stats()["history"]][0] == 10
+
+    def test_gradient_follows_latency(self):
+        """The gradient limit grows at baseline latency and shrinks when latency rises."""
+        limit = GradientLimit(initial=20, min_limit=1, max_limit=100)
+        for _ in range(50):
+            limit.update(10.0, dropped=False, in_flight=limit.limit)
+        grown = limit.limit
+        assert grown > 20
+
+        for _ in range(100):
+            limit.update(40.0, dropped=False, in_flight=limit.limit)
+        assert limit.limit < grown / 2
+        assert limit.stats()["baseline_ms"] == pytest.approx(10.0, rel=0.2)
+
+    @pytest.mark.asyncio
+    async def test_router_adapts_bulkhead_and_reports_in_status(self, monkeypatch):
+        """Upstream failures shrink the learned limit, which /status reports."""
+        import app.main as main_module
+
+        registry = MCPRegistry()
+        add_online_server(
+            registry, adaptive_concurrency="aimd", max_in_flight=20,
+            circuit_breaker_failures=1000, passive_offline_failures=1000,
+        )
+        router = MCPRouter(registry)
+        mock_upstream(router.pools).post.return_value = MagicMock(status_code=503)
+        for i in range(10):
+            await router.execute_tool(ToolCallRequest(tool="test_server.test_tool", arguments={"i": i}))
+
+        assert router.bulkhead_stats()["test_server"]["limit"] == router.concurrency_limits()["test_server"]["limit"]
+        assert router.concurrency_limits()["test_server"]["limit"] < 20
+
+        monkeypatch.setattr(main_module, "router", router, raising=False)
+        monkeypatch.setattr(main_module, "registry", registry, raising=False)
+        disable_rate_limit(monkeypatch)
+        status = TestClient(app).get("/status").json()
+        assert status["concurrency_limits"]["test_server"]["algorithm"] == "aimd"
+        assert len(status["concurrency_limits"]["test_server"]["history"]) > 1
+
+
+class TestLabeledMetrics:
+    """Tests for labeled counters, histograms and their exposition."""
+
+    def test_histogram_buckets_and_cardinality_guard(self):
+        """Histograms render cumulative buckets; extra tool labels fold into __other__."""
+        metrics = MetricsRegistry(max_series=2)
+        histogram = metrics.histogram("latency_seconds", "Latency", ("server", "tool"), bounded=("tool",))
+        histogram.observe(0.003, server="a", tool="read")
+        histogram.observe(0.2, server="a", tool="read")
+        histogram.observe(0.01, server="a", tool="write")
+        histogram.observe(0.01, server="a", tool="list")
+        histogram.observe(0.01, server="a", tool="delete")
+
+        assert histogram.count(server="a", tool="read") == 2
+        assert histogram.count(server="a", tool=OVERFLOW_LABEL) == 2
+        text = "\n".join(metrics.render_prometheus())
+        assert 'latency_seconds_bucket{server="a",tool="read",le="0.005"} 1' in text
+        assert 'latency_seconds_bucket{server="a",tool="read",le="+Inf"} 2' in text
+        assert 'latency_seconds_count{server="a",tool="read"} 2' in text
+        assert 'mcp_one_metric_series_overflowed_total{metric="latency_seconds"} 2' in text
+
+        series = metrics.snapshot()["latency_seconds"]["series"]
+        read = next(s for s in series if s["labels"]["tool"] == "read")
+        assert read["buckets"]["0.25"] == 2 and read["sum"] == pytest.approx(0.203)
+
+    @pytest.mark.asyncio
+    async def test_router_records_call_and_upstream_latency(self):
+        """Calls are counted per server, tool and result, with upstream time split from hub overhead."""
+        metrics = HubMetrics(MetricsRegistry())
+        registry = MCPRegistry(metrics=metrics)
+        add_online_server(registry, tools=("read",))
+        router = MCPRouter(registry)
+        upstream = mock_upstream(router.pools)
+        upstream.post.side_effect = [
+            MagicMock(status_code=200, json=MagicMock(return_value={"result": 1})),
+            MagicMock(status_code=503),
+        ]
+
+        await router.execute_tool(ToolCallRequest(tool="test_server.read"))
+        await router.execute_tool(ToolCallRequest(tool="test_server.read"))
+        await router.execute_tool(ToolCallRequest(tool="test_server.random_name"))
+
+        assert metrics.tool_calls.value(server="test_server", tool="read", result="ok") == 1
+        assert metrics.tool_calls.value(server="test_server", tool="read", result="http_error_503") == 1
+        assert metrics.tool_calls.value(server="unknown", tool="", result="tool_not_found") == 1
+        assert metrics.call_duration.count(server="test_server", tool="read") == 2
+        assert metrics.upstream_duration.count(server="test_server", result="ok") == 1
+        assert metrics.hub_overhead.count(server="test_server") == 2
+
+    def test_json_and_prometheus_share_series(self, monkeypatch):
+        """/metrics and /metrics/prometheus expose the same labeled series."""
+        disable_rate_limit(monkeypatch)
+        METRICS.counter("mcp_one_test_events_total", "Test events", ("kind",)).inc(3, kind="x")
+        client = TestClient(app)
+
+        series = client.get("/metrics").json()["series"]["mcp_one_test_events_total"]["series"]
+        assert series == [{"labels": {"kind": "x"}, "value": 3}]
+        assert 'mcp_one_test_events_total{kind="x"} 3' in client.get("/metrics/prometheus").text
+
+
+class TestWorkers:
+    """Tests for multi-worker coordination: leader election, shared catalog and metrics."""
+
+    @pytest.mark.asyncio
+    async def test_follower_loads_leader_snapshot(self, tmp_path):
+        """A follower takes statuses and tools from the snapshot and decodes only changed servers."""
+        leader = MCPRegistry()
+        add_online_server(leader, tools=("read", "write"))
+        add_online_server(leader, name="other", tools=("ping",))
+        path = str(tmp_path / "catalog.snapshot")
+        write_snapshot(path, leader.encode_snapshot(generation=1))
+
+        follower = MCPRegistry()
+        for name in ("test_server", "other"):
+            await follower.register_server(MCPServerConfig(name=name, url="http://localhost:3000"), probe=False)
+        assert follower.servers_online == 0
+
+        snapshot = SnapshotReader(path)
+        assert snapshot.generation == 1 and snapshot.tools_count == 3
+        assert await follower.load_snapshot(snapshot) == 2
+        assert follower.servers_online == 2
+        assert set(follower.tools) == {"test_server.read", "test_server.write", "other.ping"}
+        assert follower.servers["test_server"].tools_count == 2
+
+        leader._apply_server_tools("other", {})
+        write_snapshot(path, leader.encode_snapshot(generation=2))
+        assert await follower.load_snapshot(SnapshotReader(path)) == 1
+        assert set(follower.tools) == {"test_server.read", "test_server.write"}
+
+    @pytest.mark.asyncio
+    async def test_leadership_moves_when_leader_closes(self, tmp_path):
+        """Only one worker holds the lock; another takes over once it is released."""
+        first = WorkerGroup(str(tmp_path))
+        second = WorkerGroup(str(tmp_path))
+        assert first.elect() and not second.elect()
+
+        await first.close()
+        assert second.elect()
+        await second.close()
+
+    @pytest.mark.asyncio
+    async def test_metrics_are_summed_across_workers(self, tmp_path):
+        """Counters and labeled series of live workers are added; dumps of dead workers are dropped."""
+        local = MetricsRegistry()
+        local.counter("calls_total", "Calls", ("server",)).inc(2, server="a")
+        local.histogram("latency_seconds", "Latency").observe(0.003)
+        state = StateBackend()
+        state.incr("call_requests_total", 2)
+
+        group = WorkerGroup(str(tmp_path))
+        group._state, group._metrics = state, local
+
+        other = MetricsRegistry()
+        other.counter("calls_total", "Calls", ("server",)).inc(5, server="a")
+        other.histogram("latency_seconds", "Latency").observe(0.2)
+        dump = {"counters": {"call_requests_total": 3}, "series": other.export()}
+        # o processo pai está vivo; um pid inexistente simula um worker que morreu
+        for pid in (os.getppid(), 2 ** 22 + 1):
+            (tmp_path / "metrics" / f"{pid}.json").write_text(json.dumps(dump))
+
+        counters, merged = group.aggregate()
+        assert counters["call_requests_total"] == 5
+        assert merged.counter("calls_total", "Calls", ("server",)).value(server="a") == 7
+        assert merged.histogram("latency_seconds", "Latency").count() == 2
+        assert not (tmp_path / "metrics" / f"{2 ** 22 + 1}.json").exists()
+
+
+class TestCatalogPersistence:
+    """Tests for the on-disk catalog snapshot used on warm restarts."""
+
+    @pytest.mark.asyncio
+    async def test_restart_serves_stale_catalog_until_revalidated(self, tmp_path):
+        """A new registry serves the persisted tools undecoded, stale until a conditional refresh."""
+        path = str(tmp_path / "catalog.snapshot")
+        previous = MCPRegistry(snapshot_path=path)
+        config = add_online_server(previous, tools=("read", "write"))
+        previous._put_tool(ToolSchema(name="read", server_name="test_server", full_name="", tags=["fs"]))
+        previous._tools_digests["test_server"] = "abc"
+        previous._tools_validators["test_server"] = {"If-None-Match": '"v1"'}
+        await previous.persist_snapshot()
+
+        registry = MCPRegistry(snapshot_path=path)
+        await registry.register_server(config, probe=False)
+        assert await registry.restore_snapshot() == 1
+        assert registry.servers_online == 1 and registry.servers["test_server"].stale
+        assert registry.tools.pending == 2
+        assert [t.full_name for t in await registry.list_tools(tag="fs")] == ["test_server.read"]
+        body = json.loads(registry.catalog_snapshot().view().body)
+        assert sorted(t["full_name"] for t in body["tools"]) == ["test_server.read", "test_server.write"]
+        assert registry.tools.pending == 1
+
+        upstream = mock_upstream(registry.pools)
+        upstream.get.return_value = upstream_response(304)
+        await registry._refresh_server_tools("test_server")
+        assert upstream.get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+        assert not registry.servers["test_server"].stale
+        await registry.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_changed_config_is_not_restored(self, tmp_path):
+        """Servers whose configuration changed since the snapshot start from scratch."""
+        path = str(tmp_path / "catalog.snapshot")
+        previous = MCPRegistry(snapshot_path=path)
+        add_online_server(previous)
+        await previous.persist_snapshot()
+
+        registry = MCPRegistry(snapshot_path=path)
+        await registry.register_server(
+            MCPServerConfig(name="test_server", url="http://localhost:3001"), probe=False
+        )
+        assert await registry.restore_snapshot() == 0
+        assert registry.tools_count == 0 and registry.servers_online == 0
+
+    @pytest.mark.asyncio
+    async def test_changes_are_persisted_once_per_burst(self, tmp_path, monkeypatch):
+        """Catalog and status changes schedule one atomic write after PERSIST_DELAY."""
+        path = tmp_path / "catalog.snapshot"
+        monkeypatch.setattr(MCPRegistry, "PERSIST_DELAY", 0.01)
+        registry = MCPRegistry(snapshot_path=str(path))
+        add_online_server(registry)
+        registry.invalidate_catalog()
+        assert not path.exists()
+
+        await asyncio.sleep(0.1)
+        snapshot = SnapshotReader(str(path))
+        assert snapshot.servers["test_server"].status["status"] == "online"
+        assert [t.full_name for t in snapshot.tools("test_server")] == ["test_server.test_tool"]
+
+
+class TestConfigReload:
+    """Tests for applying a reloaded server list without a restart."""
+
+    @pytest.mark.asyncio
+    async def test_only_changed_servers_are_touched(self):
+        """Removed servers leave with their router state; unchanged and retuned ones keep their tools."""
+        registry = MCPRegistry()
+        cache = ToolResultCache(enabled=True)
+        router = MCPRouter(registry, cache=cache)
+        kept = add_online_server(registry, name="kept", tools=("read",))
+        tuned = add_online_server(registry, name="tuned", tools=("write",))
+        gone = add_online_server(registry, name="gone", tools=("ping",))
+        router._bulkhead(gone)
+        cache.set("kept.read", "kept", ToolCallResponse(success=True, result="ok", server_name="kept"))
+        info = registry.servers["tuned"]
+
+        changes = await registry.update_servers([
+            kept,
+            MCPServerConfig(name="tuned", url="http://localhost:3000", max_in_flight=5),
+            MCPServerConfig(name="new", url="http://localhost:3001"),
+        ], probe=False)
+
+        assert changes == {"added": ["new"], "removed": ["gone"], "updated": ["tuned"], "unchanged": ["kept"]}
+        assert registry.servers["tuned"] is info and info.config.max_in_flight == 5
+        assert set(registry.tools) == {"kept.read", "tuned.write"}
+        assert registry.servers["new"].status == ServerStatus.CONNECTING
+        assert "gone" not in router._bulkheads
+        assert cache.get("kept") is not None
+        assert registry.config_version == 1
+
+    @pytest.mark.asyncio
+    async def test_upstream_change_revalidates_catalog(self):
+        """A new URL keeps serving the tools, drops their cached results and refreshes right away."""
+        registry = MCPRegistry()
+        cache = ToolResultCache(enabled=True)
+        MCPRouter(registry, cache=cache)
+        add_online_server(registry)
+        registry._tools_digests["test_server"] = "abc"
+        registry._next_tools["test_server"] = time.monotonic() + 300
+        cache.set("test_server.test_tool", "key", ToolCallResponse(success=True, result="ok", server_name=""))
+
+        await registry.update_servers(
+            [MCPServerConfig(name="test_server", url="http://localhost:3001")], probe=False
+        )
+
+        assert "test_server.test_tool" in registry.tools
+        assert registry.servers["test_server"].stale
+        assert "test_server" not in registry._tools_digests
+        assert registry._next_tools["test_server"] <= time.monotonic()
+        assert cache.get("key") is None
+
+    @pytest.mark.asyncio
+    async def test_retired_pool_closes_after_draining(self, monkeypatch):
+        """A pool no server uses stops being handed out and closes once its requests finish."""
+        pools = UpstreamPools()
+        client = pools.client_for(MCPServerConfig(name="a", url="http://mcp-1:7000"))
+        transport = pools._transports["http://mcp-1:7000 c20-k10-e30-h1"]
+        transport.in_flight = 1
+        monkeypatch.setattr(UpstreamPools, "DRAIN_POLL_INTERVAL", 0.01)
+
+        assert pools.retire_unused([MCPServerConfig(name="b", url="http://mcp-2:7000")]) == [
+            "http://mcp-1:7000 c20-k10-e30-h1"
+        ]
+        assert pools.stats() == []
+        await asyncio.sleep(0.05)
+        assert not client.is_closed
+
+        transport.in_flight = 0
+        await asyncio.sleep(0.05)
+        assert client.is_closed
+        await pools.aclose()
+
+    def test_reload_endpoint(self, monkeypatch, tmp_path):
+        """/admin/reload applies the file's server list and rejects an invalid file without changes."""
+        import app.main as main_module
+
+        config_path = tmp_path / "config.yaml"
+        config_path.write_text(
+            "hub:\n  admin_token: s3cret\n"
+            "rate_limit:\n  enabled: false\n"
+            "servers:\n  - name: test_server\n    url: http://localhost:3000\n"
+        )
+        registry = MCPRegistry()
+        add_online_server(registry)
+        add_online_server(registry, name="other")
+        monkeypatch.setattr(main_module, "CONFIG_PATH", config_path)
+        monkeypatch.setattr(main_module, "registry", registry, raising=False)
+        monkeypatch.setattr(main_module, "config", {"hub": {"admin_token": "s3cret"}})
+        monkeypatch.setattr(main_module, "_rate_limiter", None)
+        client = TestClient(app)
+        headers = {"Authorization": "Bearer s3cret"}
+
+        assert client.post("/admin/reload").status_code == 401
+        response = client.post("/admin/reload", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["removed"] == ["other"] and response.json()["unchanged"] == ["test_server"]
+        assert set(registry.servers) == {"test_server"}
+
+        config_path.write_text(config_path.read_text() + "  - name: test_server\n    url: http://localhost:3001\n")
+        response = client.post("/admin/reload", headers=headers)
+        assert response.status_code == 400
+        assert "duplicate" in response.json()["message"]
+        assert registry.servers["test_server"].config.url.port == 3000
+
+
+class TestRequestTiming:
+    """Tests for Server-Timing headers and the sampling profiler."""
+
+    def test_server_timing_breakdown(self, monkeypatch):
+        """With hub.server_timing each /call phase is reported; without it no header is sent."""
+        import app.main as main_module
+
+        registry = MCPRegistry()
+        add_online_server(registry)
+        router = MCPRouter(registry)
+        mock_upstream(router.pools).post.return_value = MagicMock(
+            status_code=200, json=MagicMock(return_value={"result": "ok"})
+        )
+        app.dependency_overrides[get_router] = lambda: router
+        monkeypatch.setattr(main_module, "config", {"hub": {"server_timing": True}})
+        monkeypatch.setattr(main_module, "_rate_limiter", None)
+        try:
+            client = TestClient(app)
+            response = client.post("/call", json={"tool": "test_server.test_tool"})
+            phases = {
+                entry.split(";")[0].strip(): float(entry.split("dur=")[1])
+                for entry in response.headers["Server-Timing"].split(",")
+            }
+            assert {"validate", "protect", "lookup", "queue", "upstream", "serialize", "total"} <= set(phases)
+            assert phases["total"] >= phases["upstream"]
+
+            monkeypatch.setattr(main_module, "config", {})
+            assert "Server-Timing" not in client.post("/call", json={"tool": "test_server.test_tool"}).headers
+        finally:
+            app.dependency_overrides.clear()
+
+    def test_profile_endpoint(self, monkeypatch):
+        """/admin/profile needs the admin token and returns collapsed stacks."""
+        import app.main as main_module
+
+        disable_rate_limit(monkeypatch)
+        client = TestClient(app)
+        assert client.get("/admin/profile?seconds=0.1").status_code == 404
+
+        monkeypatch.setattr(main_module, "config", {"hub": {"admin_token": "s3cret"}})
+        assert client.get("/admin/profile?seconds=0.1").status_code == 401
+
+        response = client.get(
+            "/admin/profile?seconds=0.2&interval_ms=2", headers={"Authorization": "Bearer s3cret"}
+        )
+        assert response.status_code == 200
+        assert int(response.headers["X-Profile-Samples"]) > 0
+        stack, count = response.text.splitlines()[0].rsplit(" ", 1)
+        assert int(count) > 0 and ";" in stack
+
+    def test_sampling_profiler_collapses_stacks(self):
+        """Samples of the same stack are counted together, outermost frame first."""
+        started = threading.Event()
+        stop = threading.Event()
+
+        def busy_worker():
+            started.set()
+            while not stop.is_set():
+                sum(range(1000))
+
+        thread = threading.Thread(target=busy_worker)
+        thread.start()
+        started.wait()
+        profiler = SamplingProfiler(thread.ident, interval=0.001)
+        profiler.run(0.1)
+        stop.set()
+        thread.join()
+
+        assert profiler.sample_count > 10
+        assert any(stack.endswith("busy_worker") for stack in profiler.samples)
+        assert profiler.collapsed().startswith(profiler.samples.most_common(1)[0][0])
+
+
+class TestToolResultCache:
+    """Tests for the tool result cache."""
+
+    def test_key_is_canonical(self):
+        """Argument order must not change the cache key."""
+        a = ToolResultCache.make_key("s.t", {"a": 1, "b": [1, 2]})
+        b = ToolResultCache.make_key("s.t", {"b": [1, 2], "a": 1})
+        assert a == b
+        assert a != ToolResultCache.make_key("s.t", {"a": 2, "b": [1, 2]})
+
+    def test_hit_miss_and_expiry(self, monkeypatch):
+        """Entries are served until their TTL elapses."""
+        now = [100.0]
+        monkeypatch.setattr("app.core.cache.time.monotonic", lambda: now[0])
+        cache = ToolResultCache(max_size=10, ttl=5)
+        key = cache.make_key("s.t", {})
+
+        assert cache.get(key) is None
+        cache.set("s.t", key, ToolCallResponse(success=True, result=1, server_name="s"))
+        hit = cache.get(key)
+        assert hit.result == 1 and hit.cached is True
+
+        now[0] += 6
+        assert cache.get(key) is None
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+        assert stats["expirations"] == 1
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted first."""
+        cache = ToolResultCache(max_size=2, ttl=60)
+        ok = ToolCallResponse(success=True, server_name="s")
+        cache.set("s.a", "a", ok)
+        cache.set("s.b", "b", ok)
+        cache.get("a")
+        cache.set("s.c", "c", ok)
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.stats()["evictions"] == 1
+
+    def test_failures_are_not_cached(self):
+        """Failed responses never enter the cache."""
+        cache = ToolResultCache()
+        cache.set("s.t", "k", ToolCallResponse(success=False, error="x", server_name="s"))
+        assert cache.get("k") is None
+
+    @pytest.mark.asyncio
+    async def test_router_serves_cacheable_tool_from_cache(self):
+        """Identical calls to a cacheable tool only reach the upstream once."""
+        registry = MCPRegistry()
+        add_online_server(registry, cacheable_tools=["test_*"])
+        router = MCPRouter(registry, cache=ToolResultCache())
+        router_upstream = mock_upstream(router.pools)
+        router_upstream.post.return_value = MagicMock(status_code=200)
+        router_upstream.post.return_value.json.return_value = {"result": 42}
+
+        request = ToolCallRequest(tool="test_server.test_tool", arguments={"x": 1})
+        first = await router.execute_tool(request)
+        second = await router.execute_tool(request)
+
+        assert first.cached is False
+        assert second.cached is True and second.result == 42
+        assert second.server_name == "test_server"
+        assert router_upstream.post.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_removed_tool_invalidates_cache(self):
+        """Tools that vanish from the catalog lose their cached results."""
+        registry = MCPRegistry()
+        add_online_server(registry, tools=("test_tool", "other"), cacheable_tools=["*"])
+        cache = ToolResultCache()
+        MCPRouter(registry, cache=cache)
+        key = cache.make_key("test_server.test_tool", {})
+        cache.set("test_server.test_tool", key, ToolCallResponse(success=True, server_name="test_server"))
+
+        registry_upstream = mock_upstream(registry.pools)
+        registry_upstream.get.return_value = upstream_response(json={"tools": [{"name": "other"}]})
+        await registry._refresh_server_tools("test_server")
+
+        assert cache.get(key) is None
+        assert cache.stats()["invalidations"] == 1
+
+
+class TestRequestCoalescing:
+    """Tests for single-flight deduplication of identical calls."""
+
+    @staticmethod
+    def slow_upstream(router, delay=0.05):
+        """Make the router's upstream answer after ``delay`` seconds."""
+        async def post(*args, **kwargs):
+            await asyncio.sleep(delay)
+            response = MagicMock(status_code=200)
+            response.json.return_value = {"result": kwargs["json"]["arguments"]}
+            return response
+
+        router_upstream = mock_upstream(router.pools)
+        router_upstream.post.side_effect = post
+        return router_upstream
+
+    @pytest.mark.asyncio
+    async def test_identical_idempotent_calls_share_upstream_request(self):
+        """Concurrent identical calls produce a single upstream POST."""
+        registry = MCPRegistry()
+        add_online_server(registry, idempotent_tools=["test_tool"])
+        router = MCPRouter(registry)
+        router_upstream = self.slow_upstream(router)
+
+        request = ToolCallRequest(tool="test_server.test_tool", arguments={"q": "x"})
+        responses = await asyncio.gather(*(router.execute_tool(request) for _ in range(5)))
+
+        assert all(r.success and r.result == {"q": "x"} for r in responses)
+        assert len({id(r) for r in responses}) == 5
+        assert router_upstream.post.call_count == 1
+        assert router.state.counter("coalesced_calls_total") == 4
+        assert router._inflight == {}
+
+    @pytest.mark.asyncio
+    async def test_shared_upstream_error_counts_one_failure(self):
+        """An exception from a shared call feeds the circuit breaker only once."""
+        registry = MCPRegistry()
+        add_online_server(registry, idempotent_tools=["test_tool"], circuit_breaker_failures=2)
+        router = MCPRouter(registry)
+
+        async def post(*args, **kwargs):
+            await asyncio.sleep(0.02)
+            response = MagicMock(status_code=200)
+            response.json.side_effect = ValueError("invalid json")
+            return response
+
+        router_upstream = mock_upstream(router.pools)
+        router_upstream.post.side_effect = post
+
+        request = ToolCallRequest(tool="test_server.test_tool")
+        responses = await asyncio.gather(*(router.execute_tool(request) for _ in range(3)))
+
+        assert all(r.error == "execution_failed" for r in responses)
+        assert router.state.failure_count("test_server") == 1
+        assert router.state.open_circuits() == {}
+
+    @pytest.mark.asyncio
+    async def test_different_arguments_and_non_idempotent_tools_not_shared(self):
+        """Only identical calls to idempotent tools are coalesced."""
+        registry = MCPRegistry()
+        add_online_server(registry, tools=("test_tool", "write"), idempotent_tools=["test_tool"])
+        router = MCPRouter(registry)
+        router_upstream = self.slow_upstream(router)
+
+        await asyncio.gather(
+            router.execute_tool(ToolCallRequest(tool="test_server.test_tool", arguments={"q": 1})),
+            router.execute_tool(ToolCallRequest(tool="test_server.test_tool", arguments={"q": 2})),
+            router.execute_tool(ToolCallRequest(tool="test_server.write", arguments={})),
+            router.execute_tool(ToolCallRequest(tool="test_server.write", arguments={})),
+        )
+
+        assert router_upstream.post.call_count == 4
+        assert router.state.counter("coalesced_calls_total") == 0
+
+
+class TestBatchCalls:
+    """Tests for concurrent batch execution."""
+
+    @pytest.fixture
+    def router(self):
+        """Router with two servers whose upstream records peak concurrency."""
+        registry = MCPRegistry()
+        add_online_server(registry, name="slow", tools=("a",), batch_concurrency=2)
+        add_online_server(registry, name="fast", tools=("b",))
+        router = MCPRouter(registry)
+        router.active = 0
+        router.peak = 0
+
+        async def post(url, **kwargs):
+            router.active += 1
+            router.peak = max(router.peak, router.active)
+            await asyncio.sleep(0.02 if "slow" in kwargs["json"]["arguments"] else 0)
+            router.active -= 1
+            response = MagicMock(status_code=200)
+            response.json.return_value = {"result": kwargs["json"]["arguments"]}
+            return response
+
+        router_upstream = mock_upstream(router.pools)
+        router_upstream.post.side_effect = post
+        return router
+
+    @pytest.mark.asyncio
+    async def test_results_in_order_with_partial_failure(self, router):
+        """Results follow request order and failures are reported per item."""
+        calls = [
+            ToolCallRequest(tool="slow.a", arguments={"slow": 1}),
+            ToolCallRequest(tool="missing.tool", arguments={}),
+            ToolCallRequest(tool="fast.b", arguments={"n": 2}),
+        ]
+
+        results = await router.execute_batch(calls)
+
+        assert [r.success for r in results] == [True, False, True]
+        assert results[0].result == {"slow": 1}
+        assert results[1].error == "tool_not_found"
+        assert results[2].server_name == "fast"
+
+    @pytest.mark.asyncio
+    async def test_per_server_concurrency_cap(self, router):
+        """No more than batch_concurrency calls hit one server at a time."""
+        calls = [ToolCallRequest(tool="slow.a", arguments={"slow": i}) for i in range(6)]
+
+        results = await router.execute_batch(calls)
+
+        assert all(r.success for r in results)
+        assert router.peak == 2
+
+    def test_batch_endpoint(self, router):
+        """The endpoint returns ordered results and streams NDJSON on demand."""
+        app.dependency_overrides[get_router] = lambda: router
+        try:
+            client = TestClient(app)
+            body = {"calls": [
+                {"tool": "slow.a", "arguments": {"slow": 1}},
+                {"tool": "fast.b", "arguments": {"n": 2}},
+            ]}
+            data = client.post("/call/batch", json=body).json()
+            assert data["success_count"] == 2
+            assert [r["server_name"] for r in data["results"]] == ["slow", "fast"]
+
+            streamed = client.post("/call/batch?stream=true", json=body)
+            lines = [json.loads(line) for line in streamed.text.splitlines()]
+            assert [line["index"] for line in lines] == [1, 0]
+        finally:
+            app.dependency_overrides.clear()
+
+    def test_batch_is_charged_per_call(self, router, monkeypatch):
+        """Every call in a batch consumes a rate limit token."""
+        import app.main as main_module
+
+        monkeypatch.setattr(main_module, "config", {
+            "rate_limit": {"enabled": True, "requests_per_minute": 60, "burst_size": 3},
+        })
+        monkeypatch.setattr(main_module, "_rate_limiter", None)
+        app.dependency_overrides[get_router] = lambda: router
+        try:
+            client = TestClient(app)
+            body = {"calls": [{"tool": "fast.b", "arguments": {"n": i}} for i in range(3)]}
+            assert client.post("/call/batch", json=body).status_code == 200
+            assert client.post("/call", json=body["calls"][0]).status_code == 429
+        finally:
+            app.dependency_overrides.clear()
+
+
+class TestStreamingCalls:
+    """Tests for streamed tool calls."""
+
+    @staticmethod
+    def router_with(handler):
+        """Router whose upstream is an httpx MockTransport running ``handler``."""
+        registry = MCPRegistry()
+        add_online_server(registry)
+        router = MCPRouter(registry)
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        router.pools.client_for = MagicMock(return_value=client)
+        return router
+
+    @pytest.mark.asyncio
+    async def test_body_forwarded_in_envelope(self):
+        """The upstream body is forwarded chunk by chunk inside the hub envelope."""
+        async def chunks():
+            yield b'{"result": ['
+            for i in range(1000):
+                yield b"%d," % i
+            yield b"1000]}"
+
+        router = self.router_with(lambda request: httpx.Response(200, content=chunks()))
+        response, body = await router.open_stream(ToolCallRequest(tool="test_server.test_tool"))
+        assert response.success is True
+
+        parts = [chunk async for chunk in body]
+        assert len(parts) > 1000
+        data = json.loads(b"".join(parts))
+        assert data["success"] is True
+        assert data["server_name"] == "test_server"
+        assert data["upstream"]["result"] == list(range(1001))
+        assert data["execution_time_ms"] >= 0
+
+    @pytest.mark.asyncio
+    async def test_upstream_error_is_not_streamed(self):
+        """A non-200 upstream answer becomes a regular failed response and counts as a failure."""
+        router = self.router_with(lambda request: httpx.Response(502, content=b"bad gateway"))
+        response, body = await router.open_stream(ToolCallRequest(tool="test_server.test_tool"))
+
+        assert body is None
+        assert response.success is False
+        assert response.error == "http_error_502"
+        assert router.state.failure_count("test_server") == 1
+
+    def test_stream_endpoint(self, monkeypatch):
+        """POST /call/stream returns the streamed envelope."""
+        disable_rate_limit(monkeypatch)
+        router = self.router_with(lambda request: httpx.Response(200, json={"result": "big"}))
+        app.dependency_overrides[get_router] = lambda: router
+        try:
+            response = TestClient(app).post("/call/stream", json={"tool": "test_server.test_tool"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.json()["upstream"] == {"result": "big"}
+
+
+class TestTokenBucketLimiter:
+    """Tests for the token bucket rate limiter."""
+
+    def test_burst_then_refill(self):
+        """A full bucket allows burst_size calls, then refills at the per-minute rate."""
+        limiter = TokenBucketLimiter(requests_per_minute=60, burst_size=3)
+
+        assert [limiter.acquire("ip:a", now=0).allowed for _ in range(4)] == [True, True, True, False]
+        denied = limiter.acquire("ip:a", now=0.5)
+        assert not denied.allowed
+        assert denied.retry_after == pytest.approx(0.5)
+        assert limiter.acquire("ip:a", now=1.0).allowed
+        assert limiter.acquire("ip:b", now=1.0).allowed
+
+    def test_cost_above_capacity_leaves_debt(self):
+        """A request costing more than the bucket is charged in full."""
+        limiter = TokenBucketLimiter(requests_per_minute=60, burst_size=5)
+
+        assert limiter.acquire("k", now=0, cost=20).allowed
+        denied = limiter.acquire("k", now=10)
+        assert not denied.allowed
+        assert denied.retry_after == pytest.approx(6)
+        assert limiter.acquire("k", now=16).allowed
+
+    def test_headers(self):
+        """Denied decisions carry Retry-After and X-RateLimit-* headers."""
+        limiter = TokenBucketLimiter(requests_per_minute=30, burst_size=1)
+        assert limiter.acquire("k", now=0).headers()["X-RateLimit-Remaining"] == "0"
+
+        headers = limiter.acquire("k", now=0).headers()
+        assert headers["Retry-After"] == "2"
+        assert headers["X-RateLimit-Limit"] == "1"
+
+    def test_key_table_is_bounded(self):
+        """Idle keys are evicted and the table never exceeds max_keys."""
+        limiter = TokenBucketLimiter(requests_per_minute=60, burst_size=2, max_keys=3)
+        for i in range(10):
+            limiter.acquire(f"ip:{i}", now=0)
+        assert len(limiter) == 3
+
+        limiter.acquire("ip:new", now=10)
+        assert len(limiter) == 1
+
+    def test_endpoint_returns_429_with_headers(self, monkeypatch):
+        """Requests over the limit get 429 with rate limit headers, keyed by API key."""
+        import app.main as main_module
+
+        monkeypatch.setattr(main_module, "config", {
+            "hub": {"api_key": "secret"},
+            "rate_limit": {"enabled": True, "requests_per_minute": 60, "burst_size": 2, "key_by": "api_key"},
+        })
+        monkeypatch.setattr(main_module, "_rate_limiter", None)
+        client = TestClient(app)
+
+        codes = [client.get("/health", headers={"x-api-key": "secret"}).status_code for _ in range(3)]
+        assert codes == [200, 200, 429]
+        denied = client.get("/health", headers={"x-api-key": "secret"})
+        assert denied.headers["Retry-After"] == "1"
+        assert denied.headers["X-RateLimit-Limit"] == "2"
+
+    def test_unvalidated_credentials_fall_back_to_ip(self, monkeypatch):
+        """Rotating an unchecked header value does not yield fresh buckets."""
+        import app.main as main_module
+
+        monkeypatch.setattr(main_module, "config", {
+            "hub": {"bearer_token": "tok"},
+            "rate_limit": {"enabled": True, "requests_per_minute": 60, "burst_size": 2, "key_by": "api_key"},
+        })
+        monkeypatch.setattr(main_module, "_rate_limiter", None)
+        client = TestClient(app)
+
+        codes = [
+            client.get("/health", headers={"authorization": "Bearer tok", "x-api-key": str(i)}).status_code
+            for i in range(3)
+        ]
+        assert codes == [200, 200, 429]
+        assert len(main_module._rate_limiter) == 1
+
+
+class FakeRedisServer:
+    """Local Redis stand-in speaking RESP2 with the commands the hub uses."""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return f"redis://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/0"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                count = int((await reader.readline())[1:])
+                args = []
+                for _ in range(count):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2].decode())
+                self.commands.append(args[0].upper())
+                writer.write(self._execute(args[0].upper(), args[1:]))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ValueError, ConnectionError):
+            writer.close()
+
+    def _execute(self, command, args):
+        if command in ("PING", "SELECT", "AUTH", "EXPIRE"):
+            return b"+OK\r\n" if command != "EXPIRE" else b":1\r\n"
+        if command == "INCRBY":
+            self.data[args[0]] = int(self.data.get(args[0], 0)) + int(args[1])
+            return b":%d\r\n" % self.data[args[0]]
+        table = self.data.setdefault(args[0], {})
+        if command == "HINCRBY":
+            table[args[1]] = int(table.get(args[1], 0)) + int(args[2])
+            return b":%d\r\n" % table[args[1]]
+        if command == "HSET":
+            table[args[1]] = args[2]
+            return b":1\r\n"
+        if command == "HDEL":
+            return b":%d\r\n" % (table.pop(args[1], None) is not None)
+        if command == "HGETALL":
+            items = [str(v).encode() for pair in table.items() for v in pair]
+            return b"*%d\r\n" % len(items) + b"".join(b"$%d\r\n%s\r\n" % (len(i), i) for i in items)
+        return b"-ERR unknown command\r\n"
+
+
+class TestStateBackend:
+    """Tests for in-memory and Redis-protocol shared state."""
+
+    @pytest.fixture
+    async def redis_url(self):
+        """Start a Redis stand-in for the duration of a test."""
+        server = FakeRedisServer()
+        url = await server.start()
+        yield url
+        await server.stop()
+
+    def test_memory_backend(self):
+        """The default backend keeps counters and circuits in process."""
+        state = StateBackend()
+        state.incr("calls", 2)
+        state.open_circuit("s", time.time() + 30)
+        assert state.counter("calls") == 2
+        assert list(state.open_circuits()) == ["s"]
+        assert state.allow_rate("ip:a", 1) == (True, 0.0)
+        state.close_circuit("s")
+        assert state.open_circuits() == {}
+
+    @pytest.mark.asyncio
+    async def test_workers_share_counters_and_circuits(self, redis_url):
+        """Two backends converge on the same counters and open circuits after a sync."""
+        a = RedisStateBackend(redis_url)
+        b = RedisStateBackend(redis_url)
+        a.incr("call_requests_total", 3)
+        b.incr("call_requests_total", 2)
+        a.open_circuit("slow", time.time() + 30)
+
+        await a.sync()
+        await b.sync()
+        await a.sync()
+
+        assert a.counter("call_requests_total") == 5
+        assert b.counter("call_requests_total") == 5
+        assert b.circuit_open_until("slow") > time.time()
+
+        a.record_failure("slow")
+        b.record_failure("slow")
+        await a.sync()
+        await b.sync()
+        assert b.failure_count("slow") == 2
+        b.reset_failures("slow")
+        b.close_circuit("slow")
+        await b.sync()
+        await a.sync()
+        assert a.open_circuits() == {}
+        assert a.failure_count("slow") == 0
+        await a.close()
+        await b.close()
+
+    @pytest.mark.asyncio
+    async def test_rate_quota_is_global(self, redis_url):
+        """Once workers have synced, the per-minute quota applies to their sum."""
+        a = RedisStateBackend(redis_url)
+        b = RedisStateBackend(redis_url)
+
+        assert all(a.allow_rate("ip:x", 4)[0] for _ in range(3))
+        await a.sync()
+        await b.sync()
+        assert b.allow_rate("ip:x", 4)[0] is True
+        await b.sync()
+        assert b.allow_rate("ip:x", 4)[0] is False
+        await a.close()
+        await b.close()
+
+    @pytest.mark.asyncio
+    async def test_unreachable_server_keeps_local_state(self):
+        """Without a server the backend keeps deltas locally and retries later."""
+        state = RedisStateBackend("redis://127.0.0.1:1/0")
+        state.incr("calls")
+        with pytest.raises(OSError):
+            await state.sync()
+        assert state.counter("calls") == 1
+        assert state.allow_rate("ip:a", 1)[0] is True
+
+    @pytest.mark.asyncio
+    async def test_router_circuit_uses_state(self):
+        """Circuits opened by the router live in the state backend."""
+        registry = MCPRegistry()
+        add_online_server(registry, circuit_breaker_failures=1)
+        state = StateBackend()
+        router = MCPRouter(registry, state=state)
+        router_upstream = mock_upstream(router.pools)
+        router_upstream.post.return_value = MagicMock(status_code=500)
+
+        request = ToolCallRequest(tool="test_server.test_tool")
+        assert (await router.execute_tool(request)).error == "http_error_500"
+        assert (await router.execute_tool(request)).error == "circuit_open"
+        assert "test_server" in state.open_circuits()
+
+
+class FakeMCPServer:
+    """In-process MCP server behind an httpx.MockTransport (streamable HTTP or the legacy SSE transport)."""
+
+    def __init__(self, tools=("echo",), transport="streamable_http", list_changed=True):
+        self.tools = list(tools)
+        self.transport = transport
+        self.list_changed = list_changed
+        self.delays = {}
+        self.sessions = set()
+        self.initialized = 0
+        self.methods = []
+        self.events = asyncio.Queue()
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    def notify(self, method):
+        self.events.put_nowait({"jsonrpc": "2.0", "method": method})
+
+    async def handle(self, request):
+        if request.method == "GET":
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=self._stream())
+        if request.method == "DELETE":
+            self.sessions.discard(request.headers.get("mcp-session-id"))
+            return httpx.Response(200)
+        message = json.loads(request.content)
+        self.methods.append(message.get("method"))
+        if (
+            self.transport == "streamable_http"
+            and message.get("method") != "initialize"
+            and request.headers.get("mcp-session-id") not in self.sessions
+        ):
+            return httpx.Response(404)
+        if "id" not in message or "method" not in message:
+            return httpx.Response(202)
+        if self.transport == "sse":
+            # o SSE antigo responde pelo stream de eventos
+            asyncio.create_task(self._answer_on_stream(message))
+            return httpx.Response(202)
+        answer = await self._answer(message)
+        headers = {"content-type": "text/event-stream"}
+        if message["method"] == "initialize":
+            session_id = f"session-{self.initialized}"
+            self.sessions.add(session_id)
+            headers["mcp-session-id"] = session_id
+        if message["method"] != "tools/call":
+            return httpx.Response(200, json=answer, headers={k: v for k, v in headers.items() if k != "content-type"})
+        return httpx.Response(200, headers=headers, content=f"event: message\ndata: {json.dumps(answer)}\n\n".encode())
+
+    async def _answer_on_stream(self, message):
+        self.events.put_nowait(await self._answer(message))
+
+    async def _answer(self, message):
+        method, params = message["method"], message.get("params") or {}
+        result = {}
+        if method == "initialize":
+            self.initialized += 1
+            result = {
+                "protocolVersion": "2025-06-18",
+                "capabilities": {"tools": {"listChanged": self.list_changed}},
+                "serverInfo": {"name": "fake", "version": "1"},
+            }
+        elif method == "tools/list":
+            # uma ferramenta por página, para exercitar a paginação
+            index = int(params.get("cursor", 0))
+            result = {"tools": [{"name": self.tools[index], "inputSchema": {"type": "object"}}]}
+            if index + 1 < len(self.tools):
+                result["nextCursor"] = str(index + 1)
+        elif method == "tools/call":
+            if params["name"] not in self.tools:
+                return {"jsonrpc": "2.0", "id": message["id"], "error": {"code": -32602, "message": "unknown tool"}}
+            await asyncio.sleep(self.delays.get(params["name"], 0))
+            result = {
+                "content": [{"type": "text", "text": json.dumps(params["arguments"])}],
+                "isError": params["name"] == "fail",
+            }
+        return {"jsonrpc": "2.0", "id": message["id"], "result": result}
+
+    async def _stream(self):
+        if self.transport == "sse":
+            yield b"event: endpoint\ndata: /messages?session=1\n\n"
+        while True:
+            message = await self.events.get()
+            yield f"event: message\ndata: {json.dumps(message)}\n\n".encode()
+
+
+class TestNativeMCPTransport:
+    """Tests for upstreams spoken to with MCP JSON-RPC over a persistent session."""
+
+    async def registry_with(self, server, **config):
+        registry = MCPRegistry()
+        registry.pools.client_for = MagicMock(return_value=server.client())
+        await registry.register_server(MCPServerConfig(
+            name="mcp", url="http://mcp-1:7000/mcp", transport=server.transport, **config
+        ))
+        return registry
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_session(self):
+        """One initialize serves every call; answers reach their callers by JSON-RPC id."""
+        server = FakeMCPServer(tools=("slow", "fast"))
+        server.delays["slow"] = 0.05
+        registry = await self.registry_with(server)
+        router = MCPRouter(registry)
+
+        assert set(registry.tools) == {"mcp.slow", "mcp.fast"}
+        assert registry.tools["mcp.slow"].parameters == {"type": "object"}
+        slow, fast = await asyncio.gather(
+            router.execute_tool(ToolCallRequest(tool="mcp.slow", arguments={"n": 1})),
+            router.execute_tool(ToolCallRequest(tool="mcp.fast", arguments={"n": 2})),
+        )
+        assert slow.success and slow.result["content"][0]["text"] == '{"n": 1}'
+        assert fast.success and fast.result["content"][0]["text"] == '{"n": 2}'
+        assert server.initialized == 1
+        assert server.methods.count("tools/list") == 2  # duas páginas
+        # o servidor avisa mudanças: o catálogo não é mais consultado periodicamente
+        assert registry._next_tools["mcp"] == float("inf")
+        await registry.shutdown()
+        assert not server.sessions
+
+    @pytest.mark.asyncio
+    async def test_list_changed_notification_refreshes_catalog(self):
+        """A tools/list_changed notification relists the tools right away."""
+        server = FakeMCPServer(tools=("echo",))
+        registry = await self.registry_with(server)
+        await registry.start_background_refresh()
+
+        server.tools.append("added")
+        server.notify("notifications/tools/list_changed")
+        for _ in range(100):
+            if "mcp.added" in registry.tools:
+                break
+            await asyncio.sleep(0.01)
+        assert "mcp.added" in registry.tools
+        await registry.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_expired_session_is_reinitialized(self):
+        """A 404 for the session initializes a new one and the call goes through."""
+        server = FakeMCPServer()
+        registry = await self.registry_with(server)
+        router = MCPRouter(registry)
+        server.sessions.clear()
+
+        response = await router.execute_tool(ToolCallRequest(tool="mcp.echo", arguments={}))
+        assert response.success
+        assert server.initialized == 2
+        await registry.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_tool_errors_do_not_count_against_server(self):
+        """isError answers fail with tool_error but keep the circuit closed; JSON-RPC errors map to mcp_error_<code>."""
+        server = FakeMCPServer(tools=("echo", "fail"))
+        registry = await self.registry_with(server)
+        router = MCPRouter(registry)
+
+        response = await router.execute_tool(ToolCallRequest(tool="mcp.fail", arguments={}))
+        assert response.error == "tool_error" and response.result["isError"]
+        assert router.state.failure_count("mcp") == 0
+
+        server.tools.remove("echo")
+        response = await router.execute_tool(ToolCallRequest(tool="mcp.echo", arguments={}))
+        assert response.error == "mcp_error_-32602"
+        await registry.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_legacy_sse_transport(self):
+        """With the SSE transport, requests are POSTed to the announced endpoint and answered on the stream."""
+        server = FakeMCPServer(tools=("echo",), transport="sse")
+        registry = await self.registry_with(server)
+        router = MCPRouter(registry)
+
+        assert registry.servers["mcp"].status == ServerStatus.ONLINE
+        response = await router.execute_tool(ToolCallRequest(tool="mcp.echo", arguments={"a": 1}))
+        assert response.success and response.result["content"][0]["text"] == '{"a": 1}'
+        assert registry.sessions.stats()["mcp"][0]["watches_tools"]
+        await registry.shutdown()
+
+
+class TestUpstreamPools:
+    """Tests for per-upstream connection pools."""
+
+    @pytest.mark.asyncio
+    async def test_pool_per_origin(self):
+        """Servers on the same host share a client; other hosts get their own."""
+        pools = UpstreamPools()
+        a = MCPServerConfig(name="a", url="http://mcp-1:7000", max_connections=4)
+        b = MCPServerConfig(name="b", url="http://mcp-1:7000/other")
+        c = MCPServerConfig(name="c", url="http://mcp-2:7000")
+
+        d = MCPServerConfig(name="d", url="http://mcp-1:7000", max_connections=4)
+
+        assert pools.client_for(a) is pools.client_for(d)
+        assert pools.client_for(a) is not pools.client_for(b)
+        assert pools.client_for(a) is not pools.client_for(c)
+        stats = pools.stats()
+        assert len(stats) == 3
+        assert sorted(p["max_connections"] for p in stats if p["pool"] == "http://mcp-1:7000") == [4, 20]
+        await pools.aclose()
+
+    @pytest.mark.asyncio
+    async def test_metered_transport_tracks_waits(self):
+        """Requests beyond the pool size wait and slots are released on close."""
+        async def handler(request):
+            await asyncio.sleep(0.02)
+            return httpx.Response(200, json={"ok": True})
+
+        transport = MeteredTransport(httpx.MockTransport(handler), max_connections=1)
+        async with httpx.AsyncClient(transport=transport) as client:
+            responses = await asyncio.wait_for(
+                asyncio.gather(*(client.get("http://mcp/health") for _ in range(3))), timeout=5
+            )
+
+        assert all(r.status_code == 200 for r in responses)
+        assert transport.requests_total == 3
+        assert transport.in_flight == 0
+        assert transport.max_wait_seconds >= 0.02
+
+    def test_pool_metrics_in_prometheus(self, monkeypatch):
+        """Pool gauges are exported with a pool label."""
+        import app.main as main_module
+
+        registry = MCPRegistry()
+        registry.pools.client_for(MCPServerConfig(name="a", url="http://mcp-1:7000"))
+        monkeypatch.setattr(main_module, "registry", registry, raising=False)
+
+        body = TestClient(app).get("/metrics/prometheus").text
+        assert 'mcp_one_pool_max_connections{pool="http://mcp-1:7000",profile="c20-k10-e30-h1"} 20' in body
+        assert body.startswith("# HELP")
+
+
 class TestFastAPIEndpoints:
     """Tests for FastAPI endpoints."""
     